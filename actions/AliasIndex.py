@@ -0,0 +1,149 @@
+from types_consts import NEGATIVE_ALIAS_TTL, PlaceId, LocationAliasDefinition, NegativeLocationAliasDefinition
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_alias(alias: str) -> str:
+    """Normalize a location string so that trivial casing and spacing differences share a key."""
+    return _WHITESPACE.sub(" ", alias).strip().casefold()
+
+
+class AliasIndex:
+    """In-memory index over the location alias cache, keyed by normalized alias.
+
+    Lookups are O(1). Aliases are scoped by `geo_boundary_hash` when one is provided,
+    and aliases added during the run are tracked so they can be persisted at the end.
+    Negative entries remember location strings that geocoded to nothing usable, and
+    expire after `negative_ttl`.
+
+    Aliases recorded with a canonical address key (see address_normalizer) are also indexed
+    by it, so a differently written string for the same address matches when its exact
+    string doesn't. `canonical_hits` counts those matches."""
+
+    def __init__(
+        self,
+        aliases: Iterable[LocationAliasDefinition] = (),
+        negative_aliases: Iterable[NegativeLocationAliasDefinition] = (),
+        negative_ttl: timedelta = NEGATIVE_ALIAS_TTL,
+    ):
+        self._scoped: Dict[Tuple[str, Optional[str]], PlaceId] = {}
+        self._any_scope: Dict[str, PlaceId] = {}
+        self._negative: Dict[Tuple[str, Optional[str]], NegativeLocationAliasDefinition] = {}
+        self._canonical_scoped: Dict[Tuple[str, Optional[str]], PlaceId] = {}
+        self._canonical_any_scope: Dict[str, PlaceId] = {}
+        self._canonical_negative: Dict[Tuple[str, Optional[str]], NegativeLocationAliasDefinition] = {}
+        self.canonical_hits = 0
+        self.negative_ttl = negative_ttl
+        self.new_aliases: List[LocationAliasDefinition] = []
+        self.negative_aliases_changed = False
+        for alias in aliases:
+            self._index(alias)
+        for negative_alias in negative_aliases:
+            if self._is_fresh(negative_alias):
+                self._index_negative(negative_alias)
+            else:
+                self.negative_aliases_changed = True
+
+    def __len__(self) -> int:
+        return len(self._scoped)
+
+    def _index(self, alias: LocationAliasDefinition) -> None:
+        key = normalize_alias(alias["alias"])
+        scope = alias.get("geo_boundary_hash")
+        self._scoped.setdefault((key, scope), alias["place_id"])
+        # First match wins, as it did with the linear scan.
+        self._any_scope.setdefault(key, alias["place_id"])
+        canonical_key = alias.get("canonical_key")
+        if canonical_key:
+            self._canonical_scoped.setdefault((canonical_key, scope), alias["place_id"])
+            self._canonical_any_scope.setdefault(canonical_key, alias["place_id"])
+
+    def _index_negative(self, negative_alias: NegativeLocationAliasDefinition) -> None:
+        scope = negative_alias.get("geo_boundary_hash")
+        self._negative[(normalize_alias(negative_alias["alias"]), scope)] = negative_alias
+        canonical_key = negative_alias.get("canonical_key")
+        if canonical_key:
+            self._canonical_negative[(canonical_key, scope)] = negative_alias
+
+    def _is_fresh(self, negative_alias: NegativeLocationAliasDefinition) -> bool:
+        try:
+            cached_at = datetime.fromisoformat(negative_alias["cached_at"])
+        except (KeyError, ValueError):
+            return False
+        return datetime.now(timezone.utc) - cached_at < self.negative_ttl
+
+    @staticmethod
+    def _lookup_in(scoped: Dict[Tuple[str, Optional[str]], PlaceId], any_scope: Dict[str, PlaceId], key: str, geo_boundary_hash: Optional[str]) -> PlaceId | None:
+        if geo_boundary_hash is None:
+            return any_scope.get(key)
+        return scoped.get((key, geo_boundary_hash)) or scoped.get((key, None))
+
+    def lookup(self, alias: str, geo_boundary_hash: Optional[str] = None, canonical_key: Optional[str] = None) -> PlaceId | None:
+        """Get the place_id for an alias, or else for its canonical address key.
+
+        With a `geo_boundary_hash`, only aliases recorded for that boundary (or for no boundary)
+        match. Without one, an alias recorded under any boundary matches."""
+        place_id = self._lookup_in(self._scoped, self._any_scope, normalize_alias(alias), geo_boundary_hash)
+        if place_id or not canonical_key:
+            return place_id
+        place_id = self._lookup_in(self._canonical_scoped, self._canonical_any_scope, canonical_key, geo_boundary_hash)
+        if place_id:
+            self.canonical_hits += 1
+        return place_id
+
+    def _lookup_negative_in(self, negatives: Dict[Tuple[str, Optional[str]], NegativeLocationAliasDefinition], key: Tuple[str, Optional[str]]) -> str | None:
+        negative_alias = negatives.get(key)
+        if not negative_alias:
+            return None
+        if not self._is_fresh(negative_alias):
+            del negatives[key]
+            self.negative_aliases_changed = True
+            return None
+        return negative_alias["reason"]
+
+    def lookup_negative(self, alias: str, geo_boundary_hash: Optional[str] = None, canonical_key: Optional[str] = None) -> str | None:
+        """Get the reason an alias, or else its canonical address key, previously failed to geocode
+        within this boundary, unless that has expired."""
+        reason = self._lookup_negative_in(self._negative, (normalize_alias(alias), geo_boundary_hash))
+        if reason or not canonical_key:
+            return reason
+        return self._lookup_negative_in(self._canonical_negative, (canonical_key, geo_boundary_hash))
+
+    def add(self, alias: str, place_id: PlaceId, geo_boundary_hash: Optional[str] = None, canonical_key: Optional[str] = None) -> None:
+        """Add an alias found during this run. Aliases already in the index are ignored."""
+        if (normalize_alias(alias), geo_boundary_hash) in self._scoped:
+            return
+        definition: LocationAliasDefinition = {
+            "alias": alias,
+            "place_id": place_id,
+            "geo_boundary_hash": geo_boundary_hash,
+        }
+        if canonical_key:
+            definition["canonical_key"] = canonical_key
+        self._index(definition)
+        self.new_aliases.append(definition)
+
+    def add_negative(self, alias: str, reason: str, geo_boundary_hash: Optional[str] = None, canonical_key: Optional[str] = None) -> None:
+        """Remember that an alias failed to geocode within this boundary, so it is skipped until the TTL passes."""
+        negative_alias: NegativeLocationAliasDefinition = {
+            "alias": alias,
+            "geo_boundary_hash": geo_boundary_hash,
+            "reason": reason,
+            "cached_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if canonical_key:
+            negative_alias["canonical_key"] = canonical_key
+        self._index_negative(negative_alias)
+        self.negative_aliases_changed = True
+
+    def canonical_keys(self) -> Iterable[Tuple[str, PlaceId]]:
+        """Get each canonical address key recorded with an alias and its place_id."""
+        return self._canonical_any_scope.items()
+
+    def negative_aliases(self) -> List[NegativeLocationAliasDefinition]:
+        """Get the unexpired negative aliases, for saving back to the cache."""
+        return [negative_alias for negative_alias in self._negative.values() if self._is_fresh(negative_alias)]
@@ -0,0 +1,86 @@
+from RunMetrics import RunMetrics
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import asyncio
+
+import aiohttp
+from newspaper import Article, Config # type: ignore
+
+SCRAPE_MAX_CONCURRENCY = 16
+SCRAPE_MAX_PER_DOMAIN = 2
+SCRAPE_TIMEOUT = 30.0
+
+
+def extract_article_text(url: str, html: str) -> str:
+    """Extract the article text from downloaded HTML. Runs in a worker process."""
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    return article.text
+
+
+class ArticleScraper:
+    """Scrapes full article text: downloads concurrently over one pooled aiohttp session, then
+    extracts text with newspaper in a process pool so parsing doesn't block the event loop.
+
+    At most `max_concurrency` downloads run at once, and at most `max_per_domain` per host.
+    Each article is given up on after `timeout` seconds. Download and parse times, bytes
+    downloaded and failures are recorded in `metrics`. Use as an async context manager."""
+
+    def __init__(
+        self,
+        max_concurrency: int = SCRAPE_MAX_CONCURRENCY,
+        max_per_domain: int = SCRAPE_MAX_PER_DOMAIN,
+        timeout: float = SCRAPE_TIMEOUT,
+        max_workers: Optional[int] = None,
+        metrics: Optional[RunMetrics] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_per_domain = max_per_domain
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.metrics = metrics or RunMetrics()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def __aenter__(self) -> "ArticleScraper":
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.max_per_domain)
+        headers = {"User-Agent": Config().browser_user_agent}
+        self._session = aiohttp.ClientSession(connector=connector, headers=headers)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        if self._session:
+            await self._session.close()
+            self._session = None
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _scrape(self, url: str) -> str:
+        if not self._session or not self._executor:
+            raise RuntimeError("ArticleScraper must be used as an async context manager")
+        with self.metrics.call("article_download"):
+            async with self._session.get(url) as response:
+                response.raise_for_status()
+                self.metrics.add_bytes("article_download", len(await response.read()))
+                html = await response.text(errors="replace")
+        with self.metrics.call("article_parse"):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, extract_article_text, url, html)
+
+    async def scrape(self, url: Optional[str]) -> str:
+        """Get the full text of an article, or an empty string if it couldn't be scraped in time."""
+        if not url:
+            return ""
+
+        try:
+            return await asyncio.wait_for(self._scrape(url), self.timeout)
+        except asyncio.TimeoutError:
+            self.metrics.add_error("article_download")
+            print(f"    (Error: timed out scraping {url})")
+            return ""
+        except Exception as e:
+            print(f"    (Error: {e})")
+            return ""
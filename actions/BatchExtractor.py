@@ -0,0 +1,226 @@
+from CacheManager import CacheManager
+from ExtractionCache import ExtractionCache
+from LocationExtractor import EXTRACTION_MODEL, SYSTEM_PROMPT
+from RunMetrics import RunMetrics
+from types_consts import BatchJobDefinition, FeedItem, LLMConstrainedOutput
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+import json
+
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+REQUESTS_FILE = "requests.jsonl"
+RESPONSES_FILE = "responses.jsonl"
+ARTICLES_FILE = "articles.json"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_DONE_STATUSES = ("completed", "failed", "expired", "cancelled")
+"""Batch API statuses after which a batch's output, if any, won't change."""
+
+
+def strict_json_schema(schema: Any) -> Any:
+    """Make a Pydantic JSON schema strict, as structured outputs require: every object allows no
+    other properties and requires all of its own."""
+    if isinstance(schema, list):
+        return [strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    schema = {key: strict_json_schema(value) for key, value in schema.items()}
+    if schema.get("type") == "object":
+        schema["additionalProperties"] = False
+        schema["required"] = list(schema.get("properties", {}))
+    return schema
+
+
+def response_format(model: Type[BaseModel]) -> dict:
+    """Get the structured output `response_format` of a chat completion request body for a model."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__, "schema": strict_json_schema(model.model_json_schema()), "strict": True},
+    }
+
+
+class BatchExtractor:
+    """Deferred location extraction for backlogs, through JSONL request and response files in the
+    format of the OpenAI Batch API.
+
+    `create_job` writes one chat completion request per article text not in the extraction cache,
+    with its extraction cache key as the `custom_id`, and keeps the scraped articles next to it,
+    each with the key of its request as `extraction_key`.
+    The requests can be submitted to the Batch API with `submit_job`, or the responses file filled
+    in by anything else that writes the same format. A later run calls `ingest_jobs`, which puts
+    the results in the extraction cache and returns each job's articles to extract, geocode and
+    write as usual, then `finish_job` with those that were written. Their results are looked up
+    by `extraction_key`, so they are found even if the text extracted from differs by then. Articles without a usable response
+    are then extracted interactively, as are all the articles of a job whose batch ended without
+    output. Job state is kept in the cache directory."""
+
+    def __init__(
+        self,
+        cache_mgr: CacheManager,
+        model: str = EXTRACTION_MODEL,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        metrics: Optional[RunMetrics] = None,
+    ):
+        self.cache_mgr = cache_mgr
+        self.model = model
+        self.metrics = metrics or RunMetrics()
+        self.jobs: Dict[str, BatchJobDefinition] = cache_mgr.load_batch_jobs()
+        self._api_key = api_key
+        self._base_url = base_url
+
+    def _client(self) -> AsyncOpenAI:
+        return AsyncOpenAI(api_key=self._api_key, base_url=self._base_url)
+
+    def _load_articles(self, job_id: str) -> List[FeedItem]:
+        path = self.cache_mgr.batch_job_file(job_id, ARTICLES_FILE)
+        if not path.exists():
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_articles(self, job_id: str, articles: List[FeedItem]) -> None:
+        with open(self.cache_mgr.batch_job_file(job_id, ARTICLES_FILE), "w", encoding="utf-8") as f:
+            json.dump(articles, f, ensure_ascii=False)
+
+    def pending_article_ids(self) -> Set[Optional[str]]:
+        """Get the IDs of the articles in every job, which must not be queued again."""
+        return {article.get("id") for job_id in self.jobs for article in self._load_articles(job_id)}
+
+    def create_job(self, articles: List[FeedItem], contents: List[Optional[str]], extraction_cache: ExtractionCache) -> BatchJobDefinition:
+        """Write a job for the articles, with a request for each of `contents` that isn't None or
+        already in the extraction cache."""
+        created_at = datetime.now(timezone.utc)
+        job_id = created_at.strftime("%Y%m%dT%H%M%S%fZ")
+        request_format = response_format(LLMConstrainedOutput)
+
+        requests: Dict[str, dict] = {}
+        queued_articles: List[FeedItem] = []
+        for article, content in zip(articles, contents):
+            if content is None:
+                queued_articles.append(article)
+                continue
+            key = ExtractionCache.key(self.model, SYSTEM_PROMPT, content)
+            queued_articles.append({**article, "extraction_key": key})
+            if key in requests or key in extraction_cache:
+                continue
+            requests[key] = {
+                "custom_id": key,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": content},
+                    ],
+                    "response_format": request_format,
+                },
+            }
+
+        with open(self.cache_mgr.batch_job_file(job_id, REQUESTS_FILE), "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(request, ensure_ascii=False) + "\n" for request in requests.values())
+        self._save_articles(job_id, queued_articles)
+
+        job: BatchJobDefinition = {
+            "job_id": job_id,
+            "created_at": created_at.isoformat(),
+            "model": self.model,
+            "status": "pending",
+            "batch_id": None,
+            "requests": len(requests),
+            "articles": len(articles),
+        }
+        self.jobs[job_id] = job
+        self.cache_mgr.save_batch_jobs(self.jobs)
+        self.metrics.count("batch_requests_queued", len(requests))
+        return job
+
+    async def submit_job(self, job_id: str) -> None:
+        """Upload a job's requests to the Batch API and start the batch."""
+        job = self.jobs[job_id]
+        async with self._client() as client:
+            with open(self.cache_mgr.batch_job_file(job_id, REQUESTS_FILE), "rb") as f:
+                input_file = await client.files.create(file=f, purpose="batch")
+            batch = await client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window=BATCH_COMPLETION_WINDOW)
+        job["batch_id"], job["status"] = batch.id, "submitted"
+        self.cache_mgr.save_batch_jobs(self.jobs)
+
+    async def poll_jobs(self) -> None:
+        """Download the output of every submitted job whose batch is done. Jobs whose batch failed,
+        expired or was cancelled without any output are marked failed."""
+        submitted = [job for job in self.jobs.values() if job["status"] == "submitted" and job["batch_id"]]
+        if not submitted:
+            return
+        async with self._client() as client:
+            for job in submitted:
+                batch = await client.batches.retrieve(job["batch_id"])  # type: ignore
+                if batch.status not in BATCH_DONE_STATUSES:
+                    print(f"    (Batch job {job['job_id']}: {batch.status})")
+                    continue
+                if batch.output_file_id:
+                    output = await client.files.content(batch.output_file_id)
+                    with open(self.cache_mgr.batch_job_file(job["job_id"], RESPONSES_FILE), "wb") as f:
+                        f.write(output.content)
+                    job["status"] = "completed"
+                else:
+                    print(f"    (Batch job {job['job_id']}: {batch.status} without output)")
+                    job["status"] = "failed"
+                self.cache_mgr.save_batch_jobs(self.jobs)
+
+    def _ingest_responses(self, job_id: str, extraction_cache: ExtractionCache) -> Tuple[int, int]:
+        ingested = failed = 0
+        with open(self.cache_mgr.batch_job_file(job_id, RESPONSES_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    result = json.loads(line)
+                    response = result.get("response") or {}
+                    if response.get("status_code") != 200:
+                        raise ValueError(result.get("error") or response.get("status_code"))
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    extraction_cache.put(result["custom_id"], LLMConstrainedOutput.model_validate_json(content))
+                    ingested += 1
+                except (KeyError, IndexError, TypeError, ValueError):
+                    failed += 1
+        return ingested, failed
+
+    def ingest_jobs(self, extraction_cache: ExtractionCache) -> List[Tuple[str, List[FeedItem]]]:
+        """Put the results of every job with a responses file in the extraction cache. Returns the
+        articles of each of those jobs, and of each failed job, by job ID. The articles of failed
+        jobs are all extracted interactively."""
+        ready: List[Tuple[str, List[FeedItem]]] = []
+        for job_id, job in self.jobs.items():
+            if job["status"] == "failed":
+                print(f"- 2. Batch job {job_id} failed, extracting its {job['articles']} articles interactively")
+                self.metrics.count("batch_jobs_failed")
+                ready.append((job_id, self._load_articles(job_id)))
+                continue
+            if not self.cache_mgr.batch_job_file(job_id, RESPONSES_FILE).exists():
+                continue
+            ingested, failed = self._ingest_responses(job_id, extraction_cache)
+            print(f"- 2. Batch job {job_id}: {ingested} of {job['requests']} responses ingested, {failed} failed")
+            self.metrics.count("batch_responses_ingested", ingested)
+            self.metrics.count("batch_responses_failed", failed)
+            job["status"] = "completed"
+            ready.append((job_id, self._load_articles(job_id)))
+        if ready:
+            self.cache_mgr.save_batch_jobs(self.jobs)
+        return ready
+
+    def finish_job(self, job_id: str, written_article_ids: Set[Optional[str]]) -> int:
+        """Remove the articles that have been written from a job, and forget the job once none are
+        left. The others stay in the job for the next run. Returns how many are left."""
+        remaining = [article for article in self._load_articles(job_id) if article.get("id") not in written_article_ids]
+        if not remaining:
+            del self.jobs[job_id]
+            self.cache_mgr.save_batch_jobs(self.jobs)
+            self.cache_mgr.remove_batch_job_files(job_id)
+            return 0
+        self._save_articles(job_id, remaining)
+        self.jobs[job_id]["articles"] = len(remaining)
+        self.cache_mgr.save_batch_jobs(self.jobs)
+        return len(remaining)
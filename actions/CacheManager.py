@@ -1,14 +1,35 @@
-from types_consts import CACHE_DIRECTORY, Hash, PlaceId, LocationAliasDefinition, LocationArticleRelationsDefinition
+from LocationSnapshot import LocationSnapshot
+from NearDuplicateIndex import NearDuplicateIndex
+from SeenArticleIndex import SeenArticleIndex
+from ids import compact_relation, to_compact_hash
+from types_consts import BATCH_JOB_DIRECTORY, CACHE_DIRECTORY, BatchJobDefinition, Hash, PlaceId, FeedValidatorsDefinition, ValidationStateDefinition, LocationAliasDefinition, NegativeLocationAliasDefinition, LocationArticleRelationsDefinition
 
 from supabase import Client
 
 import json
+import os
+import shutil
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Iterable, List, Optional
+
+COMPACTION_MIN_LOG_BYTES = 1 << 20
+"""Append logs smaller than this are never compacted."""
+COMPACTION_RATIO = 0.25
+"""Append logs are folded back into their table once they reach this fraction of the table's size."""
+RUN_REPORT_HISTORY = 500
+"""Run reports returned by `load_run_reports`, about two weeks of runs. `run_reports.jsonl` is
+trimmed back to this many once it holds twice as many."""
+SEEN_ARTICLE_INDEX_FILE = "article_ids.idx"
+"""Seen-article index. Replaces articles.idx, which held digests of legacy decimal IDs."""
 
 
 class CacheManager:
-    """Manages cache operations for all tables."""
+    """Manages cache operations for all tables.
+
+    List tables are stored as a JSON snapshot (`<table>.json`) plus an append-only JSONL log
+    (`<table>.log.jsonl`), so that adding records costs only the new records. `load_*` reads both,
+    `append_*` adds to the log, and `save_*` atomically rewrites the snapshot and clears the log.
+    Logs are compacted into their snapshot once they grow past `COMPACTION_RATIO` of it."""
 
     def __init__(self, cache_dir: Path = CACHE_DIRECTORY):
         self.cache_dir = cache_dir
@@ -29,49 +50,302 @@ class CacheManager:
             return f.read()
 
     def _write_file(self, filename: str, data: str) -> None:
+        self._write_bytes(filename, data.encode("utf-8"))
+
+    def _read_bytes(self, filename: str) -> bytes:
+        file_path = self._get_file_path(filename)
+        if not file_path.exists():
+            return b""
+        with open(file_path, "rb") as f:
+            return f.read()
+
+    def _write_bytes(self, filename: str, data: bytes) -> None:
+        """Write a file atomically, so that a crash leaves either the old or the new contents."""
+        file_path = self._get_file_path(filename)
+        temp_path = file_path.with_name(f".{file_path.name}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+
+    def _file_size(self, filename: str) -> int:
+        file_path = self._get_file_path(filename)
+        return file_path.stat().st_size if file_path.exists() else 0
+
+    def _is_newer(self, filename: str, *than_filenames: str) -> bool:
+        if not self._file_exists(filename):
+            return False
+        mtime = self._get_file_path(filename).stat().st_mtime_ns
+        return all(not self._file_exists(than) or mtime >= self._get_file_path(than).stat().st_mtime_ns for than in than_filenames)
+
+    @staticmethod
+    def _log_filename(filename: str) -> str:
+        return filename.removesuffix(".json") + ".log.jsonl"
+
+    @staticmethod
+    def _compact_geo_boundary_hash(alias: Any) -> Any:
+        if alias.get("geo_boundary_hash"):
+            alias["geo_boundary_hash"] = to_compact_hash(alias["geo_boundary_hash"])
+        return alias
+
+    def has_records(self, filename: str) -> bool:
+        """Check whether a list table has a snapshot or an append log in the cache."""
+        return self._file_exists(filename) or self._file_exists(self._log_filename(filename))
+
+    def load_records(self, filename: str) -> List[Any]:
+        """Get all records of a list table: its snapshot followed by its append log."""
+        records: List[Any] = json.loads(self._read_file(filename)) if self._file_exists(filename) else []
+        lines = self._read_file(self._log_filename(filename)).splitlines()
+        for i, line in enumerate(lines):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A crash mid-append can leave a torn final line; anything else is corruption.
+                if i != len(lines) - 1:
+                    raise
+        return records
+
+    def save_records(self, filename: str, records: Iterable[Any]) -> int:
+        """Replace all records of a list table, compacting its append log into the snapshot.
+
+        Records are streamed to disk, so `records` can be a generator. Returns how many were written."""
         file_path = self._get_file_path(filename)
-        with open(file_path, "w", encoding="utf-8") as f:
+        temp_path = file_path.with_name(f".{file_path.name}.tmp")
+        count = 0
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("[")
+            for record in records:
+                f.write(("," if count else "") + json.dumps(record, ensure_ascii=False))
+                count += 1
+            f.write("]")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+
+        log_path = self._get_file_path(self._log_filename(filename))
+        if log_path.exists():
+            log_path.unlink()
+        return count
+
+    @staticmethod
+    def _truncate_torn_line(log_path: Path) -> None:
+        """Drop a partial final line left by a crash mid-append, so new records start on a line of their own."""
+        if not log_path.exists() or log_path.stat().st_size == 0:
+            return
+        with open(log_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            contents = f.read()
+            f.truncate(contents.rfind(b"\n") + 1)
+
+    def append_records(self, filename: str, records: List[Any]) -> None:
+        """Add records to a list table's append log, compacting it if it has grown too large."""
+        if not records:
+            return
+        log_path = self._get_file_path(self._log_filename(filename))
+        self._truncate_torn_line(log_path)
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with open(log_path, "a", encoding="utf-8") as f:
             f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        log_size = self._file_size(self._log_filename(filename))
+        if log_size >= COMPACTION_MIN_LOG_BYTES and log_size >= COMPACTION_RATIO * self._file_size(filename):
+            self.save_records(filename, self.load_records(filename))
 
     def load_seen_articles(self) -> List[Hash]:
-        """Get the list of article uuid3s that have been seen before from cache."""
-        if self._file_exists("articles.json"):
-            return json.loads(self._read_file("articles.json"))
-        return []
+        """Get the list of article uuid3s that have been seen before from cache.
+
+        IDs saved in the legacy decimal format are converted to compact hashes, here and in every
+        other loader, until `migrate_compact_ids` rewrites them."""
+        return [to_compact_hash(article_id) for article_id in self.load_records("articles.json")]
+
+    def load_seen_article_index(self) -> SeenArticleIndex:
+        """Get the index of article uuid3s that have been seen before from cache.
+
+        The index is rebuilt from the articles table when that has been written since the index was."""
+        if self._is_newer(SEEN_ARTICLE_INDEX_FILE, "articles.json", self._log_filename("articles.json")):
+            return SeenArticleIndex(self._read_bytes(SEEN_ARTICLE_INDEX_FILE))
+        seen_article_index = SeenArticleIndex.from_ids(self.load_seen_articles())
+        self.save_seen_article_index(seen_article_index.to_bytes())
+        return seen_article_index
 
     def load_seen_locations(self) -> List[PlaceId]:
         """Get the list of location place_ids that have been seen before from cache."""
-        if self._file_exists("locations.json"):
-            return json.loads(self._read_file("locations.json"))
-        return []
+        return self.load_records("locations.json")
 
     def load_location_aliases(self) -> List[LocationAliasDefinition]:
         """Get the list of location aliases that have been seen before from cache."""
-        if self._file_exists("location_aliases.json"):
-            return json.loads(self._read_file("location_aliases.json"))
+        return [self._compact_geo_boundary_hash(alias) for alias in self.load_records("location_aliases.json")]
+
+    def load_negative_location_aliases(self) -> List[NegativeLocationAliasDefinition]:
+        """Get the list of location aliases that previously failed to geocode from cache."""
+        if self._file_exists("negative_location_aliases.json"):
+            return [self._compact_geo_boundary_hash(alias) for alias in json.loads(self._read_file("negative_location_aliases.json"))]
         return []
 
     def load_location_article_relations(self) -> List[LocationArticleRelationsDefinition]:
         """Get the list of location-article relations that have been seen before from cache."""
-        if self._file_exists("location_article_relations.json"):
-            return json.loads(self._read_file("location_article_relations.json"))
-        return []
+        return [compact_relation(relation) for relation in self.load_records("location_article_relations.json")]
+
+    def load_extraction_cache(self) -> Dict[str, dict]:
+        """Get the cached LLM extraction results, oldest first, from cache."""
+        if self._file_exists("extraction_cache.json"):
+            return json.loads(self._read_file("extraction_cache.json"))
+        return {}
+
+    def load_feed_validators(self) -> Dict[str, FeedValidatorsDefinition]:
+        """Get the ETag/Last-Modified validators for each feed URL from cache."""
+        if self._file_exists("feed_validators.json"):
+            return json.loads(self._read_file("feed_validators.json"))
+        return {}
+
+    def load_location_snapshot(self) -> LocationSnapshot:
+        """Get the columnar snapshot of geocoded locations from cache."""
+        return LocationSnapshot.from_bytes(self._read_bytes("location_snapshot.bin"))
+
+    def load_near_duplicate_index(self) -> NearDuplicateIndex:
+        """Get the MinHash index of extracted articles and their locations from cache."""
+        return NearDuplicateIndex.from_bytes(self._read_bytes("near_duplicates.bin"))
+
+    def load_batch_jobs(self) -> Dict[str, BatchJobDefinition]:
+        """Get the state of each batch extraction job not yet ingested from cache."""
+        if self._file_exists("batch_jobs.json"):
+            return json.loads(self._read_file("batch_jobs.json"))
+        return {}
+
+    def load_validation_state(self) -> Dict[str, ValidationStateDefinition]:
+        """Get the high-water mark of each table at its last validation from cache."""
+        if self._file_exists("validation_state.json"):
+            return json.loads(self._read_file("validation_state.json"))
+        return {}
 
-    def save_seen_articles(self, seen_articles: List[Hash]) -> None:
+    def save_seen_articles(self, seen_articles: Iterable[Hash]) -> int:
         """Save the list of seen articles to cache."""
-        self._write_file("articles.json", json.dumps(list(seen_articles), ensure_ascii=False))
+        return self.save_records("articles.json", seen_articles)
 
-    def save_seen_locations(self, seen_locations: List[PlaceId]) -> None:
+    def save_seen_article_index(self, seen_article_index: bytes) -> None:
+        """Save the serialized index of seen articles to cache."""
+        self._write_bytes(SEEN_ARTICLE_INDEX_FILE, seen_article_index)
+
+    def save_seen_locations(self, seen_locations: Iterable[PlaceId]) -> int:
         """Save the list of seen locations to cache."""
-        self._write_file("locations.json", json.dumps(list(seen_locations), ensure_ascii=False))
+        return self.save_records("locations.json", seen_locations)
 
-    def save_location_aliases(self, seen_location_aliases: List[LocationAliasDefinition]) -> None:
+    def save_location_aliases(self, seen_location_aliases: Iterable[LocationAliasDefinition]) -> int:
         """Save the list of location aliases to cache."""
-        self._write_file("location_aliases.json", json.dumps(list(seen_location_aliases), ensure_ascii=False))
+        return self.save_records("location_aliases.json", seen_location_aliases)
+
+    def append_seen_articles(self, seen_articles: List[Hash]) -> None:
+        """Add newly seen articles to cache."""
+        self.append_records("articles.json", seen_articles)
+
+    def append_seen_locations(self, seen_locations: List[PlaceId]) -> None:
+        """Add newly seen locations to cache."""
+        self.append_records("locations.json", seen_locations)
+
+    def append_location_aliases(self, location_aliases: List[LocationAliasDefinition]) -> None:
+        """Add new location aliases to cache."""
+        self.append_records("location_aliases.json", location_aliases)
 
-    def save_location_article_relations(self, location_article_relations: List[LocationArticleRelationsDefinition]) -> None:
+    def append_location_article_relations(self, location_article_relations: List[LocationArticleRelationsDefinition]) -> None:
+        """Add new location-article relations to cache."""
+        self.append_records("location_article_relations.json", location_article_relations)
+
+    def save_negative_location_aliases(self, negative_location_aliases: List[NegativeLocationAliasDefinition]) -> None:
+        """Save the list of location aliases that failed to geocode to cache."""
+        self._write_file("negative_location_aliases.json", json.dumps(list(negative_location_aliases), ensure_ascii=False))
+
+    def save_location_article_relations(self, location_article_relations: Iterable[LocationArticleRelationsDefinition]) -> int:
         """Save the list of location-article relations to cache."""
-        self._write_file("location_article_relations.json", json.dumps(location_article_relations, ensure_ascii=False))
+        return self.save_records("location_article_relations.json", location_article_relations)
+
+    def save_extraction_cache(self, extraction_cache: Dict[str, dict]) -> None:
+        """Save the cached LLM extraction results to cache."""
+        self._write_file("extraction_cache.json", json.dumps(extraction_cache, ensure_ascii=False))
+
+    def save_feed_validators(self, feed_validators: Dict[str, FeedValidatorsDefinition]) -> None:
+        """Save the ETag/Last-Modified validators for each feed URL to cache."""
+        self._write_file("feed_validators.json", json.dumps(feed_validators, ensure_ascii=False))
+
+    def save_location_snapshot(self, location_snapshot: bytes) -> None:
+        """Save the serialized columnar snapshot of geocoded locations to cache."""
+        self._write_bytes("location_snapshot.bin", location_snapshot)
+
+    def save_near_duplicate_index(self, near_duplicate_index: bytes) -> None:
+        """Save the serialized MinHash index of extracted articles and their locations to cache."""
+        self._write_bytes("near_duplicates.bin", near_duplicate_index)
+
+    def save_batch_jobs(self, batch_jobs: Dict[str, BatchJobDefinition]) -> None:
+        """Save the state of each batch extraction job to cache."""
+        self._write_file("batch_jobs.json", json.dumps(batch_jobs, ensure_ascii=False, indent=2))
+
+    def batch_job_file(self, job_id: str, filename: str) -> Path:
+        """Get the path of one of a batch extraction job's files, creating its directory if needed."""
+        job_dir = self._get_file_path(BATCH_JOB_DIRECTORY) / job_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+        return job_dir / filename
+
+    def remove_batch_job_files(self, job_id: str) -> None:
+        """Delete a batch extraction job's directory once its articles have been written."""
+        shutil.rmtree(self._get_file_path(BATCH_JOB_DIRECTORY) / job_id, ignore_errors=True)
+
+    def save_validation_state(self, validation_state: Dict[str, ValidationStateDefinition]) -> None:
+        """Save the high-water mark of each table at its last validation to cache."""
+        self._write_file("validation_state.json", json.dumps(validation_state, ensure_ascii=False))
+
+    def save_run_report(self, report: dict) -> None:
+        """Save the report of the latest run to cache, and append it to the history of run reports
+        as one line. The history is only rewritten when it is trimmed, once every `RUN_REPORT_HISTORY` runs."""
+        self._write_file("run_report.json", json.dumps(report, indent=2))
+        log_path = self._get_file_path("run_reports.jsonl")
+        self._truncate_torn_line(log_path)
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self._read_bytes("run_reports.jsonl").count(b"\n") >= 2 * RUN_REPORT_HISTORY:
+            self._write_file("run_reports.jsonl", "".join(json.dumps(kept, ensure_ascii=False) + "\n" for kept in self.load_run_reports(RUN_REPORT_HISTORY)))
+
+    def load_run_reports(self, limit: int = RUN_REPORT_HISTORY) -> List[dict]:
+        """Get the reports of the latest `limit` runs from cache, oldest first."""
+        lines = self._read_file("run_reports.jsonl").splitlines()[-limit:]
+        reports: List[dict] = []
+        for i, line in enumerate(lines):
+            try:
+                reports.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A crash mid-append can leave a torn final line; anything else is corruption.
+                if i != len(lines) - 1:
+                    raise
+        return reports
+
+    def migrate_compact_ids(self) -> Dict[str, int]:
+        """Rewrite every table that still has legacy decimal IDs with compact hashes.
+
+        Returns the number of records rewritten per table. Tables already in the compact format are
+        left untouched."""
+        counts: Dict[str, int] = {}
+        tables = [
+            ("articles.json", self.load_seen_articles, self.save_seen_articles),
+            ("location_article_relations.json", self.load_location_article_relations, self.save_location_article_relations),
+            ("location_aliases.json", self.load_location_aliases, self.save_location_aliases),
+        ]
+        for filename, load, save in tables:
+            records = load()
+            if records != self.load_records(filename):
+                counts[filename] = save(records)
+
+        negative_location_aliases = self.load_negative_location_aliases()
+        if self._file_exists("negative_location_aliases.json") and negative_location_aliases != json.loads(self._read_file("negative_location_aliases.json")):
+            self.save_negative_location_aliases(negative_location_aliases)
+            counts["negative_location_aliases.json"] = len(negative_location_aliases)
+        return counts
 
     def merge_artifact_with_db(self, supabase: Client) -> None:
         """One-time operation to merge existing artifacts with database contents."""
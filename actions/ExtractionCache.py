@@ -0,0 +1,70 @@
+from types_consts import EXTRACTION_CACHE_MAX_ENTRIES, LLMConstrainedOutput
+
+from collections import OrderedDict
+from typing import Dict, Optional
+import hashlib
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_content(content: str) -> str:
+    """Normalize article text so that whitespace and unicode form differences share a cache key."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", content)).strip()
+
+
+class ExtractionCache:
+    """Least-recently-used cache of parsed location extraction results.
+
+    Keys hash the model, system prompt and normalized article text, so changing either of the
+    first two invalidates old entries. Entries are kept least recently used first, and those are
+    evicted once there are more than `max_entries`. `changed` is only set by adding or evicting
+    entries, so a run that only reads from the cache doesn't rewrite it."""
+
+    def __init__(self, entries: Optional[Dict[str, dict]] = None, max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, dict] = OrderedDict(entries or {})
+        self.hits = 0
+        self.misses = 0
+        self.changed = False
+        self._evict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    @staticmethod
+    def key(model: str, prompt: str, content: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model, prompt, normalize_content(content)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.changed = True
+
+    def get(self, key: str) -> Optional[LLMConstrainedOutput]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Recency alone doesn't make the cache worth rewriting; it is saved with the next new entry
+        self._entries.move_to_end(key)
+        return LLMConstrainedOutput.model_validate(entry)
+
+    def put(self, key: str, output: LLMConstrainedOutput) -> None:
+        self._entries[key] = output.model_dump()
+        self._entries.move_to_end(key)
+        self.changed = True
+        self._evict()
+
+    def entries(self) -> Dict[str, dict]:
+        """Get the cached entries, oldest first, for saving back to the cache."""
+        return dict(self._entries)
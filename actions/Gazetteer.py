@@ -0,0 +1,160 @@
+from LocationSnapshot import LocationSnapshot
+from address_normalizer import canonical_address_key, parse_formatted_address
+from types_consts import PlaceId, LocationsDefinition
+
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+
+FUZZY_THRESHOLD = 0.85
+"""Trigram similarity (Dice coefficient) from which a fuzzy match is answered locally."""
+ADDRESS_POINT_PLACE_ID_FIELDS = ("place_id", "google_place_id", "placeId")
+"""Property names read from the Google place ID of an address point, first match wins."""
+ADDRESS_POINT_FIELDS = {
+    "street_address": ("address", "Address", "full_address", "Combined Address"),
+    "city": ("city", "City", "borough", "Borough", "Combined City"),
+    "postal_code": ("zip", "zipcode", "ZIP", "postal_code", "Combined ZIP"),
+}
+"""Property names read from each field of an address point, first match wins."""
+ADDRESS_RESULT_TYPES = {"street_address", "premise", "subpremise", "route", "intersection"}
+"""Google result types of a location that is an address. Other results, such as a point of interest,
+can have a formatted address without their name in it, which mustn't answer for the address."""
+
+
+def _trigrams(text: str) -> List[str]:
+    padded = f"  {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _split_key(canonical_key: str) -> Tuple[str, str, str]:
+    """Split a canonical key into its house number, the rest of the name, and its locality."""
+    poi_name, street_address, locality = canonical_key.split("|")
+    number, _, street = street_address.partition(" ") if street_address[:1].isdigit() else ("", "", street_address)
+    return number, " ".join(part for part in (poi_name, street) if part), locality
+
+
+class Gazetteer:
+    """Local geocoder over places that were resolved before, answering lookups without Google.
+
+    Places are indexed by canonical address key (see address_normalizer) for exact matches. For
+    fuzzy matches, the name part of each key is indexed by its character trigrams, blocked by
+    house number and locality, so only candidates at the same house number in the same borough
+    are compared. A fuzzy match needs a trigram similarity of at least `FUZZY_THRESHOLD`."""
+
+    def __init__(self, fuzzy_threshold: float = FUZZY_THRESHOLD):
+        self.fuzzy_threshold = fuzzy_threshold
+        self._locations: List[LocationsDefinition] = []
+        self._place_index: Dict[PlaceId, int] = {}
+        self._exact: Dict[str, int] = {}
+        self._entries: List[int] = []
+        self._gram_counts: List[int] = []
+        self._postings: Dict[Tuple[str, str, str], List[int]] = {}
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: LocationSnapshot, aliases: Iterable[Tuple[str, PlaceId]] = ()) -> "Gazetteer":
+        """Build the gazetteer from the locations in the location snapshot, keyed by their formatted
+        address, and from `(canonical_key, place_id)` pairs of aliases of those locations."""
+        gazetteer = cls()
+        place_ids, lats, lons = snapshot.points()
+        for place_id, lat, lon, formatted_address, types in zip(place_ids, lats.tolist(), lons.tolist(), snapshot.formatted_addresses, snapshot.types):
+            gazetteer.add_location({"place_id": place_id, "lat": lat, "lon": lon, "formatted_address": formatted_address, "types": types})
+        for canonical_key, place_id in aliases:
+            gazetteer.add_alias(canonical_key, place_id)
+        return gazetteer
+
+    def _add_key(self, canonical_key: str, location_index: int) -> None:
+        if canonical_key in self._exact:
+            return
+        self._exact[canonical_key] = location_index
+        number, name, locality = _split_key(canonical_key)
+        grams = set(_trigrams(name))
+        entry = len(self._entries)
+        self._entries.append(location_index)
+        self._gram_counts.append(len(grams))
+        for gram in grams:
+            self._postings.setdefault((number, locality, gram), []).append(entry)
+
+    def add_location(self, location: LocationsDefinition, canonical_key: Optional[str] = None) -> None:
+        """Add a resolved location, under its formatted address unless another key is given. A
+        formatted address without a name is only used for results of an `ADDRESS_RESULT_TYPES` type."""
+        location_index = self._place_index.setdefault(location["place_id"], len(self._locations))
+        if location_index == len(self._locations):
+            self._locations.append(location)
+        if not canonical_key:
+            canonical_key = canonical_address_key(parse_formatted_address(location.get("formatted_address") or ""))
+            if canonical_key and canonical_key.startswith("|") and not ADDRESS_RESULT_TYPES.intersection(location.get("types") or ()):
+                return
+        if canonical_key:
+            self._add_key(canonical_key, location_index)
+
+    def add_alias(self, canonical_key: str, place_id: PlaceId) -> None:
+        """Add another key for a location already in the gazetteer."""
+        location_index = self._place_index.get(place_id)
+        if location_index is not None:
+            self._add_key(canonical_key, location_index)
+
+    def add_address_points(self, path: Path) -> int:
+        """Add the Point features of a GeoJSON file of address points. Returns the number added.
+
+        Only points with a Google place ID are added: locations answered from the gazetteer are
+        written to the database, and the map links each one to Google by its place ID."""
+        with open(path, "r", encoding="utf-8") as f:
+            features = json.load(f)["features"]
+        added = len(self._exact)
+        for feature in features:
+            geometry, properties = feature.get("geometry") or {}, feature.get("properties") or {}
+            if geometry.get("type") != "Point":
+                continue
+            fields = {field: next((str(properties[name]) for name in names if properties.get(name)), None) for field, names in ADDRESS_POINT_FIELDS.items()}
+            place_id = next((str(properties[name]) for name in ADDRESS_POINT_PLACE_ID_FIELDS if properties.get(name)), None)
+            canonical_key = canonical_address_key(fields)
+            if not place_id or not canonical_key or not fields["street_address"]:
+                continue
+            lon, lat = geometry["coordinates"][:2]
+            formatted_address = ", ".join(value for value in (fields["street_address"], fields["city"], fields["postal_code"]) if value)
+            self.add_location({
+                "place_id": place_id,
+                "lat": float(lat),
+                "lon": float(lon),
+                "formatted_address": formatted_address,
+                "types": ["street_address"],
+            }, canonical_key)
+        return len(self._exact) - added
+
+    def lookup(self, location: str, canonical_key: Optional[str] = None) -> Optional[LocationsDefinition]:
+        """Find a location by its canonical key, or by the key parsed from the location string.
+
+        Tries the exact key, then for a point of interest at an address the address alone, then
+        fuzzy matches at the same house number and locality. Only points of interest fall back to
+        their address; an address is never answered with a point of interest there."""
+        canonical_key = canonical_key or canonical_address_key(parse_formatted_address(location))
+        if not canonical_key:
+            self.misses += 1
+            return None
+
+        poi_name, street_address, locality = canonical_key.split("|")
+        for key in (canonical_key, f"|{street_address}|{locality}" if poi_name and street_address else None):
+            if key and key in self._exact:
+                self.exact_hits += 1
+                return self._locations[self._exact[key]]
+
+        number, name, locality = _split_key(canonical_key)
+        grams = set(_trigrams(name))
+        shared = Counter(entry for gram in grams for entry in self._postings.get((number, locality, gram), ()))
+        best, best_score = None, 0.0
+        for entry, count in shared.items():
+            score = 2 * count / (len(grams) + self._gram_counts[entry])
+            if score > best_score:
+                best, best_score = entry, score
+        if best is not None and best_score >= self.fuzzy_threshold:
+            self.fuzzy_hits += 1
+            return self._locations[self._entries[best]]
+        self.misses += 1
+        return None
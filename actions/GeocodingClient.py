@@ -0,0 +1,132 @@
+from RunMetrics import RunMetrics
+
+from typing import Optional
+import asyncio
+import json
+import os
+import random
+import time
+
+import aiohttp
+
+GEOCODING_URL = os.getenv("GOOGLE_MAPS_GEOCODING_URL") or "https://maps.googleapis.com/maps/api/geocode/json"
+GEOCODING_QPS = 50.0
+"""Google's default per-project Geocoding API quota, in queries per second."""
+GEOCODING_MAX_CONCURRENCY = 10
+RETRYABLE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+
+class TokenBucket:
+    """Async token-bucket rate limiter: refills `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """Wait until a token is available, then take it."""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class GeocodingClient:
+    """Google Maps geocoding client that shares one pooled aiohttp session across requests.
+
+    Requests are capped at `max_concurrency` in flight and `qps` per second, and are retried
+    with exponential backoff on `OVER_QUERY_LIMIT`, 5xx responses, responses that aren't JSON and
+    connection errors. Each attempt's latency, bytes and failure are recorded in `metrics`, and
+    each retry, whatever its cause, is counted as `geocode_retries`. Use as an async context manager."""
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        url: str = GEOCODING_URL,
+        max_concurrency: int = GEOCODING_MAX_CONCURRENCY,
+        qps: float = GEOCODING_QPS,
+        max_retries: int = 4,
+        backoff: float = 0.5,
+        timeout: float = 10.0,
+        metrics: Optional[RunMetrics] = None,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.metrics = metrics or RunMetrics()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rate_limiter = TokenBucket(qps)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "GeocodingClient":
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def _retry_delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def geocode(self, address: str, bounds: Optional[str] = None) -> Optional[dict]:
+        """Geocode an address. Returns the decoded API response, or None if the request failed after all retries."""
+        if not self._session:
+            raise RuntimeError("GeocodingClient must be used as an async context manager")
+
+        params = {"key": self.api_key or "", "address": address}
+        if bounds:
+            params["bounds"] = bounds
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.metrics.count("geocode_retries")
+                await asyncio.sleep(self._retry_delay(attempt - 1))
+            await self._rate_limiter.acquire()
+            try:
+                async with self._semaphore:
+                    with self.metrics.call("geocode_request"):
+                        async with self._session.get(self.url, params=params) as response:
+                            body = await response.read()
+                    self.metrics.add_bytes("geocode_request", len(body))
+                if response.status >= 500 or response.status == 429:
+                    self.metrics.add_error("geocode_request")
+                    print(f"    (Geocoding HTTP {response.status}, attempt {attempt + 1})")
+                    continue
+                if response.status != 200:
+                    self.metrics.add_error("geocode_request")
+                    return None
+                data = json.loads(body)
+                if not isinstance(data, dict):
+                    raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"    (Geocoding error: {e!r}, attempt {attempt + 1})")
+                continue
+            except ValueError as e:
+                # A 200 with a body that isn't the API's JSON, such as a proxy's error page
+                self.metrics.add_error("geocode_request")
+                print(f"    (Geocoding response not JSON: {e}, attempt {attempt + 1})")
+                continue
+
+            if data.get("status") in RETRYABLE_STATUSES:
+                self.metrics.add_error("geocode_request")
+                print(f"    (Geocoding {data.get('status')}, attempt {attempt + 1})")
+                continue
+            return data
+
+        return None
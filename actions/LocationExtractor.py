@@ -0,0 +1,187 @@
+from ExtractionCache import ExtractionCache
+from RunMetrics import RunMetrics
+from types_consts import LLMConstrainedOutput, LLMPackedOutput
+
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+
+from openai import AsyncOpenAI
+
+SYSTEM_PROMPT = "Your goal is to extract all points of interest and street addresses from the text provided. For each location, provide all the information that is provided in the text for that specific location. Do NOT included any information that is not included associated with that location; for instance, if a street address is listed without some point of interest name that's separate from the address, only include the relevant address info and leave the point of interest info blank. If the text includes a physical point of interest name with no information about its specific street address, include its name anyways and leave the address fields blank. If the block of text discusses no discrete physical locations, return an empty list."
+EXTRACTION_MODEL = "gpt-4o-mini-2024-07-18"
+EXTRACTION_MAX_CONCURRENCY = 8
+PACKED_SYSTEM_PROMPT = SYSTEM_PROMPT + " The text contains several separate articles, each starting with a line \"### Article <id>\". Extract the locations of each article on its own, and return one entry per article with its id."
+PACK_TOKEN_BUDGET = 6000
+"""Estimated article tokens per packed request."""
+PACK_MAX_ARTICLES = 12
+PACK_LINGER_SECONDS = 0.05
+"""How long a packed request waits for more articles before it is sent."""
+CHARS_PER_TOKEN = 4
+
+
+class LocationExtractor:
+    """Extracts locations from article text with one shared async OpenAI client.
+
+    At most `max_concurrency` requests are in flight at once. Each request times out after
+    `timeout` seconds, and the client retries 429s, 5xx responses and connection errors with
+    backoff up to `max_retries` times. The API base URL can be pointed at any OpenAI-compatible
+    server with `base_url` or `OPENAI_BASE_URL`. Use as an async context manager.
+
+    With an `ExtractionCache`, text that was already extracted with the same model and prompt
+    is answered from the cache, and identical text requested concurrently is only sent once.
+    Request latency, failures and token usage are recorded in `metrics`.
+
+    With `pack_tokens`, articles short enough are packed into one request of up to that many
+    estimated tokens, which pays for the system prompt and the round trip once. Each article gets
+    an id in the request and the response maps ids to locations. Articles the response leaves out
+    or answers more than once, or all of them if the packed request fails, are sent on their own."""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = EXTRACTION_MODEL,
+        max_concurrency: int = EXTRACTION_MAX_CONCURRENCY,
+        timeout: float = 60.0,
+        max_retries: int = 3,
+        cache: Optional[ExtractionCache] = None,
+        metrics: Optional[RunMetrics] = None,
+        pack_tokens: int = 0,
+    ):
+        self.model = model
+        self.cache = cache
+        self.metrics = metrics or RunMetrics()
+        self.pack_tokens = pack_tokens
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._pack: List[Tuple[str, asyncio.Future]] = []
+        self._pack_size = 0
+        self._pack_timer: Optional[asyncio.TimerHandle] = None
+        self._pack_tasks: Set[asyncio.Task] = set()
+        self._client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=max_retries)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self) -> "LocationExtractor":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self._send_pack()
+        await asyncio.gather(*self._pack_tasks, return_exceptions=True)
+        await self._client.close()
+
+    async def extract(self, content: str, cache_key: Optional[str] = None) -> Optional[LLMConstrainedOutput]:
+        """Extract the locations mentioned in a block of text. Raises if the request fails after all retries.
+
+        A result cached under `cache_key`, such as that of a batch request, is used first."""
+        if self.cache is None:
+            return await self._extract_uncached(content)
+
+        if cache_key is not None and cache_key in self.cache:
+            return self.cache.get(cache_key)
+        key = ExtractionCache.key(self.model, SYSTEM_PROMPT, content)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key])
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            parsed = await self._extract_uncached(content)
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved if nobody else was waiting on it.
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+        if parsed:
+            self.cache.put(key, parsed)
+        future.set_result(parsed)
+        return parsed
+
+    async def _extract_uncached(self, content: str) -> Optional[LLMConstrainedOutput]:
+        size = len(content) // CHARS_PER_TOKEN + 1
+        if not self.pack_tokens or size > self.pack_tokens // 2:
+            return await self._request(content)
+
+        if self._pack_size + size > self.pack_tokens or len(self._pack) >= PACK_MAX_ARTICLES:
+            self._send_pack()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pack.append((content, future))
+        self._pack_size += size
+        if self._pack_timer is None:
+            self._pack_timer = asyncio.get_running_loop().call_later(PACK_LINGER_SECONDS, self._send_pack)
+        return await future
+
+    def _send_pack(self) -> None:
+        if self._pack_timer is not None:
+            self._pack_timer.cancel()
+            self._pack_timer = None
+        pack, self._pack, self._pack_size = self._pack, [], 0
+        if pack:
+            task = asyncio.get_running_loop().create_task(self._request_pack(pack))
+            self._pack_tasks.add(task)
+            task.add_done_callback(self._pack_tasks.discard)
+
+    async def _request_pack(self, pack: List[Tuple[str, asyncio.Future]]) -> None:
+        results: Dict[int, Optional[LLMConstrainedOutput]] = {}
+        if len(pack) > 1:
+            try:
+                results = await self._request_packed([content for content, _ in pack])
+            except Exception as e:
+                print(f"    (Packed extraction of {len(pack)} articles failed, extracting them one by one: {e})")
+            self.metrics.count("llm_pack_fallbacks", len(pack) - len(results))
+
+        fallbacks = [i for i in range(len(pack)) if i not in results]
+        outcomes = await asyncio.gather(*(self._request(pack[i][0]) for i in fallbacks), return_exceptions=True)
+        results.update(zip(fallbacks, outcomes))
+        for i, (_, future) in enumerate(pack):
+            if isinstance(results[i], BaseException):
+                future.set_exception(results[i])  # type: ignore
+            else:
+                future.set_result(results[i])
+
+    async def _request_packed(self, contents: List[str]) -> Dict[int, Optional[LLMConstrainedOutput]]:
+        """Extract several articles in one request. Returns the results by index of the articles
+        the response answered exactly once."""
+        packed_content = "\n\n".join(f"### Article {i + 1}\n{content}" for i, content in enumerate(contents))
+        async with self._semaphore:
+            with self.metrics.call("llm_packed_request"):
+                completion = await self._client.beta.chat.completions.parse(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": PACKED_SYSTEM_PROMPT},
+                        {"role": "user", "content": packed_content},
+                    ],
+                    response_format=LLMPackedOutput,
+                )
+        self.metrics.count("llm_packed_articles", len(contents))
+        if completion.usage:
+            self.metrics.count("llm_prompt_tokens", completion.usage.prompt_tokens)
+            self.metrics.count("llm_completion_tokens", completion.usage.completion_tokens)
+        parsed = completion.choices[0].message.parsed
+        if not parsed:
+            return {}
+
+        answered: Dict[str, List[LLMConstrainedOutput]] = {}
+        for article in parsed.articles:
+            answered.setdefault(article.article_id.strip(), []).append(LLMConstrainedOutput(locations=article.locations))
+        return {i: answered[str(i + 1)][0] for i in range(len(contents)) if len(answered.get(str(i + 1), [])) == 1}
+
+    async def _request(self, content: str) -> Optional[LLMConstrainedOutput]:
+        async with self._semaphore:
+            with self.metrics.call("llm_request"):
+                completion = await self._client.beta.chat.completions.parse(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": content},
+                    ],
+                    response_format=LLMConstrainedOutput,
+                )
+        if completion.usage:
+            self.metrics.count("llm_prompt_tokens", completion.usage.prompt_tokens)
+            self.metrics.count("llm_completion_tokens", completion.usage.completion_tokens)
+        return completion.choices[0].message.parsed
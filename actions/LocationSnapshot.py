@@ -0,0 +1,130 @@
+from ids import COMPACT_HASH_LENGTH
+from types_consts import PlaceId, LocationsDefinition
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import struct
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b"MNLS"
+SNAPSHOT_VERSION = 3
+HEADER = struct.Struct("<4sII")
+V1_RELATION_COUNTS = struct.Struct("<II")
+"""Article and relation counts, which follow the header of version 1 snapshots."""
+V1_ARTICLE_ID_SIZE = COMPACT_HASH_LENGTH // 2
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 4)
+
+
+def pack_strings(strings: List[str]) -> bytes:
+    """Pack strings as uint32 offsets, one per string plus one, followed by their padded UTF-8 blob."""
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(data) for data in encoded], dtype=np.uint64)
+    return offsets.tobytes() + _pad(b"".join(encoded))
+
+
+def unpack_strings(data: memoryview, offset: int, count: int) -> Tuple[List[str], int]:
+    """Unpack `count` strings packed at `offset`. Returns them with the offset just past them."""
+    offsets = np.frombuffer(data, dtype="<u4", count=count + 1, offset=offset)
+    blob_start = offset + offsets.nbytes
+    blob = bytes(data[blob_start:blob_start + int(offsets[-1])])
+    strings = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count)]
+    return strings, blob_start + len(_pad(blob))
+
+
+class LocationSnapshot:
+    """Columnar snapshot of the geocoded locations, kept in the cache for the gazetteer to be built from.
+
+    The binary format is little-endian, with every section 4-byte aligned:
+
+    - header: magic `MNLS`, version, location count (uint32 each)
+    - `lat`, `lon`: float32 per location
+    - place IDs, formatted addresses, then comma-separated Google result types: uint32 offsets (one
+      per location, plus one) and a UTF-8 blob
+
+    New locations are appended to the previous snapshot, so a run only adds its delta. Snapshots of
+    version 1 also held the article relations of the locations, which are skipped when read, and
+    those before version 3 have no types."""
+
+    def __init__(self) -> None:
+        self.place_ids: List[PlaceId] = []
+        self.formatted_addresses: List[str] = []
+        self.types: List[Optional[List[str]]] = []
+        self._lat = np.zeros(0, dtype="<f4")
+        self._lon = np.zeros(0, dtype="<f4")
+        self._pending_points: List[Tuple[float, float]] = []
+        self._place_index: Dict[PlaceId, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.place_ids)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LocationSnapshot":
+        snapshot = cls()
+        if not data:
+            return snapshot
+
+        view = memoryview(data)
+        magic, version, location_count = HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC or not 1 <= version <= SNAPSHOT_VERSION:
+            raise ValueError(f"Not a version {SNAPSHOT_VERSION} location snapshot")
+
+        offset = HEADER.size
+        relation_count = 0
+        article_count = 0
+        if version == 1:
+            article_count, relation_count = V1_RELATION_COUNTS.unpack_from(view, offset)
+            offset += V1_RELATION_COUNTS.size
+        snapshot._lat = np.frombuffer(view, dtype="<f4", count=location_count, offset=offset).copy()
+        snapshot._lon = np.frombuffer(view, dtype="<f4", count=location_count, offset=offset + 4 * location_count).copy()
+        offset += 8 * location_count + 8 * relation_count + V1_ARTICLE_ID_SIZE * article_count
+
+        snapshot.place_ids, offset = unpack_strings(view, offset, location_count)
+        snapshot.formatted_addresses, offset = unpack_strings(view, offset, location_count)
+        if version >= 3:
+            types, offset = unpack_strings(view, offset, location_count)
+            snapshot.types = [location_types.split(",") if location_types else None for location_types in types]
+        else:
+            snapshot.types = [None] * location_count
+        snapshot._place_index = {place_id: i for i, place_id in enumerate(snapshot.place_ids)}
+        return snapshot
+
+    def points(self) -> Tuple[List[PlaceId], np.ndarray, np.ndarray]:
+        """Get the place IDs with their latitude and longitude columns."""
+        self._merge_pending()
+        return self.place_ids, self._lat, self._lon
+
+    def add_locations(self, locations: Iterable[LocationsDefinition]) -> int:
+        """Add locations that aren't in the snapshot yet. Returns the number added."""
+        added = 0
+        for location in locations:
+            if location["place_id"] in self._place_index:
+                continue
+            self._place_index[location["place_id"]] = len(self.place_ids)
+            self.place_ids.append(location["place_id"])
+            self.formatted_addresses.append(location.get("formatted_address") or "")
+            self.types.append(location.get("types"))
+            self._pending_points.append((float(location["lat"]), float(location["lon"])))
+            added += 1
+        return added
+
+    def _merge_pending(self) -> None:
+        if self._pending_points:
+            points = np.array(self._pending_points, dtype="<f4").reshape(-1, 2)
+            self._lat = np.concatenate([self._lat, points[:, 0]])
+            self._lon = np.concatenate([self._lon, points[:, 1]])
+            self._pending_points = []
+
+    def to_bytes(self) -> bytes:
+        self._merge_pending()
+        return b"".join([
+            HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.place_ids)),
+            self._lat.tobytes(),
+            self._lon.tobytes(),
+            pack_strings(self.place_ids),
+            pack_strings(self.formatted_addresses),
+            pack_strings([",".join(location_types or []) for location_types in self.types]),
+        ])
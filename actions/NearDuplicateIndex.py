@@ -0,0 +1,211 @@
+from ExtractionCache import normalize_content
+from LocationSnapshot import pack_strings, unpack_strings
+from ids import COMPACT_HASH_LENGTH
+from types_consts import NEAR_DUPLICATE_MAX_ENTRIES, Hash
+
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import re
+import struct
+import zlib
+
+import numpy as np
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+"""Bands of 4 signature values; with 16-bit values, each band packs into one 64-bit key."""
+SHINGLE_WORDS = 5
+NEAR_DUPLICATE_THRESHOLD = 0.8
+"""Share of signature values, an estimate of the Jaccard similarity of two articles' shingles, from which one is a near-duplicate of the other."""
+
+INDEX_MAGIC = b"MNDP"
+INDEX_VERSION = 1
+HEADER = struct.Struct("<4sIII")
+ARTICLE_ID_SIZE = COMPACT_HASH_LENGTH // 2
+
+_WORD = re.compile(r"\w+")
+
+
+def _permutations() -> Tuple[np.ndarray, np.ndarray]:
+    # Derived from SHA-256 rather than a random generator, so signatures stay comparable across runs
+    values = [int.from_bytes(hashlib.sha256(f"minhash-{i}".encode("utf-8")).digest()[:16], "little") for i in range(NUM_PERMUTATIONS)]
+    multipliers = np.array([(value & 0xFFFFFFFFFFFFFFFF) | 1 for value in values], dtype=np.uint64)
+    increments = np.array([value >> 64 for value in values], dtype=np.uint64)
+    return multipliers, increments
+
+
+_MULTIPLIERS, _INCREMENTS = _permutations()
+
+
+def shingles(content: str) -> np.ndarray:
+    """Get the 32-bit hashes of the overlapping `SHINGLE_WORDS`-word sequences of normalized text."""
+    words = _WORD.findall(normalize_content(content).lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    grams = (" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1)))
+    return np.unique(np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64))
+
+
+def minhash_signature(content: str) -> Optional[np.ndarray]:
+    """Get the MinHash signature of article text, or None if it has no words.
+
+    Each permutation is a multiply-shift hash of the shingles (wrapping modulo 2^64), and keeps the
+    top 16 bits of its smallest value."""
+    hashed = shingles(content)
+    if not len(hashed):
+        return None
+    permuted = (_MULTIPLIERS[:, None] * hashed[None, :] + _INCREMENTS[:, None]) >> np.uint64(32)
+    return (permuted.min(axis=1) >> np.uint64(16)).astype("<u2")
+
+
+def _band_keys(signatures: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(signatures, dtype="<u2").view("<u8")
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index over the text of extracted articles, for reusing the locations extracted
+    from an article for its near-duplicates, such as the same wire story on several feeds.
+
+    For each of the `BANDS` bands, the band keys of every article are kept sorted, so the articles
+    sharing any band with a query are found by binary search, and then compared on their whole
+    signature. Articles added during the run are kept in a small buffer that every query also
+    scans, and merged in once it grows. Articles still being extracted can be matched too; their
+    near-duplicates wait for the result instead of extracting the same text again.
+
+    The binary format is little-endian: header (magic `MNDP`, version, article count and
+    permutations, uint32 each), signatures (uint16 per permutation), article IDs (16 bytes each),
+    then each article's locations as JSON, packed as uint32 offsets and a UTF-8 blob. Articles are
+    kept oldest first, and the oldest are dropped once there are more than `max_entries`."""
+
+    MERGE_THRESHOLD = 1024
+
+    def __init__(self, max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.article_ids: List[Hash] = []
+        self._locations: List[str] = []
+        self._signatures = np.zeros((0, NUM_PERMUTATIONS), dtype="<u2")
+        self._sorted_keys: Optional[np.ndarray] = None
+        self._sorted_rows: Optional[np.ndarray] = None
+        self._pending: List[Tuple[Hash, np.ndarray, str]] = []
+        self._in_flight: Dict[Hash, Tuple[np.ndarray, asyncio.Future]] = {}
+        self.hits = 0
+        self.changed = False
+
+    def __len__(self) -> int:
+        return len(self.article_ids) + len(self._pending)
+
+    @classmethod
+    def from_signatures(cls, article_ids: List[Hash], signatures: np.ndarray, locations: List[List[str]], max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES) -> "NearDuplicateIndex":
+        index = cls(max_entries)
+        index.article_ids = list(article_ids)
+        index._signatures = np.asarray(signatures, dtype="<u2").reshape(-1, NUM_PERMUTATIONS)
+        index._locations = [json.dumps(article_locations, ensure_ascii=False) for article_locations in locations]
+        return index
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES) -> "NearDuplicateIndex":
+        index = cls(max_entries)
+        if not data:
+            return index
+
+        view = memoryview(data)
+        magic, version, count, permutations = HEADER.unpack_from(view)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or permutations != NUM_PERMUTATIONS:
+            # Signatures from another format can't be compared, so start over
+            return index
+
+        offset = HEADER.size
+        index._signatures = np.frombuffer(view, dtype="<u2", count=count * NUM_PERMUTATIONS, offset=offset).reshape(count, NUM_PERMUTATIONS)
+        offset += index._signatures.nbytes
+        article_bytes = bytes(view[offset:offset + ARTICLE_ID_SIZE * count])
+        index.article_ids = [article_bytes[i:i + ARTICLE_ID_SIZE].hex() for i in range(0, len(article_bytes), ARTICLE_ID_SIZE)]
+        offset += len(article_bytes)
+        index._locations, offset = unpack_strings(view, offset, count)
+        return index
+
+    def to_bytes(self) -> bytes:
+        self._merge_pending()
+        if len(self.article_ids) > self.max_entries:
+            drop = len(self.article_ids) - self.max_entries
+            self.article_ids, self._locations = self.article_ids[drop:], self._locations[drop:]
+            self._signatures = self._signatures[drop:]
+            self._sorted_keys = self._sorted_rows = None
+        return b"".join([
+            HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self.article_ids), NUM_PERMUTATIONS),
+            np.ascontiguousarray(self._signatures, dtype="<u2").tobytes(),
+            b"".join(bytes.fromhex(article_id) for article_id in self.article_ids),
+            pack_strings(self._locations),
+        ])
+
+    def _merge_pending(self) -> None:
+        if not self._pending:
+            return
+        article_ids, signatures, locations = zip(*self._pending)
+        self.article_ids.extend(article_ids)
+        self._locations.extend(locations)
+        self._signatures = np.concatenate([self._signatures, np.stack(signatures)])
+        self._pending = []
+        self._sorted_keys = self._sorted_rows = None
+
+    def _sort(self) -> None:
+        keys = _band_keys(self._signatures).T
+        self._sorted_rows = np.argsort(keys, axis=1)
+        self._sorted_keys = np.take_along_axis(keys, self._sorted_rows, axis=1)
+
+    def best_match(self, signature: np.ndarray) -> Tuple[Optional[str], float]:
+        """Get the JSON locations of the most similar indexed article, with the similarity."""
+        best: Tuple[Optional[str], float] = (None, 0.0)
+        if len(self.article_ids):
+            if self._sorted_keys is None:
+                self._sort()
+            query = _band_keys(signature[None, :])[0]
+            rows = [self._sorted_rows[band, np.searchsorted(self._sorted_keys[band], key, side="left"):np.searchsorted(self._sorted_keys[band], key, side="right")] for band, key in enumerate(query)]
+            candidates = np.unique(np.concatenate(rows))
+            if len(candidates):
+                similarities = (self._signatures[candidates] == signature).mean(axis=1)
+                i = int(np.argmax(similarities))
+                best = (self._locations[candidates[i]], float(similarities[i]))
+        if self._pending:
+            similarities = (np.stack([pending[1] for pending in self._pending]) == signature).mean(axis=1)
+            i = int(np.argmax(similarities))
+            if similarities[i] > best[1]:
+                best = (self._pending[i][2], float(similarities[i]))
+        return best
+
+    async def find_locations(self, signature: np.ndarray) -> Optional[List[str]]:
+        """Get the locations extracted from a near-duplicate of an article, or None if there isn't one.
+
+        Waits for a near-duplicate that is still being extracted, unless a finished one is found."""
+        locations, similarity = self.best_match(signature)
+        if similarity >= NEAR_DUPLICATE_THRESHOLD:
+            self.hits += 1
+            return json.loads(locations or "[]")
+
+        for in_flight_signature, future in list(self._in_flight.values()):
+            if (in_flight_signature == signature).mean() >= NEAR_DUPLICATE_THRESHOLD:
+                result = await asyncio.shield(future)
+                if result is not None:
+                    self.hits += 1
+                return result
+        return None
+
+    def start_extraction(self, article_id: Hash, signature: np.ndarray) -> None:
+        """Mark an article as being extracted, so that its near-duplicates wait for its locations."""
+        self._in_flight[article_id] = (signature, asyncio.get_running_loop().create_future())
+
+    def finish_extraction(self, article_id: Hash, locations: Optional[List[str]]) -> None:
+        """Add an article's extracted locations to the index, or None if extraction failed."""
+        in_flight = self._in_flight.pop(article_id, None)
+        if in_flight is None:
+            return
+        signature, future = in_flight
+        if not future.done():
+            future.set_result(locations)
+        if locations is None:
+            return
+        self._pending.append((article_id, signature, json.dumps(locations, ensure_ascii=False)))
+        self.changed = True
+        if len(self._pending) >= self.MERGE_THRESHOLD:
+            self._merge_pending()
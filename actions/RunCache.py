@@ -0,0 +1,182 @@
+from AliasIndex import AliasIndex
+from CacheManager import CacheManager
+from ExtractionCache import ExtractionCache
+from Gazetteer import Gazetteer
+from LocationSnapshot import LocationSnapshot
+from NearDuplicateIndex import NearDuplicateIndex
+from SeenArticleIndex import SeenArticleIndex
+from types_consts import Hash, PlaceId, FeedValidatorsDefinition, LocationsDefinition, LocationArticleRelationsDefinition
+
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+import asyncio
+
+
+class RunCache:
+    """Run-scoped view of the cache, shared by every stage of a feed parser run.
+
+    Each table is loaded from disk at most once, on first use, and kept in memory as an indexed
+    structure. Changes are tracked per table and written by `flush()`, which only touches tables
+    that changed. With `checkpoint`, callers flush after each batch of results so that a crash
+    loses at most one batch."""
+
+    def __init__(self, cache_mgr: Optional[CacheManager] = None, checkpoint: bool = False, address_points: Optional[Path] = None):
+        self.cache_mgr = cache_mgr or CacheManager()
+        self.checkpoint = checkpoint
+        self.address_points = address_points
+        self._seen_articles: Optional[SeenArticleIndex] = None
+        self._seen_locations: Optional[Set[PlaceId]] = None
+        self._alias_index: Optional[AliasIndex] = None
+        self._extraction_cache: Optional[ExtractionCache] = None
+        self._near_duplicates: Optional[NearDuplicateIndex] = None
+        self._feed_validators: Optional[Dict[str, FeedValidatorsDefinition]] = None
+        self._location_snapshot: Optional[LocationSnapshot] = None
+        self._gazetteer: Optional[Gazetteer] = None
+        self.pending_feed_validators: Dict[str, FeedValidatorsDefinition] = {}
+        self.pending_feed_articles: Dict[str, List[Hash]] = {}
+        self._new_articles: List[Hash] = []
+        self._new_locations: List[PlaceId] = []
+        self._new_location_article_relations: List[LocationArticleRelationsDefinition] = []
+        self._dirty: Set[str] = set()
+
+    @property
+    def seen_articles(self) -> SeenArticleIndex:
+        if self._seen_articles is None:
+            self._seen_articles = self.cache_mgr.load_seen_article_index()
+        return self._seen_articles
+
+    @property
+    def seen_locations(self) -> Set[PlaceId]:
+        if self._seen_locations is None:
+            self._seen_locations = set(self.cache_mgr.load_seen_locations())
+        return self._seen_locations
+
+    @property
+    def alias_index(self) -> AliasIndex:
+        if self._alias_index is None:
+            self._alias_index = AliasIndex(self.cache_mgr.load_location_aliases(), self.cache_mgr.load_negative_location_aliases())
+        return self._alias_index
+
+    @property
+    def extraction_cache(self) -> ExtractionCache:
+        if self._extraction_cache is None:
+            self._extraction_cache = ExtractionCache(self.cache_mgr.load_extraction_cache())
+        return self._extraction_cache
+
+    @property
+    def near_duplicates(self) -> NearDuplicateIndex:
+        if self._near_duplicates is None:
+            self._near_duplicates = self.cache_mgr.load_near_duplicate_index()
+        return self._near_duplicates
+
+    @property
+    def feed_validators(self) -> Dict[str, FeedValidatorsDefinition]:
+        if self._feed_validators is None:
+            self._feed_validators = self.cache_mgr.load_feed_validators()
+        return self._feed_validators
+
+    @property
+    def location_snapshot(self) -> LocationSnapshot:
+        if self._location_snapshot is None:
+            self._location_snapshot = self.cache_mgr.load_location_snapshot()
+        return self._location_snapshot
+
+    @property
+    def gazetteer(self) -> Gazetteer:
+        """Local geocoder over every location in the location snapshot, the canonical keys of their
+        aliases, the address points file if one was given, and any locations added since."""
+        if self._gazetteer is None:
+            self._gazetteer = Gazetteer.from_snapshot(self.location_snapshot, self.alias_index.canonical_keys())
+            if self.address_points:
+                self._gazetteer.add_address_points(self.address_points)
+        return self._gazetteer
+
+    def add_seen_articles(self, article_ids: List[Hash]) -> None:
+        for article_id in article_ids:
+            self.seen_articles.add(article_id)
+        self._new_articles.extend(article_ids)
+        self._dirty.add("articles")
+
+    def add_seen_locations(self, place_ids: List[PlaceId]) -> None:
+        self.seen_locations.update(place_ids)
+        self._new_locations.extend(place_ids)
+        self._dirty.add("locations")
+
+    def add_to_gazetteer(self, locations: List[LocationsDefinition]) -> None:
+        if self._gazetteer is not None:
+            for location in locations:
+                self._gazetteer.add_location(location)
+
+    def add_location_article_relations(self, location_article_relations: List[LocationArticleRelationsDefinition]) -> None:
+        self._new_location_article_relations.extend(location_article_relations)
+        self._dirty.add("location_article_relations")
+
+    def add_to_location_snapshot(self, locations: List[LocationsDefinition]) -> None:
+        if self.location_snapshot.add_locations(locations):
+            self._dirty.add("location_snapshot")
+
+    def commit_feed_validators(self, queued_articles: Optional[Set[Hash]] = None) -> List[str]:
+        """Mark this run's feed validators for saving, for each feed whose fetched articles have all
+        been written or are `queued_articles`. Other feeds keep their old validators, so that their
+        dropped articles are fetched again next time. Returns the URLs of those feeds."""
+        queued_articles = queued_articles or set()
+        held_back: List[str] = []
+        for url, validators in self.pending_feed_validators.items():
+            article_ids = self.pending_feed_articles.get(url, [])
+            if all(article_id in self.seen_articles or article_id in queued_articles for article_id in article_ids):
+                self.feed_validators[url] = validators
+                self._dirty.add("feed_validators")
+            else:
+                held_back.append(url)
+        self.pending_feed_validators = {}
+        self.pending_feed_articles = {}
+        return held_back
+
+    def _take_writes(self) -> List[Callable[[], None]]:
+        """Take every table changed since the last flush, and return the writes that save it to disk.
+        Tables are copied or serialized here, so that the writes can run while other tasks change them."""
+        cache_mgr = self.cache_mgr
+        writes: List[Callable[[], None]] = []
+        if "articles" in self._dirty:
+            writes.append(partial(cache_mgr.append_seen_articles, self._new_articles))
+            writes.append(partial(cache_mgr.save_seen_article_index, self.seen_articles.to_bytes()))
+            self._new_articles = []
+        if "locations" in self._dirty:
+            writes.append(partial(cache_mgr.append_seen_locations, self._new_locations))
+            self._new_locations = []
+        if "location_article_relations" in self._dirty:
+            writes.append(partial(cache_mgr.append_location_article_relations, self._new_location_article_relations))
+            self._new_location_article_relations = []
+        if "feed_validators" in self._dirty:
+            writes.append(partial(cache_mgr.save_feed_validators, dict(self.feed_validators)))
+        if "location_snapshot" in self._dirty:
+            writes.append(partial(cache_mgr.save_location_snapshot, self.location_snapshot.to_bytes()))
+        self._dirty.clear()
+
+        if self._alias_index is not None:
+            if self._alias_index.new_aliases:
+                writes.append(partial(cache_mgr.append_location_aliases, self._alias_index.new_aliases))
+                self._alias_index.new_aliases = []
+            if self._alias_index.negative_aliases_changed:
+                writes.append(partial(cache_mgr.save_negative_location_aliases, self._alias_index.negative_aliases()))
+                self._alias_index.negative_aliases_changed = False
+
+        if self._extraction_cache is not None and self._extraction_cache.changed:
+            writes.append(partial(cache_mgr.save_extraction_cache, self._extraction_cache.entries()))
+            self._extraction_cache.changed = False
+
+        if self._near_duplicates is not None and self._near_duplicates.changed:
+            writes.append(partial(cache_mgr.save_near_duplicate_index, self._near_duplicates.to_bytes()))
+            self._near_duplicates.changed = False
+        return writes
+
+    def flush(self) -> None:
+        """Write every table changed since the last flush to disk."""
+        for write in self._take_writes():
+            write()
+
+    async def flush_in_thread(self) -> None:
+        """Like `flush`, but write to disk in a worker thread, so that the event loop keeps running."""
+        writes = self._take_writes()
+        await asyncio.to_thread(lambda: [write() for write in writes])
@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List
+import threading
+import time
+
+import numpy as np
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+"""Upper bounds of the call latency histogram buckets, in seconds."""
+METRIC_PREFIX = "feedparser"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class RunMetrics:
+    """Timings and counters of one feed parser run, reported as JSON and as OpenMetrics text.
+
+    - stages: wall time of each stage, summed over every time it runs (`stage()`)
+    - calls: latency, errors and bytes of each kind of external call (`call()`, `add_error()`, `add_bytes()`)
+    - counters: anything else countable (`count()`, or `set()` for totals kept elsewhere). Pairs
+      named `<cache>_cache_hits` and `<cache>_cache_misses` are also reported as cache hit rates.
+
+    Safe to update from worker threads."""
+
+    def __init__(self) -> None:
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a stage of the run."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def call(self, name: str) -> Iterator[None]:
+        """Time one external call. An exception raised out of the call counts as an error of it."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.add_error(name)
+            raise
+        finally:
+            with self._lock:
+                self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    def add_error(self, name: str) -> None:
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def add_bytes(self, name: str, size: int) -> None:
+        with self._lock:
+            self.bytes[name] = self.bytes.get(name, 0) + size
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: int) -> None:
+        """Set a counter to a total kept elsewhere, such as a cache's hits so far in the run."""
+        with self._lock:
+            self.counters[name] = value
+
+    def _call_names(self) -> List[str]:
+        return sorted(set(self.latencies) | set(self.errors) | set(self.bytes))
+
+    def _caches(self) -> Dict[str, Dict[str, float]]:
+        caches = {}
+        for name in sorted(self.counters):
+            if name.endswith("_cache_hits"):
+                cache = name[:-len("_cache_hits")]
+                hits, misses = self.counters[name], self.counters.get(f"{cache}_cache_misses", 0)
+                caches[cache] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+        return caches
+
+    def report(self) -> dict:
+        """Get the run report, with latency percentiles and cumulative histogram buckets per call."""
+        calls = {}
+        for name in self._call_names():
+            latencies = np.array(self.latencies.get(name, []), dtype=np.float64)
+            calls[name] = {
+                "count": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "bytes": self.bytes.get(name, 0),
+                "total_seconds": float(latencies.sum()),
+                "p50_seconds": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p95_seconds": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "max_seconds": float(latencies.max()) if len(latencies) else None,
+                "buckets": {str(bound): int((latencies <= bound).sum()) for bound in LATENCY_BUCKETS},
+            }
+        return {
+            "started_at": self.started_at.isoformat(),
+            "duration_seconds": time.perf_counter() - self._start,
+            "stages": dict(self.stages),
+            "calls": calls,
+            "caches": self._caches(),
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def to_openmetrics(self) -> str:
+        """Get the run's metrics in the OpenMetrics text format."""
+        report = self.report()
+        lines = [
+            f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge",
+            f"{METRIC_PREFIX}_run_duration_seconds {report['duration_seconds']}",
+            f"# TYPE {METRIC_PREFIX}_stage_duration_seconds gauge",
+        ]
+        lines.extend(f'{METRIC_PREFIX}_stage_duration_seconds{{stage="{_escape_label(stage)}"}} {seconds}' for stage, seconds in report["stages"].items())
+
+        lines.append(f"# TYPE {METRIC_PREFIX}_call_duration_seconds histogram")
+        for name, call in report["calls"].items():
+            label = f'call="{_escape_label(name)}"'
+            lines.extend(f'{METRIC_PREFIX}_call_duration_seconds_bucket{{{label},le="{bound}"}} {count}' for bound, count in call["buckets"].items())
+            lines.append(f'{METRIC_PREFIX}_call_duration_seconds_bucket{{{label},le="+Inf"}} {call["count"]}')
+            lines.append(f'{METRIC_PREFIX}_call_duration_seconds_count{{{label}}} {call["count"]}')
+            lines.append(f'{METRIC_PREFIX}_call_duration_seconds_sum{{{label}}} {call["total_seconds"]}')
+        for family, key in (("call_errors", "errors"), ("call_bytes", "bytes")):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{family} counter")
+            lines.extend(f'{METRIC_PREFIX}_{family}_total{{call="{_escape_label(name)}"}} {call[key]}' for name, call in report["calls"].items())
+
+        lines.append(f"# TYPE {METRIC_PREFIX}_cache_hit_ratio gauge")
+        lines.extend(f'{METRIC_PREFIX}_cache_hit_ratio{{cache="{_escape_label(name)}"}} {cache["hit_rate"]}' for name, cache in report["caches"].items())
+        lines.append(f"# TYPE {METRIC_PREFIX}_events counter")
+        lines.extend(f'{METRIC_PREFIX}_events_total{{event="{_escape_label(name)}"}} {value}' for name, value in report["counters"].items())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Get a one-line summary of the stage timings."""
+        return ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in self.stages.items())
@@ -0,0 +1,76 @@
+from ids import COMPACT_HASH_LENGTH, to_compact_hash
+from types_consts import Hash
+
+from typing import Iterable, Set
+import hashlib
+import heapq
+
+DIGEST_SIZE = COMPACT_HASH_LENGTH // 2
+
+
+def article_digest(article_id: Hash) -> bytes:
+    """Get the fixed-width digest an article ID is stored under in the index.
+
+    Article IDs are already 128-bit digests, so this is just their bytes, whichever format they're
+    in. Anything else, such as an empty ID, is hashed."""
+    compact_id = to_compact_hash(article_id)
+    if len(compact_id) == COMPACT_HASH_LENGTH:
+        try:
+            return bytes.fromhex(compact_id)
+        except ValueError:
+            pass
+    return hashlib.sha256(article_id.encode("utf-8")).digest()[:DIGEST_SIZE]
+
+
+class SeenArticleIndex:
+    """Membership index over seen article IDs.
+
+    IDs are stored as a sorted array of 128-bit digests packed into one `bytes` object, so
+    memory stays at 16 bytes per article and lookups are a binary search. IDs added during the
+    run are kept in a small set until the index is serialized."""
+
+    def __init__(self, digests: bytes = b""):
+        if len(digests) % DIGEST_SIZE:
+            raise ValueError(f"Index length {len(digests)} is not a multiple of {DIGEST_SIZE}")
+        self._sorted = digests
+        self._added: Set[bytes] = set()
+
+    @classmethod
+    def from_ids(cls, article_ids: Iterable[Hash]) -> "SeenArticleIndex":
+        return cls(b"".join(sorted({article_digest(article_id) for article_id in article_ids})))
+
+    def __len__(self) -> int:
+        return len(self._sorted) // DIGEST_SIZE + len(self._added)
+
+    def _in_sorted(self, digest: bytes) -> bool:
+        data = self._sorted
+        low, high = 0, len(data) // DIGEST_SIZE
+        while low < high:
+            mid = (low + high) // 2
+            candidate = data[mid * DIGEST_SIZE:(mid + 1) * DIGEST_SIZE]
+            if candidate < digest:
+                low = mid + 1
+            elif candidate > digest:
+                high = mid
+            else:
+                return True
+        return False
+
+    def __contains__(self, article_id: object) -> bool:
+        if not isinstance(article_id, str):
+            return False
+        digest = article_digest(article_id)
+        return digest in self._added or self._in_sorted(digest)
+
+    def add(self, article_id: Hash) -> None:
+        digest = article_digest(article_id)
+        if not self._in_sorted(digest):
+            self._added.add(digest)
+
+    def to_bytes(self) -> bytes:
+        """Get the index as a sorted array of digests, including IDs added during the run."""
+        if self._added:
+            existing = (self._sorted[i:i + DIGEST_SIZE] for i in range(0, len(self._sorted), DIGEST_SIZE))
+            self._sorted = b"".join(heapq.merge(existing, sorted(self._added)))
+            self._added = set()
+        return self._sorted
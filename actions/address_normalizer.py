@@ -0,0 +1,164 @@
+from types_consts import LLMConstrainedAddress, LLMConstrainedPOI
+
+from typing import Dict, List, Mapping, Optional, Union
+import re
+import unicodedata
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_APOSTROPHES = re.compile(r"['’]")
+_ORDINAL = re.compile(r"^(\d+)(st|nd|rd|th)$")
+_STATE_ZIP = re.compile(r"^([A-Za-z .]+?)\s*(\d{5})?(?:-\d{4})?$")
+
+DIRECTIONALS = {
+    "north": "n", "south": "s", "east": "e", "west": "w",
+    "northeast": "ne", "northwest": "nw", "southeast": "se", "southwest": "sw",
+}
+STREET_SUFFIXES = {
+    "street": "st", "str": "st",
+    "avenue": "ave", "av": "ave", "avenu": "ave",
+    "boulevard": "blvd", "boul": "blvd",
+    "place": "pl", "road": "rd", "drive": "dr", "lane": "ln", "court": "ct", "terrace": "ter",
+    "square": "sq", "plaza": "plz", "parkway": "pkwy", "pky": "pkwy", "highway": "hwy",
+    "expressway": "expy", "turnpike": "tpke", "center": "ctr", "centre": "ctr",
+}
+"""Street suffixes, full name first, mapped to the abbreviation they get at the end of a name."""
+_SUFFIX_NAMES = {abbreviation: name for name, abbreviation in reversed(STREET_SUFFIXES.items())}
+NAME_WORDS = {
+    **{word: _SUFFIX_NAMES[abbreviation] for word, abbreviation in STREET_SUFFIXES.items()},
+    **_SUFFIX_NAMES,
+    "st": "saint",
+}
+"""Suffix words elsewhere in a name, as in "Avenue A" or "St Marks Pl", mapped to their full name.
+"St" before the end of a name is "Saint"."""
+ORDINAL_WORDS = {
+    word: str(number) for number, word in enumerate([
+        "first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth",
+        "eleventh", "twelfth", "thirteenth", "fourteenth", "fifteenth", "sixteenth", "seventeenth",
+        "eighteenth", "nineteenth", "twentieth",
+    ], start=1)
+}
+STREET_SYNONYMS = {
+    "avenue of the americas": "6 ave",
+}
+"""Whole street names that are another name for a street, after the rest of normalization."""
+UNIT_MARKERS = {"apt", "apartment", "suite", "ste", "unit", "fl", "floor", "rm", "room"}
+"""Tokens that start the unit part of an address, which doesn't change where it is."""
+
+BOROUGH_SYNONYMS = {
+    "manhattan": "manhattan", "new york": "manhattan", "new york city": "manhattan", "nyc": "manhattan", "ny": "manhattan",
+    "brooklyn": "brooklyn", "kings": "brooklyn", "kings county": "brooklyn", "bk": "brooklyn",
+    "queens": "queens", "queens county": "queens", "astoria": "queens", "long island city": "queens",
+    "flushing": "queens", "jamaica": "queens", "jackson heights": "queens", "forest hills": "queens",
+    "bronx": "bronx", "the bronx": "bronx", "bronx county": "bronx",
+    "staten island": "staten island", "richmond": "staten island", "richmond county": "staten island",
+}
+"""City names, including USPS place names used for some neighborhoods, mapped to their borough."""
+ZIP_PREFIX_BOROUGHS = {
+    "100": "manhattan", "101": "manhattan", "102": "manhattan", "103": "staten island", "104": "bronx",
+    "110": "queens", "111": "queens", "113": "queens", "114": "queens", "116": "queens", "112": "brooklyn",
+}
+NEW_YORK_STATE = {"ny", "new york", "n y"}
+
+
+def _tokens(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").casefold()
+    text = _APOSTROPHES.sub("", text).replace("&", " and ").replace("#", " unit ")
+    return _TOKEN.findall(text)
+
+
+def _normalize_token(token: str) -> str:
+    ordinal = _ORDINAL.match(token)
+    if ordinal:
+        return ordinal.group(1)
+    return ORDINAL_WORDS.get(token) or DIRECTIONALS.get(token) or token
+
+
+def _normalize_name(tokens: List[str]) -> List[str]:
+    """Normalize the tokens of a name. Only its last word other than a directional is read as a
+    suffix and abbreviated, so "Saint" and "Street" stay apart everywhere else."""
+    normalized = [_normalize_token(token) for token in tokens]
+    suffix_at = next((i for i in range(len(normalized) - 1, -1, -1) if normalized[i] not in DIRECTIONALS.values()), None)
+    return [
+        STREET_SUFFIXES.get(token, token) if i == suffix_at else NAME_WORDS.get(token, token)
+        for i, token in enumerate(normalized)
+    ]
+
+
+def normalize_street_address(street_address: Optional[str]) -> str:
+    """Canonicalize a street address: casing, punctuation, ordinals, directionals and suffixes,
+    without the unit. "123 West Fourth Street, Apt 2" and "123 W. 4th St" both give "123 w 4 st"."""
+    tokens: List[str] = []
+    for token in _tokens(street_address or ""):
+        if token in UNIT_MARKERS:
+            break
+        tokens.append(token)
+    street = " ".join(_normalize_name(tokens))
+    for name, synonym in STREET_SYNONYMS.items():
+        street = re.sub(rf"\b{name}\b", synonym, street)
+    return street
+
+
+def normalize_poi_name(poi_name: Optional[str]) -> str:
+    """Canonicalize the name of a point of interest, like a street address but keeping every word
+    and dropping a leading "the"."""
+    tokens = _normalize_name(_tokens(poi_name or ""))
+    if tokens[:1] == ["the"]:
+        tokens = tokens[1:]
+    return " ".join(tokens)
+
+
+def normalize_locality(city: Optional[str], state: Optional[str] = None, postal_code: Optional[str] = None) -> str:
+    """Get the borough a location is in from its ZIP code or city, or its normalized city and
+    state outside New York City. City names are only read as boroughs in New York State or without
+    a state, so that "Richmond, VA" isn't taken for Staten Island."""
+    zip_digits = "".join(_TOKEN.findall(postal_code or ""))[:5]
+    if len(zip_digits) == 5 and zip_digits[:3] in ZIP_PREFIX_BOROUGHS:
+        return ZIP_PREFIX_BOROUGHS[zip_digits[:3]]
+
+    city_name = " ".join(_tokens(city or ""))
+    state_name = " ".join(_tokens(state or ""))
+    in_new_york = not state_name or state_name in NEW_YORK_STATE
+    if in_new_york and city_name in BOROUGH_SYNONYMS:
+        return BOROUGH_SYNONYMS[city_name]
+    if not city_name or in_new_york:
+        return city_name
+    return f"{city_name} {state_name}"
+
+
+def canonical_address_key(location: Union[LLMConstrainedAddress, LLMConstrainedPOI, Mapping[str, Optional[str]]]) -> Optional[str]:
+    """Get the canonical key of a location extracted by the LLM, built from its structured fields,
+    so that different spellings of the same place share an alias cache entry. None if the location
+    has neither a name nor a street address."""
+    fields: Dict[str, Optional[str]] = dict(location)  # type: ignore
+    poi_name = normalize_poi_name(fields.get("poi_name"))
+    street_address = normalize_street_address(fields.get("street_address"))
+    if not poi_name and not street_address:
+        return None
+    locality = normalize_locality(fields.get("city"), fields.get("state"), fields.get("postal_code"))
+    return f"{poi_name}|{street_address}|{locality}"
+
+
+def parse_formatted_address(address: str) -> Dict[str, Optional[str]]:
+    """Split a one-line address, such as a Google formatted address or a joined location string,
+    into the fields the LLM extracts. A first part that doesn't start with a house number is taken
+    as the name of a point of interest."""
+    parts = [part.strip() for part in address.split(",") if part.strip()]
+    if parts and parts[-1].casefold() in ("usa", "united states"):
+        parts = parts[:-1]
+    fields: Dict[str, Optional[str]] = {"poi_name": None, "street_address": None, "city": None, "state": None, "postal_code": None}
+    if not parts:
+        return fields
+
+    if parts[0][:1].isdigit():
+        fields["street_address"] = parts.pop(0)
+    else:
+        fields["poi_name"] = parts.pop(0)
+        if parts and parts[0][:1].isdigit():
+            fields["street_address"] = parts.pop(0)
+    if parts:
+        state_zip = _STATE_ZIP.match(parts[-1])
+        if len(parts) > 1 and state_zip:
+            fields["state"], fields["postal_code"] = state_zip.group(1), state_zip.group(2)
+            parts = parts[:-1]
+        fields["city"] = parts[0]
+    return fields
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the feed parser's hot paths, run against synthetic data."""
+import argparse
+import json
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from AliasIndex import AliasIndex, normalize_alias
+from CacheManager import CacheManager
+from Gazetteer import Gazetteer
+from NearDuplicateIndex import NUM_PERMUTATIONS, NearDuplicateIndex, minhash_signature
+from SeenArticleIndex import SeenArticleIndex
+from address_normalizer import canonical_address_key
+from ids import compact_hash, legacy_hash
+from location_signal import NYC_PLACE_NAMES, PREFILTER_THRESHOLD, location_paragraphs, location_signal
+from types_consts import CACHE_DIRECTORY, LocationAliasDefinition, LocationArticleRelationsDefinition
+
+
+def time_per_call(fn: Callable[[], object], calls: int) -> float:
+    """Get the mean wall time of `fn` in microseconds."""
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def synthetic_aliases(count: int, seed: int = 0) -> List[LocationAliasDefinition]:
+    rng = random.Random(seed)
+    return [{
+        "alias": f"{rng.randint(1, 9999)} {''.join(rng.choices(string.ascii_letters, k=10))} St, New York, NY",
+        "place_id": "".join(rng.choices(string.ascii_letters + string.digits, k=27)),
+        "geo_boundary_hash": None,
+    } for _ in range(count)]
+
+
+def bench_aliases(sizes: List[int], lookups: int) -> None:
+    print(f"{'aliases':>10} {'linear scan (us)':>18} {'index build (ms)':>18} {'index lookup (us)':>18}")
+    for size in sizes:
+        aliases = synthetic_aliases(size)
+        rng = random.Random(1)
+        queries = [rng.choice(aliases)["alias"] for _ in range(lookups)]
+
+        def linear_scan() -> object:
+            query = rng.choice(queries)
+            return [alias for alias in aliases if alias["alias"] == query]
+
+        start = time.perf_counter()
+        index = AliasIndex(aliases)
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        scan_us = time_per_call(linear_scan, max(1, lookups // 100))
+        lookup_us = time_per_call(lambda: index.lookup(rng.choice(queries)), lookups)
+        print(f"{size:>10} {scan_us:>18.2f} {build_ms:>18.2f} {lookup_us:>18.2f}")
+
+
+def synthetic_article_ids(count: int, hash_fn: Callable[[str], str] = legacy_hash) -> List[str]:
+    """Article IDs in the legacy decimal format by default, or another `hash_fn` format."""
+    return [hash_fn(f"article-{i}") for i in range(count)]
+
+
+def synthetic_relations(article_ids: List[str], hash_fn: Callable[[str], str]) -> List[LocationArticleRelationsDefinition]:
+    """One location-article relation per article, built the way feedParser builds them."""
+    rng = random.Random(0)
+    relations: List[LocationArticleRelationsDefinition] = []
+    for article_id in article_ids:
+        place_id = "ChIJ" + "".join(rng.choices(string.ascii_letters + string.digits, k=23))
+        relations.append({"id": hash_fn(f"{article_id}-{place_id}"), "article_uuid": article_id, "place_id": place_id, "location_name": "Broadway"})
+    return relations
+
+
+def measure(build: Callable[[], object]) -> tuple:
+    """Build a structure, returning it with the build time in ms and its traced memory in MB."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    structure = build()
+    build_ms = (time.perf_counter() - start) * 1e3
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+    return structure, build_ms, memory_mb
+
+
+def bench_seen_articles(sizes: List[int], lookups: int) -> None:
+    print(f"{'history':>10} {'structure':>10} {'build (ms)':>12} {'memory (MB)':>12} {'lookup (us)':>12}")
+    for size in sizes:
+        rng = random.Random(0)
+        ids, _, ids_mb = measure(lambda: synthetic_article_ids(size))
+        queries = [rng.choice(ids) if rng.random() < 0.5 else f"unseen-{i}" for i in range(lookups)]
+
+        # The list and set hold references to the ID strings, so the strings count towards their memory.
+        structures = [
+            ("list", lambda: list(ids), ids_mb, max(1, lookups // 1000)),
+            ("set", lambda: set(ids), ids_mb, lookups),
+            ("index", lambda: SeenArticleIndex.from_ids(ids), None, lookups),
+        ]
+        for name, build, base_mb, calls in structures:
+            structure, build_ms, memory_mb = measure(build)
+            lookup_us = time_per_call(lambda: rng.choice(queries) in structure, calls)
+            print(f"{size:>10} {name:>10} {build_ms:>12.1f} {memory_mb + (base_mb or 0):>12.1f} {lookup_us:>12.2f}")
+            del structure
+
+
+def bench_ids(sizes: List[int]) -> None:
+    print(f"{'articles':>10} {'format':>9} {'table':>10} {'file (MB)':>10} {'load (ms)':>10} {'memory (MB)':>12}")
+    for size in sizes:
+        for name, hash_fn in [("legacy", legacy_hash), ("compact", compact_hash)]:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cache_mgr = CacheManager(Path(cache_dir))
+                article_ids = synthetic_article_ids(size, hash_fn)
+                cache_mgr.save_seen_articles(article_ids)
+                cache_mgr.save_location_article_relations(synthetic_relations(article_ids, hash_fn))
+                del article_ids
+
+                # The loaders convert legacy IDs, so their time includes what reading an unmigrated cache costs
+                for table, filename, load in [
+                    ("articles", "articles.json", cache_mgr.load_seen_articles),
+                    ("relations", "location_article_relations.json", cache_mgr.load_location_article_relations),
+                ]:
+                    file_mb = (Path(cache_dir) / filename).stat().st_size / 1e6
+                    _, raw_ms, raw_mb = measure(lambda: cache_mgr.load_records(filename))
+                    _, load_ms, _ = measure(load)
+                    print(f"{size:>10} {name:>9} {table:>10} {file_mb:>10.1f} {raw_ms:>10.1f} {raw_mb:>12.1f}")
+                    if name == "legacy":
+                        print(f"{size:>10} {'dual-read':>9} {table:>10} {'':>10} {load_ms:>10.1f} {'':>12}")
+
+
+def bench_near_duplicates(sizes: List[int], lookups: int) -> None:
+    rng = random.Random(0)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(20_000)]
+    articles = [" ".join(rng.choices(words, k=600)) for _ in range(100)]
+    # Reposts with a changed sentence and a different byline
+    reposts = [f"{article[:2000]} {' '.join(rng.choices(words, k=12))} {article[2000:]} Reporting by staff." for article in articles]
+    signature_us = time_per_call(lambda: minhash_signature(rng.choice(articles)), 100)
+    print(f"signature of a 600-word article: {signature_us:.1f} us")
+
+    print(f"{'articles':>10} {'linear scan (us)':>18} {'index build (ms)':>18} {'index lookup (us)':>18} {'file (MB)':>10} {'load (ms)':>10}")
+    for size in sizes:
+        signatures = np.random.default_rng(0).integers(0, 1 << 16, (size, NUM_PERMUTATIONS), dtype=np.uint16)
+        signatures[:len(articles)] = [minhash_signature(article) for article in articles]
+        index = NearDuplicateIndex.from_signatures([f"{i:032x}" for i in range(size)], signatures, [[]] * size, max_entries=size)
+        queries = [minhash_signature(repost) for repost in reposts]
+
+        def linear_scan() -> object:
+            return int(np.argmax((signatures == rng.choice(queries)).mean(axis=1)))
+
+        # The band keys are sorted on the first lookup
+        start = time.perf_counter()
+        index.best_match(queries[0])
+        build_ms = (time.perf_counter() - start) * 1e3
+        scan_us = time_per_call(linear_scan, max(1, lookups // 100))
+        lookup_us = time_per_call(lambda: index.best_match(rng.choice(queries)), lookups)
+
+        data = index.to_bytes()
+        start = time.perf_counter()
+        NearDuplicateIndex.from_bytes(data)
+        load_ms = (time.perf_counter() - start) * 1e3
+        print(f"{size:>10} {scan_us:>18.1f} {build_ms:>18.1f} {lookup_us:>18.1f} {len(data) / 1e6:>10.1f} {load_ms:>10.1f}")
+
+
+def synthetic_extracted_locations(count: int, seed: int = 0) -> List[Dict[str, Optional[str]]]:
+    """Locations as the LLM extracts them, with each place written in the different ways articles write it."""
+    rng = random.Random(seed)
+    ordinals = ["1st", "2nd", "3rd", "4th", "5th", "6th", "7th", "8th", "9th", "10th", "11th", "12th"]
+    ordinal_words = ["First", "Second", "Third", "Fourth", "Fifth", "Sixth", "Seventh", "Eighth", "Ninth", "Tenth", "Eleventh", "Twelfth"]
+    names = ["Main", "Court", "Atlantic", "Flatbush", "Lexington", "Madison", "Fulton", "Grand", "Canal", "Bedford"]
+    suffixes = [("St", "Street", "St."), ("Ave", "Avenue", "Ave."), ("Blvd", "Boulevard", "Blvd."), ("Pl", "Place", "Pl.")]
+    directions = [("W", "West", "W."), ("E", "East", "E.")]
+    cities = [("New York", "Manhattan", "NYC", "New York City"), ("Brooklyn",), ("Queens",), ("Bronx", "The Bronx")]
+
+    places = []
+    for _ in range(max(1, count // 4)):
+        number = str(rng.randint(1, 999))
+        if rng.random() < 0.5:
+            i = rng.randrange(len(ordinals))
+            direction = rng.choice(directions)
+            street_forms = [f"{d} {o}" for d in direction for o in (ordinals[i], ordinal_words[i])]
+        else:
+            street_forms = [rng.choice(names)]
+        places.append((number, street_forms, rng.choice(suffixes), rng.choice(cities)))
+
+    locations = []
+    for _ in range(count):
+        number, street_forms, suffix, city = rng.choice(places)
+        locations.append({
+            "street_address": f"{number} {rng.choice(street_forms)} {rng.choice(suffix)}",
+            "city": rng.choice(city) if rng.random() < 0.8 else None,
+            "state": rng.choice(["NY", "New York", None]),
+            "postal_code": None,
+        })
+    return locations
+
+
+def load_extracted_locations(path: Path) -> List[Dict[str, Optional[str]]]:
+    """Locations from the LLM extraction results saved in an extraction cache file."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    return [location for entry in entries.values() for location in entry.get("locations", [])]
+
+
+def bench_addresses(corpus: Optional[Path], count: int) -> None:
+    if corpus and corpus.exists():
+        locations = load_extracted_locations(corpus)
+        print(f"corpus: {corpus} ({len(locations)} locations)")
+    else:
+        locations = synthetic_extracted_locations(count)
+        print(f"corpus: synthetic ({len(locations)} locations)")
+    if not locations:
+        return
+
+    # Replay the corpus through an alias cache keyed by joined string, as before, and one that also
+    # matches canonical keys. Every miss is a Google call, after which the location is cached.
+    joined_cache: set = set()
+    index = AliasIndex()
+    joined_calls = canonical_calls = 0
+    start = time.perf_counter()
+    keys = [canonical_address_key(location) for location in locations]
+    normalize_us = (time.perf_counter() - start) / len(locations) * 1e6
+    for i, (location, canonical_key) in enumerate(zip(locations, keys)):
+        alias = ", ".join(f"{v}" for _, v in location.items() if v)
+        if normalize_alias(alias) not in joined_cache:
+            joined_cache.add(normalize_alias(alias))
+            joined_calls += 1
+        if not index.lookup(alias, None, canonical_key):
+            index.add(alias, f"place-{i}", None, canonical_key)
+            canonical_calls += 1
+
+    print(f"{'alias key':>12} {'Google calls':>14} {'hit rate':>10}")
+    print(f"{'string':>12} {joined_calls:>14} {1 - joined_calls / len(locations):>10.1%}")
+    print(f"{'canonical':>12} {canonical_calls:>14} {1 - canonical_calls / len(locations):>10.1%}")
+    print(f"saved {joined_calls - canonical_calls} calls ({(joined_calls - canonical_calls) / joined_calls:.1%}); canonical key: {normalize_us:.1f} us per location")
+
+
+def bench_gazetteer(sizes: List[int], lookups: int, address_points: Optional[Path]) -> None:
+    rng = random.Random(0)
+    names = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))).capitalize() for _ in range(2_000)]
+    suffixes = ["St", "Ave", "Blvd", "Pl", "Rd"]
+    cities = [("New York", "10001"), ("Brooklyn", "11201"), ("Queens", "11101"), ("Bronx", "10451"), ("Staten Island", "10301")]
+
+    print(f"{'places':>10} {'build (ms)':>12} {'lookup (us)':>12} {'exact':>8} {'fuzzy':>8} {'miss':>8}")
+    for size in sizes:
+        places = [(str(rng.randint(1, 2_999)), rng.choice(names), rng.choice(suffixes), *rng.choice(cities)) for _ in range(size)]
+        start = time.perf_counter()
+        gazetteer = Gazetteer()
+        for i, (number, name, suffix, city, zip_code) in enumerate(places):
+            gazetteer.add_location({"place_id": f"place-{i}", "lat": 40.7, "lon": -74.0, "formatted_address": f"{number} {name} {suffix}, {city}, NY {zip_code}, USA", "types": ["street_address"]})
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        # Known places as articles write them, some misspelled, and places that were never resolved
+        queries = []
+        for _ in range(lookups):
+            number, name, suffix, city, _zip = rng.choice(places)
+            if rng.random() < 0.2:
+                number = str(rng.randint(3_000, 9_999))
+            elif rng.random() < 0.3:
+                name = name[:-1] + name[-1] * 2
+            queries.append(f"{number} {name} {dict(St='Street', Ave='Avenue', Blvd='Boulevard', Pl='Place', Rd='Road')[suffix]}, {city}")
+        query_iter = iter(queries)
+        lookup_us = time_per_call(lambda: gazetteer.lookup(next(query_iter)), lookups)
+        print(f"{size:>10} {build_ms:>12.1f} {lookup_us:>12.1f} {gazetteer.exact_hits / lookups:>8.1%} {gazetteer.fuzzy_hits / lookups:>8.1%} {gazetteer.misses / lookups:>8.1%}")
+
+    if address_points and address_points.exists():
+        start = time.perf_counter()
+        added = Gazetteer().add_address_points(address_points)
+        print(f"address points: {added} from {address_points} in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+
+def synthetic_articles(count: int, seed: int = 0) -> List[tuple]:
+    """Articles of filler paragraphs, about half of them with one paragraph that mentions a local
+    place, paired with whether they do."""
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(5_000)]
+    streets = ["Atlantic Ave", "Bedford Avenue", "W. 4th St.", "Grand Street", "Broadway", "Court St", "East 116th Street"]
+    mentions = [
+        lambda: f"The shop at {rng.randint(1, 999)} {rng.choice(streets)} opened on Friday.",
+        lambda: f"Neighbors in {rng.choice(NYC_PLACE_NAMES)} gathered near {rng.choice(streets)}.",
+        lambda: f"The new restaurant in {rng.choice(NYC_PLACE_NAMES)} is already busy.",
+    ]
+    articles = []
+    for _ in range(count):
+        paragraphs = [" ".join(rng.choices(words, k=rng.randint(40, 90))).capitalize() + "." for _ in range(rng.randint(3, 12))]
+        local = rng.random() < 0.5
+        if local:
+            paragraphs.insert(rng.randrange(len(paragraphs) + 1), rng.choice(mentions)())
+        articles.append(("\n\n".join(paragraphs), local))
+    return articles
+
+
+def bench_prefilter(count: int, thresholds: List[float]) -> None:
+    articles = synthetic_articles(count)
+    start = time.perf_counter()
+    signals = np.array([location_signal(content) for content, _ in articles])
+    signal_us = (time.perf_counter() - start) / len(articles) * 1e6
+    local = np.array([is_local for _, is_local in articles])
+    print(f"corpus: synthetic ({len(articles)} articles, {local.mean():.0%} with locations); signal: {signal_us:.1f} us per article")
+
+    print(f"{'threshold':>10} {'LLM calls avoided':>18} {'recall':>8} {'precision':>10}")
+    for threshold in thresholds:
+        sent = signals >= threshold
+        recall = (sent & local).sum() / max(1, local.sum())
+        precision = (sent & local).sum() / max(1, sent.sum())
+        print(f"{threshold:>10.2f} {(~sent).mean():>18.1%} {recall:>8.1%} {precision:>10.1%}")
+
+    lengths = [(len(content), len(location_paragraphs(content))) for content, _ in articles]
+    print(f"trimming: {1 - sum(trimmed for _, trimmed in lengths) / sum(full for full, _ in lengths):.1%} of characters cut")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run microbenchmarks against synthetic data')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    aliases_parser = subparsers.add_parser('aliases', help='Location alias lookup cost as the alias set grows')
+    aliases_parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    aliases_parser.add_argument('--lookups', type=int, default=10_000)
+
+    seen_parser = subparsers.add_parser('seen', help='Seen-article membership cost over synthetic histories')
+    seen_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    seen_parser.add_argument('--lookups', type=int, default=10_000)
+
+    ids_parser = subparsers.add_parser('ids', help='Cache file size, load time and memory with legacy and compact IDs')
+    ids_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+
+    duplicates_parser = subparsers.add_parser('duplicates', help='MinHash signature and near-duplicate lookup cost over synthetic articles')
+    duplicates_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 200_000])
+    duplicates_parser.add_argument('--lookups', type=int, default=1_000)
+
+    addresses_parser = subparsers.add_parser('addresses', help='Alias cache hit rate and Google calls with and without canonical address keys')
+    addresses_parser.add_argument('--corpus', type=Path, default=CACHE_DIRECTORY / "extraction_cache.json", help='Extraction cache to replay; synthetic locations if missing')
+    addresses_parser.add_argument('--count', type=int, default=10_000, help='Synthetic locations to generate')
+
+    gazetteer_parser = subparsers.add_parser('gazetteer', help='Local gazetteer build and lookup cost, and how many lookups it answers')
+    gazetteer_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    gazetteer_parser.add_argument('--lookups', type=int, default=10_000)
+    gazetteer_parser.add_argument('--address-points', type=Path, help='GeoJSON file of address points to time loading')
+
+    prefilter_parser = subparsers.add_parser('prefilter', help='Location pre-filter cost, LLM calls avoided and recall at each threshold')
+    prefilter_parser.add_argument('--count', type=int, default=5_000, help='Synthetic articles to generate')
+    prefilter_parser.add_argument('--thresholds', type=float, nargs='+', default=[0.25, PREFILTER_THRESHOLD, 0.5, 0.75])
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'aliases':
+        bench_aliases(args.sizes, args.lookups)
+    elif args.benchmark == 'seen':
+        bench_seen_articles(args.sizes, args.lookups)
+    elif args.benchmark == 'ids':
+        bench_ids(args.sizes)
+    elif args.benchmark == 'duplicates':
+        bench_near_duplicates(args.sizes, args.lookups)
+    elif args.benchmark == 'addresses':
+        bench_addresses(args.corpus, args.count)
+    elif args.benchmark == 'gazetteer':
+        bench_gazetteer(args.sizes, args.lookups, args.address_points)
+    elif args.benchmark == 'prefilter':
+        bench_prefilter(args.count, args.thresholds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+from RunMetrics import RunMetrics
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+import httpx
+from postgrest.exceptions import APIError
+from supabase import Client, create_client
+
+PAGE_SIZE = 1000
+"""Rows per request; Supabase caps responses at 1000 rows by default."""
+EXPORT_MAX_WORKERS = 4
+
+HASH_KEY_PARTITIONS = list("123456789abcdef")
+"""Boundaries that split keys written by feedParser.hash into ranges of similar size. Compact (hex)
+keys spread over all of them, legacy (decimal) keys over the first nine."""
+
+UPSERT_CHUNK_SIZE = 500
+UPSERT_MAX_WORKERS = 4
+UPSERT_MAX_ATTEMPTS = 3
+UPSERT_RETRY_DELAY = 1.0
+"""Seconds before the first retry of a transient upsert error, doubling with each retry."""
+
+ROW_ERROR_SQLSTATE_CLASSES = ("22", "23")
+"""Postgres error classes caused by the rows written: data exceptions and constraint violations."""
+TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57")
+"""Postgres error classes worth retrying: connection failures, serialization failures and
+deadlocks, exhausted resources, and statement timeouts or shutdowns."""
+
+DIGEST_BUCKETS = 256
+"""Hash buckets compared by incremental validation. Must stay under the 1000-row response cap."""
+
+_DONE = object()
+_client: Optional[Client] = None
+
+
+def get_supabase_client() -> Client:
+    """Get the Supabase client shared by every database call in the process, creating it on first use."""
+    global _client
+    if _client is None:
+        supabase_url = os.getenv("SUPABASE_URL") or ""
+        supabase_key = os.getenv("SUPABASE_SER_KEY") or ""
+        _client = create_client(supabase_url, supabase_key)
+    return _client
+
+
+def iter_table_rows(
+    supabase: Client,
+    table: str,
+    columns: str,
+    key: str,
+    page_size: int = PAGE_SIZE,
+    lower: Optional[str] = None,
+    upper: Optional[str] = None,
+) -> Iterator[dict]:
+    """Yield every row of a table in `key` order, optionally only those with `lower <= key < upper`.
+
+    Pages with keyset pagination (`key > last key seen`) rather than offsets, so each page costs
+    an index seek no matter how deep into the table it is. `columns` must include `key`."""
+    last_key: Optional[str] = None
+    while True:
+        query = supabase.table(table).select(columns).order(key).limit(page_size)
+        if last_key is not None:
+            query = query.gt(key, last_key)
+        elif lower is not None:
+            query = query.gte(key, lower)
+        if upper is not None:
+            query = query.lt(key, upper)
+        rows = query.execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_key = rows[-1][key]
+
+
+def key_ranges(boundaries: Sequence[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Split the key space at `boundaries` into `[lower, upper)` ranges covering every key."""
+    edges: List[Optional[str]] = [None, *sorted(boundaries), None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def iter_table_rows_concurrently(
+    supabase: Client,
+    table: str,
+    columns: str,
+    key: str,
+    boundaries: Sequence[str] = (),
+    max_workers: int = EXPORT_MAX_WORKERS,
+    page_size: int = PAGE_SIZE,
+) -> Iterator[dict]:
+    """Yield every row of a table, scanning the key ranges between `boundaries` in parallel.
+
+    Each range is its own keyset scan on a worker thread. Pages are yielded as they arrive, so
+    rows are not in key order across ranges. A bounded queue keeps fast workers from running far
+    ahead of the consumer."""
+    ranges = key_ranges(boundaries)
+    if len(ranges) == 1:
+        yield from iter_table_rows(supabase, table, columns, key, page_size)
+        return
+
+    pages: queue.Queue = queue.Queue(maxsize=2 * max_workers)
+    stopped = threading.Event()
+
+    def put(item: object) -> None:
+        # Give up if the consumer has stopped, so workers never block on a queue nobody reads.
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan(lower: Optional[str], upper: Optional[str]) -> None:
+        try:
+            page: List[dict] = []
+            for row in iter_table_rows(supabase, table, columns, key, page_size, lower, upper):
+                if stopped.is_set():
+                    return
+                page.append(row)
+                if len(page) == page_size:
+                    put(page)
+                    page = []
+            if page:
+                put(page)
+        except BaseException as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for lower, upper in ranges:
+            executor.submit(scan, lower, upper)
+
+        try:
+            remaining = len(ranges)
+            while remaining:
+                item = pages.get()
+                if item is _DONE:
+                    remaining -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            stopped.set()
+
+
+def iter_rows_since(
+    supabase: Client,
+    table: str,
+    columns: str,
+    key: str,
+    created_at: str,
+    after_key: Optional[str] = None,
+    page_size: int = PAGE_SIZE,
+) -> Iterator[dict]:
+    """Yield the rows created after a high-water mark, in `(created_at, key)` order.
+
+    The mark is the `created_at` and `key` of the last row seen, which breaks ties between rows
+    created in the same transaction. `columns` must include `created_at` and `key`."""
+    while True:
+        if after_key is None:
+            mark = f'created_at.gt."{created_at}"'
+        else:
+            mark = f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",{key}.gt."{after_key}")'
+        rows = supabase.table(table).select(columns).or_(mark).order("created_at").order(key).limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        created_at, after_key = rows[-1]["created_at"], rows[-1][key]
+
+
+def get_latest_row(supabase: Client, table: str, columns: str, key: str) -> Optional[dict]:
+    """Get the most recently created row of a table, or None if it is empty."""
+    rows = supabase.table(table).select(columns).order("created_at", desc=True, nullsfirst=False).order(key, desc=True).limit(1).execute().data
+    return rows[0] if rows else None
+
+
+def id_bucket(row_id: str, bucket_count: int = DIGEST_BUCKETS) -> Tuple[int, int]:
+    """Get the bucket an ID falls in and its contribution to that bucket's digest.
+
+    Matches the `id_bucket_digests` database function: the bucket comes from the first 32 bits of
+    the ID's MD5, and the digest is the sum of the next 60 bits over the bucket's IDs."""
+    digest = hashlib.md5(row_id.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % bucket_count, int(digest[8:23], 16)
+
+
+def compute_bucket_digests(row_ids: Iterable[str], bucket_count: int = DIGEST_BUCKETS) -> Dict[int, Tuple[int, int]]:
+    """Get the `(row count, digest)` of each non-empty bucket of a set of IDs."""
+    digests: Dict[int, Tuple[int, int]] = {}
+    for row_id in row_ids:
+        bucket, value = id_bucket(row_id, bucket_count)
+        count, total = digests.get(bucket, (0, 0))
+        digests[bucket] = (count + 1, total + value)
+    return digests
+
+
+def get_bucket_digests(supabase: Client, table: str, key: str, bucket_count: int = DIGEST_BUCKETS) -> Dict[int, Tuple[int, int]]:
+    """Get the `(row count, digest)` of each non-empty bucket of a table's IDs from the database."""
+    rows = supabase.rpc("id_bucket_digests", {"table_name": table, "id_field": key, "bucket_count": bucket_count}).execute().data
+    return {row["bucket"]: (row["row_count"], int(row["digest"])) for row in rows}
+
+
+def iter_bucket_ids(supabase: Client, table: str, key: str, bucket: int, bucket_count: int = DIGEST_BUCKETS) -> Iterator[str]:
+    """Yield every ID of a table that falls in one bucket, a page at a time."""
+    after: Optional[str] = None
+    while True:
+        params = {"table_name": table, "id_field": key, "bucket_count": bucket_count, "bucket": bucket, "after": after}
+        rows = supabase.rpc("id_bucket_ids", params).execute().data
+        for row in rows:
+            yield row["id"]
+        if len(rows) < PAGE_SIZE:
+            return
+        after = rows[-1]["id"]
+
+
+def iter_rows_by_key(supabase: Client, table: str, columns: str, key: str, keys: Sequence[str], chunk_size: int = 50) -> Iterator[dict]:
+    """Yield the rows whose `key` is in `keys`, requesting a chunk at a time to keep URLs short."""
+    for i in range(0, len(keys), chunk_size):
+        yield from supabase.table(table).select(columns).in_(key, list(keys[i:i + chunk_size])).execute().data
+
+
+def _is_row_error(error: Exception) -> bool:
+    """Whether a write was rejected because of the rows in it: rows that can't be encoded, a data
+    or constraint error from Postgres, or a 4xx without an error body. Only those are worth bisecting.
+
+    PostgREST's own errors, such as a column missing from the schema cache (PGRST204), are about
+    the request as a whole, so every half of the chunk would fail the same way."""
+    if isinstance(error, (TypeError, ValueError)):
+        return True
+    if not isinstance(error, APIError):
+        return False
+    code = str(error.code or "")
+    if code.isdigit() and len(code) == 3:
+        # PostgREST's error body couldn't be parsed, so the code is the HTTP status
+        return 400 <= int(code) < 500 and int(code) not in (408, 429)
+    if code.startswith("PGRST"):
+        return False
+    return code[:2] in ROW_ERROR_SQLSTATE_CLASSES
+
+
+def _is_transient_error(error: Exception) -> bool:
+    """Whether a write failed in a way that may pass if it is sent again: a transport error, a 5xx,
+    a timeout or rate limit, or Postgres being unreachable or overloaded."""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if not isinstance(error, APIError):
+        return False
+    code = str(error.code or "")
+    if code.isdigit() and len(code) == 3:
+        return int(code) >= 500 or int(code) in (408, 429)
+    if code.startswith("PGRST"):
+        return code[5:6] == "0"
+    return code[:2] in TRANSIENT_SQLSTATE_CLASSES
+
+
+def _upsert_chunk(supabase: Client, table: str, rows: List[dict], metrics: RunMetrics, failing: threading.Event) -> List[dict]:
+    """Upsert a chunk, retrying transient errors with exponential backoff. A chunk rejected for
+    its rows is split in half until the rows that fail are isolated. Any other error, or a
+    transient one that persists, sets `failing`, after which no chunk sends anything more.
+    Returns the rows that could not be written."""
+    for attempt in range(UPSERT_MAX_ATTEMPTS):
+        if failing.is_set():
+            return rows
+        try:
+            with metrics.call(f"upsert_{table}"):
+                metrics.add_bytes(f"upsert_{table}", len(json.dumps(rows)))
+                supabase.table(table).insert(rows, upsert=True).execute()
+            return []
+        except Exception as e:
+            error = e
+        if not _is_transient_error(error) or attempt + 1 == UPSERT_MAX_ATTEMPTS:
+            break
+        time.sleep(UPSERT_RETRY_DELAY * 2 ** attempt)
+
+    if not _is_row_error(error):
+        # The database is unreachable or refuses every write, which the other chunks would only confirm
+        failing.set()
+        print(f"    (Error writing to {table}, giving up on the remaining rows: {error})")
+        return rows
+    if len(rows) == 1:
+        print(f"    (Error writing to {table}: {error}; row: {rows[0]})")
+        return rows
+    middle = len(rows) // 2
+    return _upsert_chunk(supabase, table, rows[:middle], metrics, failing) + _upsert_chunk(supabase, table, rows[middle:], metrics, failing)
+
+
+def upsert_rows(
+    supabase: Client,
+    table: str,
+    rows: Sequence[dict],
+    chunk_size: int = UPSERT_CHUNK_SIZE,
+    max_workers: int = UPSERT_MAX_WORKERS,
+    metrics: Optional[RunMetrics] = None,
+) -> List[dict]:
+    """Upsert rows in chunks of `chunk_size`, sending up to `max_workers` chunks at once.
+
+    Transient errors are retried with backoff, and a chunk rejected for its rows is bisected so
+    that one bad row doesn't fail the rows around it. Once the database looks unavailable, the
+    remaining chunks fail without being sent. Each request is recorded in `metrics` as an `upsert_<table>` call. Returns the rows that could
+    not be written."""
+    if not rows:
+        return []
+
+    chunks = [list(rows[i:i + chunk_size]) for i in range(0, len(rows), chunk_size)]
+    metrics = metrics or RunMetrics()
+    start = time.perf_counter()
+    failing = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        failed = [row for failed_rows in executor.map(lambda chunk: _upsert_chunk(supabase, table, chunk, metrics, failing), chunks) for row in failed_rows]
+    elapsed = time.perf_counter() - start
+
+    written = len(rows) - len(failed)
+    print(f"    (Wrote {written} rows to {table} in {elapsed:.2f}s, {written / elapsed if elapsed else 0:.0f} rows/s, {len(failed)} failed)")
+    return failed
@@ -1,5 +1,5 @@
 from datetime import date
-from typing import List, Optional, Set, Callable
+from typing import Dict, List, Optional, Set, Callable, Tuple
 from pathlib import Path
 from collections import defaultdict
 import asyncio
@@ -7,21 +7,46 @@ import aiohttp
 import feedparser # type: ignore
 import os
 import argparse
-from newspaper import Article # type: ignore
-from openai import OpenAI
 import pandas as pd
-import requests
 from supabase import create_client, Client
-import hashlib
 
+from BatchExtractor import BatchExtractor
 from CacheManager import CacheManager
-from types_consts import FEED_FILE, FILTERABLE_LOCATION_TYPES, Hash, PlaceId, Feed, FeedItem, CustomFeedItem, LLMConstrainedOutput, LocationsDefinition, OptionalGeoBoundaries, GeocodingResultDefinition, GeocodedLocations,ArticlesDefinition, LocationArticleRelationsDefinition
-
-SYSTEM_PROMPT = "Your goal is to extract all points of interest and street addresses from the text provided. For each location, provide all the information that is provided in the text for that specific location. Do NOT included any information that is not included associated with that location; for instance, if a street address is listed without some point of interest name that's separate from the address, only include the relevant address info and leave the point of interest info blank. If the text includes a physical point of interest name with no information about its specific street address, include its name anyways and leave the address fields blank. If the block of text discusses no discrete physical locations, return an empty list."
+from LocationSnapshot import LocationSnapshot
+from NearDuplicateIndex import minhash_signature
+from address_normalizer import canonical_address_key
+from geo_validation import CoverageGrid, validate_geocoded_candidates
+from location_signal import PREFILTER_THRESHOLD, LocationPrefilter, location_paragraphs, location_signal
+from ids import compact_hash
+from db_io import HASH_KEY_PARTITIONS, get_supabase_client, iter_table_rows_concurrently, upsert_rows
+from RunCache import RunCache
+from RunMetrics import RunMetrics
+from ArticleScraper import ArticleScraper
+from GeocodingClient import GeocodingClient
+from LocationExtractor import PACK_TOKEN_BUDGET, LocationExtractor
+from types_consts import FEED_FILE, FILTERABLE_LOCATION_TYPES, LINKNYC_FILE, GeocodedCandidate, Hash, PlaceId, Feed, FeedItem, FeedValidatorsDefinition, CustomFeedItem, LLMConstrainedOutput, LocationsDefinition, OptionalGeoBoundaries, GeocodingResultDefinition, GeocodedLocations,ArticlesDefinition, LocationArticleRelationsDefinition
 
 # Flag to control whether to write to the database
 WRITE_TO_DB = True
 
+# Cache shared by every stage of the run, created by get_run_cache() and written by run_cache.flush()
+RUN_CACHE: Optional[RunCache] = None
+
+# Timings and counters of the run, created by get_run_metrics() and reported at the end of main()
+RUN_METRICS: Optional[RunMetrics] = None
+
+# Area that geocoded locations must also fall in, set by --coverage-check
+COVERAGE_GRID: Optional[CoverageGrid] = None
+
+# Check that skips or trims articles before location extraction, set by --prefilter and --trim-articles
+PREFILTER: Optional[LocationPrefilter] = None
+
+# Estimated tokens of short articles to pack into one extraction request, set by --pack-articles (0 is off)
+EXTRACTION_PACK_TOKENS = 0
+
+FEED_FETCH_TIMEOUT = 30
+FEED_FETCH_LIMIT_PER_HOST = 4
+
 def read_file_csv(file_path: Path) -> pd.DataFrame:
     df = pd.read_csv(file_path)
     return df
@@ -54,26 +79,11 @@ def load_feeds() -> List[Feed]:
     } for item in data.to_dict("records")]
     return feeds
 
-def get_server_articles_recursive(supabase: Client, index: int = 0) -> List[dict]:
-    response = supabase.table("articles").select("*").range(index, index + 1000).execute()
-    if len(response.data) == 1000:
-        return response.data + get_server_articles_recursive(supabase, index + 1000)
-    return response.data
-
-def get_server_locations_recursive(supabase: Client, index: int = 0) -> List[dict]:
-    response = supabase.table("locations").select("place_id").range(index, index + 1000).execute()
-    if len(response.data) == 1000:
-        return response.data + get_server_locations_recursive(supabase, index + 1000)
-    return response.data
-
-def get_server_location_article_relations_recursive(supabase: Client, index: int = 0) -> List[dict]:
-    response = supabase.table("location_article_relations").select("article_uuid,place_id,location_name").range(index, index + 1000).execute()
-    if len(response.data) == 1000:
-        return response.data + get_server_location_article_relations_recursive(supabase, index + 1000)
-    return response.data
-
 def refresh_cache_from_db() -> None:
-    """Update the cache from the database - should only be run when needed to sync."""
+    """Update the cache from the database - should only be run when needed to sync.
+
+    Rows are streamed from the database straight into the cache files, a few key ranges at a time.
+    The location snapshot the gazetteer is built from is rebuilt from the same rows."""
     supabase_url = os.getenv("SUPABASE_URL") or ""
     supabase_key = os.getenv("SUPABASE_SER_KEY") or ""
     cache_mgr = CacheManager()
@@ -83,26 +93,44 @@ def refresh_cache_from_db() -> None:
     print("Refreshing cache from database...")
 
     # Get articles
-    prelim_articles_data = get_server_articles_recursive(supabase)
-    articles = [article["uuid3"] for article in prelim_articles_data]
-    cache_mgr.save_seen_articles(articles)
+    articles = iter_table_rows_concurrently(supabase, "articles", "uuid3", "uuid3", HASH_KEY_PARTITIONS)
+    articles_count = cache_mgr.save_seen_articles(article["uuid3"] for article in articles)
+
+    snapshot = LocationSnapshot()
 
     # Get locations
-    prelim_locations = get_server_locations_recursive(supabase)
-    locations = [location["place_id"] for location in prelim_locations]
-    cache_mgr.save_seen_locations(locations)
+    locations = iter_table_rows_concurrently(supabase, "locations", "place_id,lat,lon,formatted_address,types", "place_id")
+    def add_location_to_snapshot(location: dict) -> PlaceId:
+        snapshot.add_locations([location])  # type: ignore
+        return location["place_id"]
+    locations_count = cache_mgr.save_seen_locations(add_location_to_snapshot(location) for location in locations)
 
     # Get location-article relations
-    prelim_location_article_relations = get_server_location_article_relations_recursive(supabase)
-    location_article_relations = prelim_location_article_relations
-    cache_mgr.save_location_article_relations(location_article_relations)
+    location_article_relations = iter_table_rows_concurrently(supabase, "location_article_relations", "id,article_uuid,place_id,location_name", "id", HASH_KEY_PARTITIONS)
+    location_article_relations_count = cache_mgr.save_location_article_relations(location_article_relations)
+
+    cache_mgr.save_location_snapshot(snapshot.to_bytes())
     
-    print(f"Cache refreshed with {len(articles)} articles, {len(locations)} locations, and {len(location_article_relations)} relations")
+    print(f"Cache refreshed with {articles_count} articles, {locations_count} locations, and {location_article_relations_count} relations")
+
+def get_run_cache() -> RunCache:
+    """Get the run-wide cache, creating it on first use."""
+    global RUN_CACHE
+    if RUN_CACHE is None:
+        RUN_CACHE = RunCache()
+    return RUN_CACHE
+
+def get_run_metrics() -> RunMetrics:
+    """Get the run-wide metrics, creating them on first use."""
+    global RUN_METRICS
+    if RUN_METRICS is None:
+        RUN_METRICS = RunMetrics()
+    return RUN_METRICS
 
 def hash(string: Optional[str]) -> Hash:
     if not string:
         return ""
-    return str(int(hashlib.sha256(string.encode('utf-8')).hexdigest(), 16))
+    return compact_hash(string)
 
 def feed_item_standardizer(item: dict) -> FeedItem:
     """Standardize the individual item results into a predictable, library-agnostic format."""
@@ -114,26 +142,49 @@ def feed_item_standardizer(item: dict) -> FeedItem:
         "author": item.get("author"),
     }
 
-async def parse_feed(feed: Feed) -> List[FeedItem]:
-    """For a given RSS feed URL, get all current items."""
+async def parse_feed(feed: Feed, session: aiohttp.ClientSession, validators: Optional[FeedValidatorsDefinition] = None) -> Tuple[List[FeedItem], Optional[FeedValidatorsDefinition]]:
+    """For a given RSS feed URL, get all current items.
+
+    Sends the feed's cached validators as a conditional GET; an unchanged feed returns no items.
+    Also returns the validators to cache for the feed, or None if the request failed."""
 
     url = feed.get("url", "")
+    headers = {}
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
 
+    metrics = get_run_metrics()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
+        with metrics.call("feed_fetch"):
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    print(f"0. {feed.get('name', '')} (Not modified)")
+                    metrics.count("feeds_not_modified")
+                    return [], validators
+                response.raise_for_status()
+                metrics.add_bytes("feed_fetch", len(await response.read()))
                 content = await response.text()
+                new_validators: FeedValidatorsDefinition = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
         parsedFeed = feedparser.parse(content)
     except Exception as e:
         print(f"Error parsing {feed.get('name', '')} feed: {e}")
-        return []
-    return [{**feed_item_standardizer(item), "feed": feed} for item in parsedFeed.entries]
+        return [], None
+    return [{**feed_item_standardizer(item), "feed": feed} for item in parsedFeed.entries], new_validators
 
 async def fetch_new_articles() -> List[FeedItem]:
-    """Check RSS feeds for new articles that are not included in the local cache."""
-    cache_mgr = CacheManager()
-    seen_articles: List[Hash] = cache_mgr.load_seen_articles()
+    """Check RSS feeds for new articles that are not included in the local cache.
+
+    All feeds are fetched concurrently over one pooled session."""
+    run_cache = get_run_cache()
+    seen_articles = run_cache.seen_articles
+    feed_validators = run_cache.feed_validators
     new_articles: List[FeedItem] = []
+    new_article_ids: Set[Hash] = set()
     seen_headlines: Set[str] = set()  
     seen_links: Set[str] = set()  
 
@@ -142,96 +193,165 @@ async def fetch_new_articles() -> List[FeedItem]:
     TEMP_ARTICLES_LIMIT = 1001.5
     articles_count = 0
 
-    for feed in feeds:
+    connector = aiohttp.TCPConnector(limit_per_host=FEED_FETCH_LIMIT_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=FEED_FETCH_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        parsed_feeds = await asyncio.gather(*(parse_feed(feed, session, feed_validators.get(feed["url"])) for feed in feeds))
+
+    for feed, (articles, validators) in zip(feeds, parsed_feeds):
         print(f"0. {feed['name']} (Parsing)")
         if articles_count >= TEMP_ARTICLES_LIMIT:
             continue
-        articles = await parse_feed(feed)
+        feed_article_ids: List[Hash] = []
         for article in articles:
             hashed_id = hash(article.get("id"))
             headline = article.get("title")
             link = article.get("link")
             if not hashed_id or articles_count >= TEMP_ARTICLES_LIMIT or headline is None or link is None:
                 continue
-            if hashed_id in seen_articles or headline in seen_headlines or link in seen_links:
+            if hashed_id in new_article_ids or hashed_id in seen_articles or headline in seen_headlines or link in seen_links:
                 # Skip articles with duplicate IDs or headlines
                 continue
 
             print(f"    (New: {headline})")
             articles_count += 1
             new_articles.append(article)
-            seen_articles.append(hashed_id)
+            new_article_ids.add(hashed_id)
+            feed_article_ids.append(hashed_id)
             seen_headlines.add(headline)
             seen_links.add(link)
 
+        # Only skip a feed next time if every one of its entries was considered this time.
+        if validators is not None and articles_count < TEMP_ARTICLES_LIMIT:
+            run_cache.pending_feed_validators[feed["url"]] = validators
+            run_cache.pending_feed_articles[feed["url"]] = feed_article_ids
+
+    get_run_metrics().count("articles_new", len(new_articles))
     # No need to save here as we'll update at the end of the workflow
     return new_articles
 
-async def scrap(url: Optional[str]) -> str:
-    """Get data from provided article URLs."""
-    if not url:
-        return ""
+async def add_article_full_content(article: FeedItem, scraper: ArticleScraper) -> FeedItem:
+    if article.get("fullText") or not article.get("link"):
+        return article
     
-    try:
-        article = Article(url)
-        article.download()
-        article.parse()
-        return article.text
-    except Exception as e:
-        print(f"    (Error: {e})")
-        return ""
+    print(f"- 1. {article.get('title', '')} (Scraping)")
+
+    # TODO: do we want to add other information here like author?
+    content = await scraper.scrape(article.get("link"))
+    article["content"] = content
+
+    return article
 
 async def add_articles_full_content(articles: List[FeedItem]) -> List[FeedItem]:
     """For those articles that are missing full text, fetch the full content."""
-    async def process_article(article: FeedItem) -> FeedItem:
-        if article.get("fullText") or not article.get("link"):
-            return article
-        
-        print(f"- 1. {article.get('title', '')} (Scraping)")
-
-        # TODO: do we want to add other information here like author?
-        content = await scrap(article.get("link"))
-        article["content"] = content
+    async with ArticleScraper(metrics=get_run_metrics()) as scraper:
+        return await asyncio.gather(*(add_article_full_content(article, scraper) for article in articles))
 
-        return article
+async def add_article_locations(articles: List[FeedItem]) -> List[CustomFeedItem]:
+    """For each article, extract location information.
 
-    return await asyncio.gather(*(process_article(article) for article in articles))
+    Articles are processed concurrently over one shared client, and text that was extracted before is answered from the extraction cache. Articles whose extraction fails are left out, so they are picked up again on the next run."""
+    extraction_cache = get_run_cache().extraction_cache
 
-def add_article_locations(articles: List[FeedItem]) -> List[CustomFeedItem]:
-    """For each article, extract location information."""
-    return [add_article_location(article) for article in articles]
+    async with LocationExtractor(os.getenv("OPENAI_API_KEY"), cache=extraction_cache, metrics=get_run_metrics(), pack_tokens=EXTRACTION_PACK_TOKENS) as extractor:
+        articles_with_locations = await asyncio.gather(*(add_article_location(article, extractor) for article in articles))
 
-def add_article_location(article: FeedItem) -> CustomFeedItem:
-    key = os.getenv("OPENAI_API_KEY")
-    client = OpenAI(api_key=key)
+    report_extraction_caches()
+    return [article for article in articles_with_locations if article]
 
+def extraction_content(article: FeedItem) -> Optional[str]:
+    """Get the text an article's locations would be extracted from, or None if the pre-filter
+    skips it. Unlike add_article_location, this doesn't count toward the pre-filter's savings."""
+    content = article.get("content") or ""
+    if not PREFILTER:
+        return content
+    if location_signal(content) < PREFILTER.threshold:
+        return None
+    return location_paragraphs(content) if PREFILTER.trim else content
+
+async def defer_article_locations(batch_extractor: BatchExtractor, articles: List[FeedItem], submit: bool) -> None:
+    """Queue the extraction of the articles as a batch job, whose results a later run ingests."""
+    job = batch_extractor.create_job(articles, [extraction_content(article) for article in articles], get_run_cache().extraction_cache)
+    print(f"- 2. Deferred {job['articles']} articles ({job['requests']} extraction requests) to batch job {job['job_id']}")
+    if submit:
+        await batch_extractor.submit_job(job["job_id"])
+        print(f"    (Submitted as batch {batch_extractor.jobs[job['job_id']]['batch_id']})")
+
+def report_extraction_caches() -> None:
+    """Print and record how often extraction was answered from the extraction cache or a near-duplicate.
+
+    The caches keep totals for the whole run, so the metrics are set to them rather than added to,
+    and this can be called after each batch of articles."""
+    run_cache, metrics = get_run_cache(), get_run_metrics()
+    extraction_cache, near_duplicates = run_cache.extraction_cache, run_cache.near_duplicates
+    print(f"    (Extraction cache: {extraction_cache.hits} hits, {extraction_cache.misses} misses)")
+    print(f"    (Near-duplicates: {near_duplicates.hits} reused)")
+    metrics.set("extraction_cache_hits", extraction_cache.hits)
+    metrics.set("extraction_cache_misses", extraction_cache.misses)
+    metrics.set("near_duplicates_reused", near_duplicates.hits)
+    if PREFILTER:
+        print(f"    (Pre-filter: {PREFILTER.skipped} LLM calls avoided, {PREFILTER.trimmed_chars} characters trimmed)")
+        metrics.set("llm_calls_avoided", PREFILTER.skipped)
+        metrics.set("llm_chars_trimmed", PREFILTER.trimmed_chars)
+
+async def add_article_location(article: FeedItem, extractor: LocationExtractor) -> Optional[CustomFeedItem]:
+    """Extract an article's locations, or reuse those of a near-duplicate extracted before. With the
+    pre-filter, articles without a location signal get no locations without calling the LLM."""
     print(f"- 2. {article.get('title', '')} (Parsing)")
 
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": article.get("content") or ""},
-        ],
-        response_format=LLMConstrainedOutput,
-    )
+    near_duplicates = get_run_cache().near_duplicates
+    signature = minhash_signature(article.get("content") or "")
+    locations = await near_duplicates.find_locations(signature) if signature is not None else None
+    if locations is not None:
+        print(f"    (Near-duplicate, locations: {locations})")
+        return {
+            "item": article,
+            "locations": dict.fromkeys(locations, None),
+        }
+
+    content = article.get("content") or ""
+    if PREFILTER:
+        if not PREFILTER.should_extract(content):
+            print(f"    (No location signal)")
+            return {
+                "item": article,
+                "locations": {},
+            }
+        content = PREFILTER.prepare(content)
 
-    parsed_message = completion.choices[0].message.parsed
-    if not parsed_message or not getattr(parsed_message, "locations"):
-        locations = []
-    else:
-        locations = [", ".join(f"{v}" for _, v in d.items() if v) for d in parsed_message.locations]
+    article_id = hash(article.get("id"))
+    if signature is not None:
+        near_duplicates.start_extraction(article_id, signature)
+    extracted_locations: Optional[List[str]] = None
+    try:
+        parsed_message = await extractor.extract(content, article.get("extraction_key"))
+        locations: List[str] = []
+        canonical_keys: Dict[str, str] = {}
+        if parsed_message and getattr(parsed_message, "locations"):
+            for d in parsed_message.locations:
+                location = ", ".join(f"{v}" for _, v in d.items() if v)
+                locations.append(location)
+                canonical_key = canonical_address_key(d)
+                if canonical_key:
+                    canonical_keys.setdefault(location, canonical_key)
+        extracted_locations = locations
+    except Exception as e:
+        print(f"    (Error extracting locations from {article.get('title', '')}: {e})")
+        return None
+    finally:
+        # Also when this task is cancelled, so near-duplicates waiting on it extract themselves
+        near_duplicates.finish_extraction(article_id, extracted_locations)
     print(f"    (Locations: {locations})")
 
     return {
         "item": article,
         "locations": dict.fromkeys(locations, None),
+        "canonical_keys": canonical_keys,
     }
 
 def filter_new_geocoded_full_locations(new_geocoded_full_locations: List[LocationsDefinition]) -> List[LocationsDefinition]:
     """Filter out locations that are already in the cache, and remove duplicate entries based on their place_id."""
-    cache_mgr = CacheManager()
-    seen_locations = cache_mgr.load_seen_locations()
+    seen_locations = get_run_cache().seen_locations
     unseen_locations: List[LocationsDefinition] = []
 
     for location in new_geocoded_full_locations:
@@ -257,52 +377,88 @@ def get_geo_boundaries(article: CustomFeedItem) -> OptionalGeoBoundaries | None:
 async def add_geocoded_locations(articles: List[CustomFeedItem]) -> GeocodingResultDefinition:
     """For each article, geocode the locations."""
 
-    new_geocoded_full_locations: List[LocationsDefinition] = []
-    def add_new_geocoded_location(location: LocationsDefinition) -> None:
-        """Add a new geocoded location to the cache in this function. Workaround until this is all in a class."""
-        new_geocoded_full_locations.append(location)
+    candidates: List[GeocodedCandidate] = []
+
+    async with GeocodingClient(os.getenv("GOOGLE_MAPS_API_KEY"), metrics=get_run_metrics()) as geocoding_client:
+        articles_with_geo = await asyncio.gather(*(add_geocoded_location(article, geocoding_client, candidates.append, get_geo_boundaries(article)) for article in articles))
 
-    articles_with_geo = await asyncio.gather(*(add_geocoded_location(article, add_new_geocoded_location, get_geo_boundaries(article)) for article in articles))
+    accepted_candidates = reject_out_of_bounds_locations(articles_with_geo, candidates)
 
     # TODO: Preliminary solution to avoid upsert errors.
-    filtered_new_geocoded_full_locations = filter_new_geocoded_full_locations(new_geocoded_full_locations)
+    filtered_new_geocoded_full_locations = filter_new_geocoded_full_locations([candidate["location"] for candidate in accepted_candidates])
 
     return {
         "articles": articles_with_geo, 
-        "new_geocoded_full_locations": filtered_new_geocoded_full_locations
+        "new_geocoded_full_locations": filtered_new_geocoded_full_locations,
+        "accepted_candidates": accepted_candidates,
     }
 
-async def add_geocoded_location(article: CustomFeedItem, add_new_geocoded_location: Callable[[LocationsDefinition], None], geo_boundaries: Optional[OptionalGeoBoundaries]) -> CustomFeedItem:
+async def add_geocoded_location(article: CustomFeedItem, geocoding_client: GeocodingClient, add_geocoded_candidate: Callable[[GeocodedCandidate], None], geo_boundaries: Optional[OptionalGeoBoundaries]) -> CustomFeedItem:
     locations = article["locations"]
+    canonical_keys = article.get("canonical_keys", {})
 
-    geocoded_locations = await geocode_locations(locations, add_new_geocoded_location, geo_boundaries)
+    geocoded_locations = await geocode_locations(locations, canonical_keys, geocoding_client, add_geocoded_candidate, geo_boundaries)
     return {
         "item": article["item"],
         "locations": geocoded_locations,
+        "canonical_keys": canonical_keys,
     }
 
-async def geocode_locations(locations: GeocodedLocations, add_new_geocoded_location: Callable[[LocationsDefinition], None], geo_boundaries: Optional[OptionalGeoBoundaries]) -> GeocodedLocations:
+async def geocode_locations(locations: GeocodedLocations, canonical_keys: Dict[str, str], geocoding_client: GeocodingClient, add_geocoded_candidate: Callable[[GeocodedCandidate], None], geo_boundaries: Optional[OptionalGeoBoundaries]) -> GeocodedLocations:
     """For each location, make a request to Google Maps API to get geocoding information."""
     
     returned_locations: GeocodedLocations = defaultdict()
 
-    for location in locations:
-        geocoded_location = await geocode_location(location, add_new_geocoded_location, geo_boundaries)
+    geocoded_locations = await asyncio.gather(*(geocode_location(location, canonical_keys.get(location), geocoding_client, add_geocoded_candidate, geo_boundaries) for location in locations))
+    for location, geocoded_location in zip(locations, geocoded_locations):
         if geocoded_location:
             returned_locations[location] = geocoded_location
 
     return returned_locations
 
-def get_location_in_alias_cache(location: str) -> PlaceId | None:
-    """Extract the location from the cache, if present."""
-    cache_mgr = CacheManager()
-    aliases = cache_mgr.load_location_aliases()
-    match = [alias for alias in aliases if alias["alias"] == location]
+def reject_out_of_bounds_locations(articles: List[CustomFeedItem], candidates: List[GeocodedCandidate]) -> List[GeocodedCandidate]:
+    """Check every new geocoding result against its feed's boundaries in one pass. Returns the
+    accepted results, one per location string and feed boundaries.
+
+    Google only uses the boundaries as a bias, so results can land outside them. Accepted results are
+    added to the alias cache by record_results, once their location is in the database. Rejected ones
+    are cached as negative aliases, so they aren't geocoded again, and removed from their articles."""
+    alias_index = get_run_cache().alias_index
+    accepted_candidates: List[GeocodedCandidate] = []
+    checked: Set[Tuple[str, Optional[str]]] = set()
+    rejected: Set[Tuple[str, Optional[str]]] = set()
+
+    for candidate, accepted in zip(candidates, validate_geocoded_candidates(candidates, COVERAGE_GRID)):
+        key = (candidate["alias"], hash_geo_boundaries(candidate["geo_boundaries"]))
+        if key in checked:
+            continue
+        checked.add(key)
+        if accepted:
+            accepted_candidates.append(candidate)
+        else:
+            print(f"- 3. {candidate['alias']}")
+            print(f"    (Out of bounds: {candidate['location']['lat']}, {candidate['location']['lon']})")
+            get_run_metrics().count("locations_out_of_bounds")
+            alias_index.add_negative(candidate["alias"], "out of bounds", key[1], candidate["canonical_key"])
+            rejected.add(key)
 
-    if not match:
+    if rejected:
+        for article in articles:
+            geo_boundary_hash = hash_geo_boundaries(get_geo_boundaries(article))
+            for location in [location for location in article["locations"] if (location, geo_boundary_hash) in rejected]:
+                del article["locations"][location]
+
+    return accepted_candidates
+
+def hash_geo_boundaries(geo_boundaries: Optional[OptionalGeoBoundaries]) -> Optional[str]:
+    """Get a stable key for a feed's bounding box, used to scope location aliases."""
+    if not geo_boundaries:
         return None
+    return hash(f"{geo_boundaries.get('minLat')},{geo_boundaries.get('minLon')}|{geo_boundaries.get('maxLat')},{geo_boundaries.get('maxLon')}")
 
-    return match[0]["place_id"]
+def get_location_in_alias_cache(location: str, geo_boundary_hash: Optional[str] = None, canonical_key: Optional[str] = None) -> PlaceId | None:
+    """Extract the location from the cache, if present, matching its canonical address key too."""
+    return get_run_cache().alias_index.lookup(location, geo_boundary_hash, canonical_key)
 
 def is_location_unspecific(types_list: List[str]) -> bool:
     """Check if the location too generic to be included in the map."""
@@ -318,42 +474,66 @@ def format_geocoding_results_for_cache(result: dict) -> LocationsDefinition:
         "types": result.get("types"),
     }
 
-async def geocode_location(location: str, add_new_geocoded_location: Callable[[LocationsDefinition], None], geo_boundaries: Optional[OptionalGeoBoundaries]) -> PlaceId | None:
-    """Make a request to Google Maps API to get geocoding information. Returns the place_id."""
+async def geocode_location(location: str, canonical_key: Optional[str], geocoding_client: GeocodingClient, add_geocoded_candidate: Callable[[GeocodedCandidate], None], geo_boundaries: Optional[OptionalGeoBoundaries]) -> PlaceId | None:
+    """Make a request to Google Maps API to get geocoding information. Returns the place_id.
+
+    Locations the local gazetteer knows are resolved without a request. Locations that could not be
+    geocoded are written through to the alias cache. New results are passed to `add_geocoded_candidate`,
+    and only cached once reject_out_of_bounds_locations accepts them and their location is written."""
+
+    alias_index = get_run_cache().alias_index
+    geo_boundary_hash = hash_geo_boundaries(geo_boundaries)
+
+    metrics = get_run_metrics()
 
-    cached_location = get_location_in_alias_cache(location)
+    cached_location = get_location_in_alias_cache(location, geo_boundary_hash, canonical_key)
     if cached_location:
         print(f"- 3. {location}")
         print(f"    (Cached)")
+        metrics.count("alias_cache_hits")
         return cached_location
 
-    key = os.getenv("GOOGLE_MAPS_API_KEY")
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
+    cached_failure = alias_index.lookup_negative(location, geo_boundary_hash, canonical_key)
+    if cached_failure:
+        print(f"- 3. {location}")
+        print(f"    (Cached: {cached_failure})")
+        metrics.count("alias_cache_hits")
+        return None
+
+    metrics.count("alias_cache_misses")
+
+    # Places resolved before, under another spelling, or in the address points file
+    known_location = get_run_cache().gazetteer.lookup(location, canonical_key)
+    if known_location:
+        print(f"- 3. {location}")
+        print(f"    (Gazetteer: {known_location['formatted_address']})")
+        metrics.count("gazetteer_cache_hits")
+        add_geocoded_candidate({"alias": location, "canonical_key": canonical_key, "location": known_location, "geo_boundaries": geo_boundaries})
+        return known_location["place_id"]
+    metrics.count("gazetteer_cache_misses")
+
     bounds = f"{geo_boundaries['minLat']},{geo_boundaries['minLon']}|{geo_boundaries['maxLat']},{geo_boundaries['maxLon']}" if geo_boundaries else None
-    params = {
-        "key": key,
-        "address": location,
-        "bounds": bounds,
-    }
 
     print(f"- 3. {location} (Geocoding)")
 
-    response = requests.get(url, params=params)
-    data = response.json()
-    if response.status_code != 200 or data["status"] != "OK":
+    data = await geocoding_client.geocode(location, bounds)
+    # Other statuses (quota, denied, server errors) are transient, so they aren't cached.
+    if not data or data["status"] not in ("OK", "ZERO_RESULTS"):
         return None
     
     if not data["results"]:
         print(f"    (No results)")
+        alias_index.add_negative(location, "no results", geo_boundary_hash, canonical_key)
         return None
     
     if is_location_unspecific(data["results"][0]["types"]):
         print(f"    (Location not specific enough: {data['results'][0]['types']})")
+        alias_index.add_negative(location, "not specific enough", geo_boundary_hash, canonical_key)
         return None
 
     formatted_location = format_geocoding_results_for_cache(data["results"][0])
 
-    add_new_geocoded_location(formatted_location)
+    add_geocoded_candidate({"alias": location, "canonical_key": canonical_key, "location": formatted_location, "geo_boundaries": geo_boundaries})
     return formatted_location["place_id"]
 
 def is_feed_item_with_locations(item: CustomFeedItem) -> bool:
@@ -414,89 +594,256 @@ def generate_location_article_relations(items: List[CustomFeedItem]) -> List[Loc
 
     return to_return
 
-def send_articles_to_db(articles: List[ArticlesDefinition]) -> None:
-    """Send articles to the Supabase database."""
+def send_articles_to_db(articles: List[ArticlesDefinition]) -> List[ArticlesDefinition]:
+    """Send articles to the Supabase database. Returns the articles that could not be written."""
     if not WRITE_TO_DB:
         print(f"Dry run: Would have sent {len(articles)} articles to Supabase.")
-        return
-    
-    supabase_url = os.getenv("SUPABASE_URL") or ""
-    supabase_key = os.getenv("SUPABASE_SER_KEY") or ""
+        return []
 
     if len(articles) == 0:
         print("No new articles to send to Supabase.")
-        return
-
-    supabase = create_client(supabase_url, supabase_key)
+        return []
 
     print(f"- 4. Sending {len(articles)} articles to Supabase")
     print(f"    {len([article for article in articles if article['headline']])} with location data, {len([article for article in articles if not article['headline']])} without")
 
-    supabase.table("articles").insert(articles, upsert=True).execute()
+    return upsert_rows(get_supabase_client(), "articles", articles, metrics=get_run_metrics())
 
-def send_locations_to_db(locations: List[LocationsDefinition]) -> None:
+def send_locations_to_db(locations: List[LocationsDefinition]) -> List[LocationsDefinition]:
     if not WRITE_TO_DB:
         print(f"Dry run: Would have sent {len(locations)} locations to Supabase.")
-        return
-    
-    supabase_url = os.getenv("SUPABASE_URL") or ""
-    supabase_key = os.getenv("SUPABASE_SER_KEY") or ""
+        return []
 
     if len(locations) == 0:
         print("No new locations to send to Supabase.")
-        return
+        return []
 
-    supabase = create_client(supabase_url, supabase_key)
     print(f"- 5. Sending {len(locations)} locations to Supabase")
-    supabase.table("locations").insert(list(locations), upsert=True).execute()
+    return upsert_rows(get_supabase_client(), "locations", locations, metrics=get_run_metrics())
 
-def send_location_article_relations_to_db(location_article_relations: List[LocationArticleRelationsDefinition]) -> None:
+def send_location_article_relations_to_db(location_article_relations: List[LocationArticleRelationsDefinition]) -> List[LocationArticleRelationsDefinition]:
     if not WRITE_TO_DB:
         print(f"Dry run: Would have sent {len(location_article_relations)} location-article relations to Supabase.")
-        return
-    
-    supabase_url = os.getenv("SUPABASE_URL") or ""
-    supabase_key = os.getenv("SUPABASE_SER_KEY") or ""
+        return []
 
     if len(location_article_relations) == 0:
         print("No new location-article relations to send to Supabase.")
-        return
+        return []
 
-    supabase = create_client(supabase_url, supabase_key)
     print(f"- 6. Sending {len(location_article_relations)} location-article relations to Supabase")
-    supabase.table("location_article_relations").insert(location_article_relations, upsert=True).execute()
+    return upsert_rows(get_supabase_client(), "location_article_relations", location_article_relations, metrics=get_run_metrics())
+
+def write_results_to_db(
+    articles: List[ArticlesDefinition],
+    locations: List[LocationsDefinition],
+    location_article_relations: List[LocationArticleRelationsDefinition],
+) -> Tuple[List[ArticlesDefinition], List[LocationsDefinition], List[LocationArticleRelationsDefinition]]:
+    """Send the rows of processed articles to the database. Returns the rows that were written.
+
+    Only the database is touched, not the cache, so this can run in a worker thread."""
+    failed_articles = {article["uuid3"] for article in send_articles_to_db(articles)}
+    failed_locations = {location["place_id"] for location in send_locations_to_db(locations)}
+    failed_relations = {relation["id"] for relation in send_location_article_relations_to_db(location_article_relations)}
+    return (
+        [article for article in articles if article["uuid3"] not in failed_articles],
+        [location for location in locations if location["place_id"] not in failed_locations],
+        [relation for relation in location_article_relations if relation["id"] not in failed_relations],
+    )
 
-def handle_articles_result(new_articles_with_geocoded_locations: List[ArticlesDefinition]) -> None:
-    """Add the new articles to the cache."""
-    cache_mgr = CacheManager()
-    seen_articles = cache_mgr.load_seen_articles()
-    seen_articles.extend([article["uuid3"] for article in new_articles_with_geocoded_locations])
-    cache_mgr.save_seen_articles(seen_articles)
-    send_articles_to_db(new_articles_with_geocoded_locations)
+def handle_articles_result(written_articles: List[ArticlesDefinition]) -> None:
+    """Add the new articles written to the database to the cache."""
+    get_run_cache().add_seen_articles([article["uuid3"] for article in written_articles])
+
+def handle_locations_result(written_locations: List[LocationsDefinition]) -> None:
+    """Add the new geocoded locations written to the database to the cache."""
+    get_run_cache().add_seen_locations([location["place_id"] for location in written_locations])
+    get_run_cache().add_to_location_snapshot(written_locations)
+    get_run_cache().add_to_gazetteer(written_locations)
+
+def handle_location_aliases_result(accepted_candidates: List[GeocodedCandidate]) -> None:
+    """Add the accepted geocoding results whose location is in the database to the alias cache.
+    The others would point later runs at a place that was never written."""
+    run_cache = get_run_cache()
+    for candidate in accepted_candidates:
+        place_id = candidate["location"]["place_id"]
+        if place_id in run_cache.seen_locations:
+            run_cache.alias_index.add(candidate["alias"], place_id, hash_geo_boundaries(candidate["geo_boundaries"]), candidate["canonical_key"])
+
+def handle_location_article_relations_result(written_location_article_relations: List[LocationArticleRelationsDefinition]) -> None:
+    """Add the new location-article relations written to the database to the cache."""
+    get_run_cache().add_location_article_relations(written_location_article_relations)
+
+def result_rows(articles_with_geocoded_locations: List[CustomFeedItem]) -> Tuple[List[ArticlesDefinition], List[LocationArticleRelationsDefinition]]:
+    """Get the article and location-article relation rows of processed articles."""
+    return filter_and_reorganize_articles(articles_with_geocoded_locations), generate_location_article_relations(articles_with_geocoded_locations)
+
+def record_results(
+    articles_with_geocoded_locations: List[CustomFeedItem],
+    accepted_candidates: List[GeocodedCandidate],
+    written_articles: List[ArticlesDefinition],
+    written_locations: List[LocationsDefinition],
+    written_location_article_relations: List[LocationArticleRelationsDefinition],
+) -> None:
+    """Add the rows written to the database to the cache, and count them."""
+    handle_articles_result(written_articles)
+    handle_locations_result(written_locations)
+    handle_location_aliases_result(accepted_candidates)
+    handle_location_article_relations_result(written_location_article_relations)
+
+    metrics = get_run_metrics()
+    metrics.count("articles_with_locations", sum(1 for article in articles_with_geocoded_locations if is_feed_item_with_locations(article)))
+    metrics.count("locations_new", len(written_locations))
+    metrics.count("location_article_relations_new", len(written_location_article_relations))
+
+def handle_results(articles_with_geocoded_locations: List[CustomFeedItem], new_geocoded_full_locations: List[LocationsDefinition], accepted_candidates: List[GeocodedCandidate]) -> List[ArticlesDefinition]:
+    """Write processed articles, their new locations and the relations between them to the cache and database.
+    Returns the article rows that were written."""
+    filtered_articles, location_article_relations = result_rows(articles_with_geocoded_locations)
+    with get_run_metrics().stage("write"):
+        written = write_results_to_db(filtered_articles, new_geocoded_full_locations, location_article_relations)
+    record_results(articles_with_geocoded_locations, accepted_candidates, *written)
+
+    run_cache = get_run_cache()
+    if run_cache.checkpoint:
+        run_cache.flush()
+    return written[0]
+
+async def handle_results_in_thread(articles_with_geocoded_locations: List[CustomFeedItem], new_geocoded_full_locations: List[LocationsDefinition], accepted_candidates: List[GeocodedCandidate]) -> None:
+    """Like `handle_results`, but the database writes and cache checkpoint run in a worker thread,
+    so that the event loop keeps serving the other stages meanwhile."""
+    filtered_articles, location_article_relations = result_rows(articles_with_geocoded_locations)
+    with get_run_metrics().stage("write"):
+        written = await asyncio.to_thread(write_results_to_db, filtered_articles, new_geocoded_full_locations, location_article_relations)
+    record_results(articles_with_geocoded_locations, accepted_candidates, *written)
+
+    run_cache = get_run_cache()
+    if run_cache.checkpoint:
+        await run_cache.flush_in_thread()
+
+async def run_streaming_pipeline(
+    articles: List[FeedItem],
+    scrape_workers: int = 8,
+    extract_workers: int = 8,
+    geocode_workers: int = 4,
+    flush_size: int = 25,
+) -> None:
+    """Stream each article through scraping, extraction and geocoding, so that the stages overlap.
+
+    Stages are connected by bounded queues, so a slow stage holds back the ones before it. Results
+    are written to the cache and database every `flush_size` articles instead of once at the end,
+    with the database writes in a worker thread. Articles a stage fails on are counted and dropped.
+    If a write fails, the remaining articles are drained without being processed and the error is
+    raised once every stage has stopped."""
+    scrape_queue: asyncio.Queue[FeedItem] = asyncio.Queue()
+    extract_queue: asyncio.Queue[FeedItem] = asyncio.Queue(maxsize=2 * extract_workers)
+    geocode_queue: asyncio.Queue[CustomFeedItem] = asyncio.Queue(maxsize=2 * geocode_workers)
+    results_queue: asyncio.Queue[CustomFeedItem] = asyncio.Queue(maxsize=2 * flush_size)
+
+    pending_articles: List[CustomFeedItem] = []
+    # The first error raised writing results, after which the stages only drain their queues
+    write_errors: List[Exception] = []
+    # Geocoding results of each article on its way to the sink, by id() of the article
+    pending_candidates: Dict[int, List[GeocodedCandidate]] = {}
+
+    async def geocode_article(article: CustomFeedItem, geocoding_client: GeocodingClient) -> CustomFeedItem:
+        candidates: List[GeocodedCandidate] = []
+        geocoded_article = await add_geocoded_location(article, geocoding_client, candidates.append, get_geo_boundaries(article))
+        pending_candidates[id(geocoded_article)] = candidates
+        return geocoded_article
+
+    async def flush() -> None:
+        if not pending_articles:
+            return
+        print(f"- Flushing {len(pending_articles)} articles")
+        articles = list(pending_articles)
+        pending_articles.clear()
+        candidates = [candidate for article in articles for candidate in pending_candidates.pop(id(article), [])]
+        accepted_candidates = reject_out_of_bounds_locations(articles, candidates)
+        new_locations = filter_new_geocoded_full_locations([candidate["location"] for candidate in accepted_candidates])
+        await handle_results_in_thread(articles, new_locations, accepted_candidates)
+
+    async def stage(name: str, queue: asyncio.Queue, process: Callable, next_queue: Optional[asyncio.Queue]) -> None:
+        while True:
+            item = await queue.get()
+            try:
+                if write_errors:
+                    continue
+                result = await process(item)
+                if result is not None and next_queue is not None:
+                    await next_queue.put(result)
+            except Exception as e:
+                # The article is dropped; its feed's validators are kept, so it's fetched again next run
+                metrics.count(f"{name}_stage_errors")
+                print(f"    (Error in {name} stage: {e})")
+            finally:
+                queue.task_done()
+
+    async def sink() -> None:
+        while True:
+            article = await results_queue.get()
+            try:
+                if write_errors:
+                    continue
+                pending_articles.append(article)
+                if len(pending_articles) >= flush_size:
+                    await flush()
+            except Exception as e:
+                metrics.count("write_stage_errors")
+                print(f"    (Error writing results: {e})")
+                write_errors.append(e)
+            finally:
+                results_queue.task_done()
+
+    extraction_cache = get_run_cache().extraction_cache
+    metrics = get_run_metrics()
+
+    async with ArticleScraper(metrics=metrics) as scraper, \
+            LocationExtractor(os.getenv("OPENAI_API_KEY"), cache=extraction_cache, metrics=metrics, pack_tokens=EXTRACTION_PACK_TOKENS) as extractor, \
+            GeocodingClient(os.getenv("GOOGLE_MAPS_API_KEY"), metrics=metrics) as geocoding_client:
+        stages = [
+            (scrape_queue, [stage("scrape", scrape_queue, lambda article: add_article_full_content(article, scraper), extract_queue) for _ in range(scrape_workers)]),
+            (extract_queue, [stage("extract", extract_queue, lambda article: add_article_location(article, extractor), geocode_queue) for _ in range(extract_workers)]),
+            (geocode_queue, [stage("geocode", geocode_queue, lambda article: geocode_article(article, geocoding_client), results_queue) for _ in range(geocode_workers)]),
+            (results_queue, [sink()]),
+        ]
+        tasks = [[asyncio.create_task(worker) for worker in workers] for _, workers in stages]
 
-def handle_locations_result(new_geocoded_full_locations: List[LocationsDefinition]) -> None:
-    """Add the new geocoded locations to the cache."""
-    cache_mgr = CacheManager()
-    seen_locations = cache_mgr.load_seen_locations()
-    seen_locations.extend([location["place_id"] for location in new_geocoded_full_locations])
-    cache_mgr.save_seen_locations(seen_locations)
-    send_locations_to_db(new_geocoded_full_locations)
+        for article in articles:
+            scrape_queue.put_nowait(article)
 
-def handle_location_article_relations_result(new_location_article_relations: List[LocationArticleRelationsDefinition]) -> None:
-    """Add the new location-article relations to the cache."""
-    cache_mgr = CacheManager()
-    location_article_relations = cache_mgr.load_location_article_relations()
-    location_article_relations.extend(new_location_article_relations)
-    cache_mgr.save_location_article_relations(location_article_relations)
-    send_location_article_relations_to_db(new_location_article_relations)
+        # Drain each stage in order, so that nothing is still on its way into the next one.
+        for (queue, _), stage_tasks in zip(stages, tasks):
+            await queue.join()
+            for task in stage_tasks:
+                task.cancel()
+            await asyncio.gather(*stage_tasks, return_exceptions=True)
+
+    if write_errors:
+        raise write_errors[0]
+    await flush()
+    report_extraction_caches()
 
 async def main() -> None:
-    global WRITE_TO_DB
+    global WRITE_TO_DB, RUN_CACHE, RUN_METRICS, COVERAGE_GRID, PREFILTER, EXTRACTION_PACK_TOKENS
     
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Parse RSS feeds and extract location data')
     parser.add_argument('--dry-run', action='store_true', help='Run without writing to database')
     parser.add_argument('--sync-db', action='store_true', help='Sync cache with database (use with caution)')
+    parser.add_argument('--stream', action='store_true', help='Overlap the scraping, extraction and geocoding stages, writing results as they finish')
+    parser.add_argument('--scrape-workers', type=int, default=8, help='Concurrent articles in the scraping stage (with --stream)')
+    parser.add_argument('--extract-workers', type=int, default=8, help='Concurrent articles in the extraction stage (with --stream)')
+    parser.add_argument('--geocode-workers', type=int, default=4, help='Concurrent articles in the geocoding stage (with --stream)')
+    parser.add_argument('--flush-size', type=int, default=25, help='Articles to write per batch (with --stream)')
+    parser.add_argument('--checkpoint', action='store_true', help='Write the cache after each batch of results instead of once at the end')
+    parser.add_argument('--coverage-check', action='store_true', help='Also reject geocoded locations away from every LinkNYC kiosk')
+    parser.add_argument('--prefilter', type=float, nargs='?', const=PREFILTER_THRESHOLD, help=f'Skip location extraction for articles whose location signal (0 to 1) is below this threshold (default {PREFILTER_THRESHOLD})')
+    parser.add_argument('--trim-articles', action='store_true', help='Send only the paragraphs of long articles that mention a location to the LLM')
+    parser.add_argument('--pack-articles', type=int, nargs='?', const=PACK_TOKEN_BUDGET, default=0, metavar='TOKENS', help=f'Extract short articles several at a time, in requests of up to this many estimated tokens (default {PACK_TOKEN_BUDGET})')
+    parser.add_argument('--defer-extraction', action='store_true', help='Queue the extraction of new articles as a batch job instead of calling the LLM; a later run ingests the results')
+    parser.add_argument('--submit-batch', action='store_true', help='Submit deferred extraction jobs to the OpenAI Batch API (with --defer-extraction)')
+    parser.add_argument('--address-points', type=Path, help='GeoJSON file of address points with Google place IDs to resolve locations from before calling Google Maps')
+    parser.add_argument('--metrics-file', type=Path, help='Also write the run\'s metrics to this file in the OpenMetrics text format')
     args = parser.parse_args()
     
     # Update global flag based on command line arguments
@@ -504,8 +851,17 @@ async def main() -> None:
         WRITE_TO_DB = False
         print("Running in dry-run mode - no data will be written to the database")
     
-    # Initialize cache manager
-    cache_mgr = CacheManager()
+    if args.coverage_check:
+        COVERAGE_GRID = CoverageGrid.from_geojson(LINKNYC_FILE)
+
+    EXTRACTION_PACK_TOKENS = args.pack_articles
+
+    if args.prefilter is not None or args.trim_articles:
+        PREFILTER = LocationPrefilter(args.prefilter or 0.0, args.trim_articles)
+
+    # Initialize the cache and metrics shared by every stage of the run
+    RUN_CACHE = RunCache(checkpoint=args.checkpoint, address_points=args.address_points)
+    RUN_METRICS = RunMetrics()
     
     # Sync with DB if requested (should be rarely needed)
     if args.sync_db:
@@ -519,27 +875,74 @@ async def main() -> None:
         refresh_cache_from_db()
         return
     
-    # Use the artifact-based cache instead of reading from DB
-    new_articles = await fetch_new_articles()
-    if not new_articles: 
-        print("No new articles found.")
-        return
-
-    print("New articles found.")
-    full_articles = await add_articles_full_content(new_articles)
-
-    new_articles_with_locations = add_article_locations(full_articles)
-
-    geocoding_result = await add_geocoded_locations(new_articles_with_locations)
+    try:
+        # Use the artifact-based cache instead of reading from DB
+        with RUN_METRICS.stage("fetch"):
+            new_articles = await fetch_new_articles()
+
+        # Articles already in a batch job are handled from the job. Jobs of earlier deferred runs
+        # whose results are in are written first.
+        batch_extractor = BatchExtractor(RUN_CACHE.cache_mgr, api_key=os.getenv("OPENAI_API_KEY"), metrics=RUN_METRICS)
+        queued_article_ids = batch_extractor.pending_article_ids()
+        new_articles = [article for article in new_articles if article.get("id") not in queued_article_ids]
+        with RUN_METRICS.stage("batch_ingest"):
+            await batch_extractor.poll_jobs()
+            ingested_jobs = batch_extractor.ingest_jobs(RUN_CACHE.extraction_cache)
+        for job_id, job_articles in ingested_jobs:
+            written_articles = await process_full_articles(job_articles)
+            remaining = batch_extractor.finish_job(job_id, {article.get("id") for article in written_articles})
+            if remaining:
+                print(f"- Keeping {remaining} unwritten articles in batch job {job_id}")
+
+        if not new_articles: 
+            print("No new articles found.")
+        elif args.defer_extraction:
+            print("New articles found.")
+            with RUN_METRICS.stage("scrape"):
+                full_articles = await add_articles_full_content(new_articles)
+            await defer_article_locations(batch_extractor, full_articles, args.submit_batch)
+        elif args.stream:
+            print("New articles found.")
+            with RUN_METRICS.stage("pipeline"):
+                await run_streaming_pipeline(new_articles, args.scrape_workers, args.extract_workers, args.geocode_workers, args.flush_size)
+        else:
+            print("New articles found.")
+            with RUN_METRICS.stage("scrape"):
+                full_articles = await add_articles_full_content(new_articles)
+            await process_full_articles(full_articles)
+
+        # Unchanged feeds can be skipped next time, unless some of their articles were dropped
+        # on the way to the database. Articles waiting in a batch job count as handled.
+        held_back = RUN_CACHE.commit_feed_validators({hash(article_id) for article_id in batch_extractor.pending_article_ids()})
+        if held_back:
+            print(f"- Keeping the old validators of {len(held_back)} feeds with unwritten articles")
+    finally:
+        with RUN_METRICS.stage("cache_flush"):
+            RUN_CACHE.flush()
+        write_run_report(args.metrics_file)
+
+async def process_full_articles(full_articles: List[FeedItem]) -> List[FeedItem]:
+    """Extract and geocode the locations of scraped articles, and write the results. Returns the
+    articles that were written to the database."""
+    with get_run_metrics().stage("extract"):
+        new_articles_with_locations = await add_article_locations(full_articles)
+
+    with get_run_metrics().stage("geocode"):
+        geocoding_result = await add_geocoded_locations(new_articles_with_locations)
     new_articles_with_geocoded_locations = geocoding_result["articles"]
     new_geocoded_full_locations = geocoding_result["new_geocoded_full_locations"]
 
-    filtered_articles = filter_and_reorganize_articles(new_articles_with_geocoded_locations)
-    location_article_relations = generate_location_article_relations(new_articles_with_geocoded_locations)
-
-    handle_articles_result(filtered_articles)
-    handle_locations_result(new_geocoded_full_locations)
-    handle_location_article_relations_result(location_article_relations)
+    written_articles = handle_results(new_articles_with_geocoded_locations, new_geocoded_full_locations, geocoding_result["accepted_candidates"])
+    written_ids = {article["uuid3"] for article in written_articles}
+    return [article for article in full_articles if hash(article.get("id")) in written_ids]
+
+def write_run_report(metrics_file: Optional[Path] = None) -> None:
+    """Save the run report to the cache, and optionally the run's metrics as OpenMetrics text."""
+    metrics = get_run_metrics()
+    get_run_cache().cache_mgr.save_run_report(metrics.report())
+    if metrics_file:
+        write_file(metrics_file, metrics.to_openmetrics())
+    print(f"- Run report: {metrics.summary()}")
 
 if __name__ == "__main__":
     asyncio.run(main())
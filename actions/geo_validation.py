@@ -0,0 +1,74 @@
+from types_consts import GeocodedCandidate
+
+from pathlib import Path
+from typing import List, Optional, Sequence
+import json
+
+import numpy as np
+
+COVERAGE_CELL_DEGREES = 0.01
+COVERAGE_MARGIN_CELLS = 2
+"""Cells around each covered cell that also count as covered, about 2 km."""
+
+
+def points_in_boxes(lats: np.ndarray, lons: np.ndarray, min_lats: np.ndarray, min_lons: np.ndarray, max_lats: np.ndarray, max_lons: np.ndarray) -> np.ndarray:
+    """Check each point against its own box, edges included. A NaN edge doesn't constrain the point."""
+    # Comparisons with NaN are false, so a missing edge never puts a point outside
+    outside = (lats < min_lats) | (lats > max_lats) | (lons < min_lons) | (lons > max_lons)
+    return ~outside
+
+
+class CoverageGrid:
+    """Prepared grid of the cells around a set of points, such as the LinkNYC kiosks, for checking
+    in one vectorized pass whether points fall in the area those points cover."""
+
+    def __init__(self, lats: Sequence[float], lons: Sequence[float], cell_degrees: float = COVERAGE_CELL_DEGREES, margin_cells: int = COVERAGE_MARGIN_CELLS):
+        self.cell_degrees = cell_degrees
+        rows, columns = self._cells(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+        offsets = np.arange(-margin_cells, margin_cells + 1)
+        dilated_rows = (rows[:, None, None] + offsets[None, :, None]).repeat(len(offsets), axis=2)
+        dilated_columns = (columns[:, None, None] + offsets[None, None, :]).repeat(len(offsets), axis=1)
+        self._keys = np.unique(self._keys_of(dilated_rows.ravel(), dilated_columns.ravel()))
+
+    @classmethod
+    def from_geojson(cls, path: Path, **kwargs: float) -> "CoverageGrid":
+        """Build the grid from the Point features of a GeoJSON file."""
+        with open(path, "r", encoding="utf-8") as f:
+            features = json.load(f)["features"]
+        coordinates = [feature["geometry"]["coordinates"] for feature in features if feature.get("geometry") and feature["geometry"]["type"] == "Point"]
+        return cls([lat for _, lat in coordinates], [lon for lon, _ in coordinates], **kwargs)  # type: ignore
+
+    def _cells(self, lats: np.ndarray, lons: np.ndarray) -> tuple:
+        return np.floor(lats / self.cell_degrees).astype(np.int64), np.floor(lons / self.cell_degrees).astype(np.int64)
+
+    @staticmethod
+    def _keys_of(rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        return rows * 1_000_000 + columns
+
+    def contains(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        return np.isin(self._keys_of(*self._cells(lats, lons)), self._keys)
+
+
+def validate_geocoded_candidates(candidates: List[GeocodedCandidate], coverage: Optional[CoverageGrid] = None) -> np.ndarray:
+    """Check every geocoded location against its article's feed boundaries, and optionally the
+    coverage grid, in one pass. Returns whether each candidate is accepted."""
+    if not candidates:
+        return np.zeros(0, dtype=bool)
+
+    def column(values: List[Optional[float]]) -> np.ndarray:
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+    boundaries = [candidate["geo_boundaries"] or {} for candidate in candidates]
+    lats = column([candidate["location"]["lat"] for candidate in candidates])
+    lons = column([candidate["location"]["lon"] for candidate in candidates])
+    accepted = points_in_boxes(
+        lats,
+        lons,
+        column([boundary.get("minLat") for boundary in boundaries]),
+        column([boundary.get("minLon") for boundary in boundaries]),
+        column([boundary.get("maxLat") for boundary in boundaries]),
+        column([boundary.get("maxLon") for boundary in boundaries]),
+    )
+    if coverage is not None:
+        accepted &= coverage.contains(lats, lons)
+    return accepted
@@ -0,0 +1,41 @@
+from types_consts import Hash, LocationArticleRelationsDefinition
+
+import hashlib
+
+COMPACT_HASH_LENGTH = 32
+"""Hex characters in a compact hash: the first 128 bits of a SHA-256 digest."""
+
+
+def compact_hash(string: str) -> Hash:
+    """Get the compact hash of a string, the hex of the first 128 bits of its SHA-256."""
+    return hashlib.sha256(string.encode("utf-8")).hexdigest()[:COMPACT_HASH_LENGTH]
+
+
+def legacy_hash(string: str) -> Hash:
+    """Get the legacy hash of a string, its whole SHA-256 as a decimal string (~77 characters)."""
+    return str(int(hashlib.sha256(string.encode("utf-8")).hexdigest(), 16))
+
+
+def is_legacy_hash(value: str) -> bool:
+    """Check whether a hash is in the legacy decimal format. Compact hashes are always 32 characters,
+    while a legacy one that short would need a SHA-256 below 10^32, which doesn't happen in practice."""
+    return len(value) > COMPACT_HASH_LENGTH and value.isdigit()
+
+
+def to_compact_hash(value: str) -> str:
+    """Get the compact form of a hash in either format. Legacy hashes are the same SHA-256, so this
+    is exact: `to_compact_hash(legacy_hash(s)) == compact_hash(s)`."""
+    if not is_legacy_hash(value):
+        return value
+    return format(int(value), "064x")[:COMPACT_HASH_LENGTH]
+
+
+def compact_relation(relation: LocationArticleRelationsDefinition) -> LocationArticleRelationsDefinition:
+    """Convert a location-article relation with a legacy article ID to compact hashes, in place.
+
+    Legacy relation IDs hash the legacy article ID, so they can't be converted directly and are
+    recomputed the way feedParser builds them: `hash(f"{article_uuid}-{place_id}")`."""
+    if relation.get("article_uuid") and is_legacy_hash(relation["article_uuid"]):
+        relation["article_uuid"] = to_compact_hash(relation["article_uuid"])
+        relation["id"] = compact_hash(f"{relation['article_uuid']}-{relation['place_id']}")
+    return relation
@@ -0,0 +1,100 @@
+from address_normalizer import STREET_SUFFIXES
+
+from typing import List
+import math
+import re
+
+PREFILTER_THRESHOLD = 0.35
+"""Location signal below which an article is assumed to have no mappable locations. One street or
+neighborhood is enough to pass; borough names and venue words alone need several."""
+TRIM_MIN_CHARS = 3000
+"""Articles shorter than this are sent to the LLM whole."""
+
+NYC_PLACE_NAMES = sorted({
+    "Harlem", "East Harlem", "Washington Heights", "Inwood", "Upper West Side", "Upper East Side",
+    "Midtown", "Hell's Kitchen", "Chelsea", "Flatiron", "Gramercy", "Murray Hill", "Kips Bay",
+    "Greenwich Village", "West Village", "East Village", "SoHo", "NoHo", "Tribeca", "Nolita",
+    "Lower East Side", "Chinatown", "Little Italy", "Financial District", "Battery Park",
+    "Williamsburg", "Greenpoint", "Bushwick", "Bed-Stuy", "Bedford-Stuyvesant", "Crown Heights",
+    "Park Slope", "Prospect Heights", "Fort Greene", "Clinton Hill", "Dumbo", "Red Hook",
+    "Carroll Gardens", "Cobble Hill", "Boerum Hill", "Sunset Park", "Bay Ridge", "Flatbush",
+    "Bensonhurst", "Coney Island", "Brighton Beach", "Sheepshead Bay", "Canarsie", "East New York",
+    "Astoria", "Long Island City", "Flushing", "Jackson Heights", "Forest Hills", "Ridgewood",
+    "Sunnyside", "Woodside", "Elmhurst", "Rockaway", "Bayside",
+    "Mott Haven", "Fordham", "Riverdale", "Pelham Bay", "Hunts Point", "St. George",
+    "Central Park", "Prospect Park", "Times Square", "Union Square", "Washington Square",
+    "Grand Central", "Penn Station", "Barclays Center", "Rockefeller Center", "City Hall",
+}, key=len, reverse=True)
+"""Neighborhoods and landmarks that place an article at a spot in New York City, longest first.
+Names that as often mean something else, like Jamaica, Corona, Kings or Richmond, are left out."""
+BOROUGH_NAMES = ("Staten Island", "Manhattan", "Brooklyn", "Queens", "Bronx")
+"""Borough names, which place an article in the city but not anywhere that can be mapped. The
+city's own name says even less about a local feed's articles, so it isn't counted at all."""
+
+_SUFFIX_WORDS = "|".join(sorted({*STREET_SUFFIXES, *STREET_SUFFIXES.values()}, key=len, reverse=True))
+_ADDRESS = re.compile(rf"\b\d{{1,5}}(?:-\d{{1,4}})?\s+(?:[NSEW]\.?\s+|(?:North|South|East|West)\s+)?(?:\d+(?:st|nd|rd|th)|[A-Z][a-z]+)(?:\s+[A-Z][a-z]+){{0,2}}\s+(?:(?i:{_SUFFIX_WORDS})\b\.?|Broadway\b)")
+_STREET = re.compile(rf"\b(?:\d+(?:st|nd|rd|th)|[A-Z][a-z]+)\s+(?:(?i:{_SUFFIX_WORDS})\b|Broadway\b)")
+_ZIP = re.compile(r"\b1(?:0[0-4]|1[0-6])\d{2}\b")
+# The lookahead lets the alternation be skipped at every position that can't start a name
+_PLACE_NAME = re.compile(r"\b(?=[A-Z])(?:" + "|".join(re.escape(name) for name in NYC_PLACE_NAMES) + r")\b")
+_BOROUGH = re.compile(r"\b(?:" + "|".join(BOROUGH_NAMES) + r")\b")
+_WORD = re.compile(r"[a-zé]+")
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+
+VENUE_WORDS = frozenset({
+    "restaurant", "cafe", "café", "bar", "bakery", "shop", "store", "market", "park", "playground", "station", "school",
+    "church", "museum", "gallery", "library", "hospital", "theater", "theatre", "bridge", "plaza", "pier", "corner",
+    "block", "opening", "opened", "located",
+})
+"""Words that suggest, weakly, that a paragraph is about a particular place."""
+SIGNAL_WEIGHTS = ((_ADDRESS, 3.0), (_ZIP, 2.0), (_STREET, 1.5), (_PLACE_NAME, 1.0), (_BOROUGH, 0.5))
+"""Evidence each match adds that a paragraph mentions a mappable location."""
+VENUE_WEIGHT = 0.25
+
+
+def paragraph_signal(paragraph: str) -> float:
+    """Sum the weighted matches of the location patterns and venue words in one paragraph."""
+    signal = sum(weight * len(pattern.findall(paragraph)) for pattern, weight in SIGNAL_WEIGHTS)
+    return signal + VENUE_WEIGHT * sum(word in VENUE_WORDS for word in _WORD.findall(paragraph.lower()))
+
+
+def location_signal(content: str) -> float:
+    """Estimate, between 0 and 1, how likely an article is to mention a location that can be mapped,
+    from street addresses, street names, ZIP codes, NYC place and borough names and venue words."""
+    return 1.0 - math.exp(-paragraph_signal(content) / 2)
+
+
+def location_paragraphs(content: str, min_chars: int = TRIM_MIN_CHARS) -> str:
+    """Cut a long article down to its first paragraph, which often carries the dateline, and the
+    paragraphs that mention a street, ZIP code or place name. Short articles are returned whole."""
+    if len(content) < min_chars:
+        return content
+    paragraphs = [paragraph.strip() for paragraph in _PARAGRAPHS.split(content) if paragraph.strip()]
+    kept: List[str] = paragraphs[:1] + [paragraph for paragraph in paragraphs[1:] if paragraph_signal(paragraph) >= 1.0]
+    return "\n\n".join(kept)
+
+
+class LocationPrefilter:
+    """Local check run before location extraction. Articles with a location signal below
+    `threshold` are skipped without an LLM call; with `trim`, long articles are sent with only
+    their location paragraphs. `skipped` and `trimmed_chars` count what was saved."""
+
+    def __init__(self, threshold: float = PREFILTER_THRESHOLD, trim: bool = False):
+        self.threshold = threshold
+        self.trim = trim
+        self.skipped = 0
+        self.trimmed_chars = 0
+
+    def should_extract(self, content: str) -> bool:
+        if location_signal(content) >= self.threshold:
+            return True
+        self.skipped += 1
+        return False
+
+    def prepare(self, content: str) -> str:
+        """Get the text to send for extraction."""
+        if not self.trim:
+            return content
+        trimmed = location_paragraphs(content)
+        self.trimmed_chars += len(content) - len(trimmed)
+        return trimmed
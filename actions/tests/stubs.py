@@ -0,0 +1,119 @@
+"""Local stand-ins for the services the feed parser talks to, served over HTTP on a free port."""
+import asyncio
+import json
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+SUPABASE_TEST_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.x"
+"""A JWT-shaped key, which is all the Supabase client checks."""
+
+
+class StubServer:
+    """Serve an aiohttp app on its own event loop thread, so that it answers both async clients in
+    the test's loop and blocking clients like Supabase's. Use as a context manager."""
+
+    def __init__(self, app: web.Application):
+        self.app = app
+        self.url = ""
+        self._loop = asyncio.new_event_loop()
+        self._runner = web.AppRunner(app)
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def __enter__(self) -> "StubServer":
+        async def start() -> None:
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]  # type: ignore
+            self.url = f"http://127.0.0.1:{port}"
+
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(start(), self._loop).result()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def chat_completion(model: str, output: dict, usage: Optional[dict] = None) -> dict:
+    """A chat completion whose message is `output` as JSON, as structured outputs return it."""
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": json.dumps(output)}}],
+        "usage": usage or {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+def openai_app(answer: Callable[[dict], Awaitable[web.StreamResponse]]) -> web.Application:
+    """An OpenAI-compatible API whose chat completions are answered by `answer(request_body)`."""
+    async def completions(request: web.Request) -> web.StreamResponse:
+        return await answer(await request.json())
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    return app
+
+
+class PostgrestStub:
+    """In-memory PostgREST tables with the filters, ordering and paging the Supabase client sends.
+    Requests are recorded in `calls`. `fail_upsert(rows)` can return a status and error body to
+    reject an upsert with."""
+
+    def __init__(self, tables: Optional[Dict[str, List[dict]]] = None, fail_upsert: Optional[Callable[[List[dict]], Optional[tuple]]] = None):
+        self.tables = tables or {}
+        self.fail_upsert = fail_upsert
+        self.calls: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def _select(self, request: web.Request, table: str) -> List[dict]:
+        rows = list(self.tables.get(table, []))
+        for column, condition in request.query.items():
+            if column in ("select", "order", "limit", "offset"):
+                continue
+            op, value = condition.split(".", 1)
+            compare = {"gt": lambda a: a > value, "gte": lambda a: a >= value, "lt": lambda a: a < value, "lte": lambda a: a <= value, "eq": lambda a: a == value}[op]
+            rows = [row for row in rows if compare(str(row[column]))]
+        for order in reversed(request.query.get("order", "").split(",")):
+            if order:
+                column, *direction = order.split(".")
+                rows.sort(key=lambda row: row[column], reverse="desc" in direction)
+        if "limit" in request.query:
+            rows = rows[:int(request.query["limit"])]
+        columns = request.query.get("select", "*")
+        return rows if columns == "*" else [{column: row[column] for column in columns.split(",")} for row in rows]
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        table = request.match_info["table"]
+        if request.method == "GET":
+            with self._lock:
+                self.calls.append((table, "GET", dict(request.query)))
+            return web.json_response(self._select(request, table))
+
+        rows = await request.json()
+        rows = rows if isinstance(rows, list) else [rows]
+        with self._lock:
+            self.calls.append((table, "POST", len(rows)))
+        failure = self.fail_upsert(rows) if self.fail_upsert else None
+        if failure:
+            status, body = failure
+            return web.json_response(body, status=status)
+        with self._lock:
+            self.tables.setdefault(table, []).extend(rows)
+        return web.json_response([], status=201)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/rest/v1/{table}", self._handle)
+        return app
+
+    def posts(self, table: str) -> List[int]:
+        """Get the size of each upsert request made to a table."""
+        return [size for name, method, size in self.calls if name == table and method == "POST"]
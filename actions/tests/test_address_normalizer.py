@@ -0,0 +1,44 @@
+import unittest
+
+from address_normalizer import canonical_address_key, normalize_locality, normalize_poi_name, normalize_street_address
+
+
+class NormalizeStreetAddressTest(unittest.TestCase):
+    def test_suffixes_are_abbreviated_at_the_end_of_the_name(self) -> None:
+        for spelling in ("123 West Fourth Street, Apt 2", "123 W. 4th St", "123 w 4th str #5"):
+            self.assertEqual(normalize_street_address(spelling), "123 w 4 st")
+        self.assertEqual(normalize_street_address("5 Fifth Avenue South"), "5 5 ave s")
+        self.assertEqual(normalize_street_address("1 Avenue of the Americas"), normalize_street_address("1 6th Ave"))
+
+    def test_suffix_words_elsewhere_keep_their_meaning(self) -> None:
+        self.assertEqual(normalize_street_address("1 St Marks Pl"), normalize_street_address("1 Saint Marks Place"))
+        self.assertNotEqual(normalize_street_address("1 St Marks Pl"), normalize_street_address("1 Street Marks Pl"))
+        self.assertEqual(normalize_street_address("200 Ave. A"), "200 avenue a")
+        self.assertEqual(normalize_street_address("10 St. Nicholas Ave"), "10 saint nicholas ave")
+        self.assertEqual(normalize_poi_name("The St. Regis"), normalize_poi_name("Saint Regis"))
+
+
+class NormalizeLocalityTest(unittest.TestCase):
+    def test_city_names_map_to_their_borough_in_new_york(self) -> None:
+        self.assertEqual(normalize_locality("Astoria", "NY"), "queens")
+        self.assertEqual(normalize_locality("Richmond"), "staten island")
+        self.assertEqual(normalize_locality("New York", "New York"), "manhattan")
+        self.assertEqual(normalize_locality("The Bronx", "N.Y."), "bronx")
+
+    def test_cities_of_the_same_name_in_other_states_stay_apart(self) -> None:
+        self.assertEqual(normalize_locality("Richmond", "VA"), "richmond va")
+        self.assertEqual(normalize_locality("Manhattan", "KS"), "manhattan ks")
+        self.assertEqual(normalize_locality("Jamaica", "VT"), "jamaica vt")
+        self.assertNotEqual(
+            canonical_address_key({"street_address": "1 Main St", "city": "Richmond", "state": "VA"}),
+            canonical_address_key({"street_address": "1 Main St", "city": "Richmond", "state": "NY"}),
+        )
+
+    def test_postal_code_decides_the_borough(self) -> None:
+        self.assertEqual(normalize_locality("New York", "NY", "11211"), "brooklyn")
+        self.assertEqual(normalize_locality(None, None, "10301-1234"), "staten island")
+        self.assertEqual(normalize_locality("Hoboken", "NJ", "07030"), "hoboken nj")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from BatchExtractor import BatchExtractor, response_format
+from CacheManager import CacheManager
+from ExtractionCache import ExtractionCache
+from LocationExtractor import EXTRACTION_MODEL, SYSTEM_PROMPT, LocationExtractor
+from RunMetrics import RunMetrics
+from types_consts import LLMConstrainedOutput
+from tests.stubs import StubServer, chat_completion, openai_app
+from tests.test_location_extractor import FakeOpenAI, locations_of
+
+
+class FakeBatchAPI:
+    """A stand-in for the OpenAI Files and Batches APIs. A batch is "in_progress" the first time it
+    is retrieved, then ends in `outcome`; a "completed" batch answers every request, and any other
+    outcome has no output."""
+
+    def __init__(self, outcome: str = "completed"):
+        self.outcome = outcome
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, dict] = {}
+        self.requests: List[dict] = []
+
+    def _batch(self, batch_id: str, status: str, output_file_id: Optional[str] = None) -> dict:
+        batch = self.batches[batch_id]
+        return {**batch, "status": status, "output_file_id": output_file_id}
+
+    async def create_file(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = form["file"].file.read()  # type: ignore
+        return web.json_response({"id": file_id, "object": "file", "bytes": len(self.files[file_id]), "created_at": 0, "filename": "requests.jsonl", "purpose": "batch", "status": "processed"})
+
+    async def create_batch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        batch_id = f"batch-{len(self.batches)}"
+        # "retrieved" counts polls; the client ignores fields it doesn't know
+        self.batches[batch_id] = {"id": batch_id, "object": "batch", "endpoint": body["endpoint"], "input_file_id": body["input_file_id"], "completion_window": body["completion_window"], "created_at": 0, "retrieved": 0}
+        return web.json_response(self._batch(batch_id, "validating"))
+
+    async def retrieve_batch(self, request: web.Request) -> web.Response:
+        batch_id = request.match_info["batch_id"]
+        batch = self.batches[batch_id]
+        batch["retrieved"] += 1
+        if batch["retrieved"] == 1:
+            return web.json_response(self._batch(batch_id, "in_progress"))
+        if self.outcome != "completed":
+            return web.json_response(self._batch(batch_id, self.outcome))
+
+        output_file_id = f"{batch_id}-output"
+        if output_file_id not in self.files:
+            lines = []
+            for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+                request_line = json.loads(line)
+                self.requests.append(request_line)
+                body = request_line["body"]
+                completion = chat_completion(body["model"], locations_of(body["messages"][-1]["content"]))
+                lines.append(json.dumps({"id": "response", "custom_id": request_line["custom_id"], "response": {"status_code": 200, "body": completion}, "error": None}))
+            self.files[output_file_id] = "\n".join(lines).encode("utf-8")
+        return web.json_response(self._batch(batch_id, "completed", output_file_id))
+
+    async def file_content(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.files[request.match_info["file_id"]])
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/files", self.create_file)
+        app.router.add_post("/v1/batches", self.create_batch)
+        app.router.add_get("/v1/batches/{batch_id}", self.retrieve_batch)
+        app.router.add_get("/v1/files/{file_id}/content", self.file_content)
+        return app
+
+
+class BatchExtractorTest(unittest.IsolatedAsyncioTestCase):
+    ARTICLES = [{"id": f"article-{i}", "title": f"Article {i}", "content": f"a{i} text"} for i in range(3)]
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_mgr = CacheManager(Path(directory.name))
+        self.cache = ExtractionCache()
+        self.metrics = RunMetrics()
+
+    def queued_articles(self) -> list:
+        """The articles as a job keeps them, with the key of their request."""
+        return [{**article, "extraction_key": ExtractionCache.key(EXTRACTION_MODEL, SYSTEM_PROMPT, article["content"])} for article in self.ARTICLES]
+
+    async def run_batch(self, fake: FakeBatchAPI) -> tuple:
+        """Queue the articles as a job, submit it and poll it until it is done, then ingest it."""
+        with StubServer(fake.app()) as server:
+            extractor = BatchExtractor(self.cache_mgr, api_key="key", base_url=f"{server.url}/v1", metrics=self.metrics)
+            job = extractor.create_job(self.ARTICLES, [article["content"] for article in self.ARTICLES], self.cache)  # type: ignore
+            await extractor.submit_job(job["job_id"])
+            await extractor.poll_jobs()
+            self.assertEqual(extractor.jobs[job["job_id"]]["status"], "submitted")
+            await extractor.poll_jobs()
+        self.assertEqual(extractor.pending_article_ids(), {article["id"] for article in self.ARTICLES})
+        # A later run picks the job up from the cache directory
+        extractor = BatchExtractor(self.cache_mgr, metrics=self.metrics)
+        return extractor, job["job_id"], extractor.ingest_jobs(self.cache)
+
+    async def test_completed_batch_fills_the_extraction_cache(self) -> None:
+        fake = FakeBatchAPI()
+        extractor, job_id, ready = await self.run_batch(fake)
+
+        self.assertEqual(ready, [(job_id, self.queued_articles())])
+        self.assertEqual(extractor.jobs[job_id]["status"], "completed")
+        self.assertEqual(self.metrics.counters["batch_responses_ingested"], 3)
+        self.assertEqual(fake.requests[0]["body"]["response_format"], response_format(LLMConstrainedOutput))
+        for request in fake.requests:
+            content = request["body"]["messages"][-1]["content"]
+            self.assertEqual(self.cache.get(request["custom_id"]), LLMConstrainedOutput.model_validate(locations_of(content)))
+
+        self.assertEqual(extractor.finish_job(job_id, {article["id"] for article in self.ARTICLES}), 0)
+        self.assertEqual(extractor.pending_article_ids(), set())
+        self.assertEqual(self.cache_mgr.load_batch_jobs(), {})
+
+    async def test_unwritten_articles_stay_in_the_job(self) -> None:
+        extractor, job_id, _ = await self.run_batch(FakeBatchAPI())
+
+        self.assertEqual(extractor.finish_job(job_id, {"article-0", "article-2"}), 1)
+        extractor = BatchExtractor(self.cache_mgr, metrics=self.metrics)
+        self.assertEqual(extractor.pending_article_ids(), {"article-1"})
+        self.assertEqual(extractor.ingest_jobs(self.cache), [(job_id, [self.queued_articles()[1]])])
+
+    async def test_results_are_found_when_the_text_has_changed_since(self) -> None:
+        _, _, ready = await self.run_batch(FakeBatchAPI())
+
+        fake = FakeOpenAI()
+        with StubServer(openai_app(fake.answer)) as server:
+            async with LocationExtractor("key", base_url=f"{server.url}/v1", cache=self.cache, metrics=self.metrics) as extractor:
+                # As if the article had been trimmed differently, or scraped again
+                outputs = [await extractor.extract(f"changed {article['content']}", article["extraction_key"]) for article in ready[0][1]]
+        self.assertEqual(fake.requests, [])
+        self.assertEqual([output.locations[0]["street_address"] for output in outputs], ["a0 St", "a1 St", "a2 St"])
+
+    async def test_batch_ending_without_output_sends_its_articles_back(self) -> None:
+        extractor, job_id, ready = await self.run_batch(FakeBatchAPI(outcome="expired"))
+
+        self.assertEqual([article["id"] for article in ready[0][1]], [article["id"] for article in self.ARTICLES])
+        self.assertEqual(extractor.jobs[job_id]["status"], "failed")
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.metrics.counters["batch_jobs_failed"], 1)
+
+        extractor.finish_job(job_id, {article["id"] for article in self.ARTICLES})
+        self.assertEqual(extractor.pending_article_ids(), set())
+
+    def test_strict_response_format(self) -> None:
+        schema = response_format(LLMConstrainedOutput)["json_schema"]["schema"]
+        for definition in [schema, *schema["$defs"].values()]:
+            self.assertFalse(definition["additionalProperties"])
+            self.assertEqual(definition["required"], list(definition["properties"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
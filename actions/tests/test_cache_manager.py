@@ -0,0 +1,36 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from CacheManager import CacheManager
+
+
+class RunReportTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_mgr = CacheManager(Path(directory.name))
+
+    @mock.patch("CacheManager.RUN_REPORT_HISTORY", 3)
+    def test_history_keeps_the_latest_runs(self) -> None:
+        for run in range(5):
+            self.cache_mgr.save_run_report({"run": run})
+        self.assertEqual(self.cache_mgr.load_run_reports(limit=3), [{"run": 2}, {"run": 3}, {"run": 4}])
+        self.assertEqual(self.cache_mgr.load_run_reports(limit=10), [{"run": run} for run in range(5)])
+
+        # The sixth run trims the history back to the latest three
+        self.cache_mgr.save_run_report({"run": 5})
+        self.assertEqual(self.cache_mgr.load_run_reports(limit=10), [{"run": 3}, {"run": 4}, {"run": 5}])
+
+    def test_torn_last_report_is_skipped(self) -> None:
+        self.cache_mgr.save_run_report({"run": 0})
+        with open(self.cache_mgr.cache_dir / "run_reports.jsonl", "a", encoding="utf-8") as f:
+            f.write('{"run": ')
+        self.assertEqual(self.cache_mgr.load_run_reports(), [{"run": 0}])
+        self.cache_mgr.save_run_report({"run": 1})
+        self.assertEqual(self.cache_mgr.load_run_reports(), [{"run": 0}, {"run": 1}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Optional
+from unittest import mock
+
+from supabase import Client, create_client
+
+import feedParser
+from CacheManager import CacheManager
+from db_io import HASH_KEY_PARTITIONS, UPSERT_MAX_ATTEMPTS, iter_table_rows, iter_table_rows_concurrently, upsert_rows
+from RunMetrics import RunMetrics
+from ids import compact_hash
+from tests.stubs import SUPABASE_TEST_KEY, PostgrestStub, StubServer
+
+ARTICLES = [{"uuid3": compact_hash(f"article {i}")} for i in range(2500)]
+LOCATIONS = [{"place_id": f"place{i:04d}", "lat": 40.7 + i / 1e4, "lon": -74.0 + i / 1e4, "formatted_address": f"{i} Main St", "types": ["street_address"]} for i in range(1200)]
+RELATIONS = [
+    {"id": compact_hash(f"relation {i}"), "article_uuid": ARTICLES[i]["uuid3"], "place_id": LOCATIONS[i % 1200]["place_id"], "location_name": f"{i} Main St"}
+    for i in range(1800)
+]
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.stub = PostgrestStub({"articles": list(ARTICLES), "locations": list(LOCATIONS), "location_article_relations": list(RELATIONS)})
+        self.server = StubServer(self.stub.app())
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.supabase = self.create_client(self.server.url, SUPABASE_TEST_KEY)
+
+    def create_client(self, url: str, key: str) -> Client:
+        supabase = create_client(url, key)
+        self.addCleanup(supabase.postgrest.session.close)
+        return supabase
+
+    def gets(self, table: str) -> list:
+        return [query for name, method, query in self.stub.calls if name == table and method == "GET"]
+
+    def test_keyset_pages_in_key_order(self) -> None:
+        rows = list(iter_table_rows(self.supabase, "articles", "uuid3", "uuid3", page_size=1000))
+        self.assertEqual([row["uuid3"] for row in rows], sorted(article["uuid3"] for article in ARTICLES))
+        queries = self.gets("articles")
+        self.assertEqual(len(queries), 3)
+        self.assertNotIn("uuid3", queries[0])
+        self.assertEqual(queries[1]["uuid3"], f"gt.{rows[999]['uuid3']}")
+
+    def test_key_range(self) -> None:
+        rows = list(iter_table_rows(self.supabase, "articles", "uuid3", "uuid3", lower="4", upper="8"))
+        self.assertEqual(sorted(row["uuid3"] for row in rows), sorted(article["uuid3"] for article in ARTICLES if "4" <= article["uuid3"] < "8"))
+
+    def test_concurrent_scan_yields_every_row_once(self) -> None:
+        rows = list(iter_table_rows_concurrently(self.supabase, "articles", "uuid3", "uuid3", HASH_KEY_PARTITIONS, page_size=100))
+        self.assertEqual(sorted(row["uuid3"] for row in rows), sorted(article["uuid3"] for article in ARTICLES))
+        self.assertGreaterEqual(len(self.gets("articles")), len(HASH_KEY_PARTITIONS) + 1)
+
+    def test_refresh_cache_from_db(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            cache_dir = Path(directory) / "cache"
+            environment = {"SUPABASE_URL": self.server.url, "SUPABASE_SER_KEY": SUPABASE_TEST_KEY}
+            with mock.patch.dict(os.environ, environment), \
+                    mock.patch.object(feedParser, "create_client", self.create_client), \
+                    mock.patch.object(feedParser, "CacheManager", lambda: CacheManager(cache_dir)):
+                feedParser.refresh_cache_from_db()
+
+            cache_mgr = CacheManager(cache_dir)
+            self.assertEqual(sorted(cache_mgr.load_seen_articles()), sorted(article["uuid3"] for article in ARTICLES))
+            self.assertEqual(sorted(cache_mgr.load_seen_locations()), [location["place_id"] for location in LOCATIONS])
+            self.assertEqual(len(cache_mgr.load_location_article_relations()), len(RELATIONS))
+            self.assertEqual(cache_mgr.load_location_snapshot().place_ids, [location["place_id"] for location in LOCATIONS])
+
+
+def postgrest_error(code: str, message: str) -> dict:
+    return {"code": code, "details": None, "hint": None, "message": message}
+
+
+@mock.patch("db_io.UPSERT_RETRY_DELAY", 0)
+class UpsertTest(unittest.TestCase):
+    ROWS = [{"id": f"{i:04d}", "bad": i in (7, 123)} for i in range(200)]
+
+    def upsert(self, stub: PostgrestStub, url: str = "", **kwargs: object) -> list:
+        with StubServer(stub.app()) as server:
+            supabase = create_client(url or server.url, SUPABASE_TEST_KEY)
+            try:
+                return upsert_rows(supabase, "articles", self.ROWS, chunk_size=50, metrics=RunMetrics(), **kwargs)  # type: ignore
+            finally:
+                supabase.postgrest.session.close()
+
+    def test_constraint_errors_are_bisected_to_the_bad_rows(self) -> None:
+        def fail_upsert(rows: list) -> Optional[tuple]:
+            return (400, postgrest_error("23502", "null value violates not-null constraint")) if any(row["bad"] for row in rows) else None
+
+        stub = PostgrestStub(fail_upsert=fail_upsert)
+        failed = self.upsert(stub)
+        self.assertEqual([row["id"] for row in failed], ["0007", "0123"])
+        self.assertEqual(len(stub.tables["articles"]), 198)
+
+    def test_transient_errors_are_retried(self) -> None:
+        responses = [(503, postgrest_error("PGRST000", "could not connect")), (500, postgrest_error("57014", "statement timeout"))]
+        stub = PostgrestStub(fail_upsert=lambda rows: responses.pop(0) if responses else None)
+        self.assertEqual(self.upsert(stub, max_workers=1), [])
+        self.assertEqual(stub.posts("articles"), [50, 50, 50, 50, 50, 50])
+
+    def test_outage_fails_fast_without_bisecting(self) -> None:
+        stub = PostgrestStub(fail_upsert=lambda rows: (503, postgrest_error("PGRST000", "could not connect")))
+        failed = self.upsert(stub, max_workers=1)
+        self.assertEqual(len(failed), len(self.ROWS))
+        self.assertEqual(stub.posts("articles"), [50] * UPSERT_MAX_ATTEMPTS)
+
+    def test_request_errors_fail_fast_without_bisecting(self) -> None:
+        stub = PostgrestStub(fail_upsert=lambda rows: (400, postgrest_error("PGRST204", "Could not find the 'bad' column of 'articles' in the schema cache")))
+        failed = self.upsert(stub, max_workers=1)
+        self.assertEqual(len(failed), len(self.ROWS))
+        self.assertEqual(stub.posts("articles"), [50])
+
+    def test_unreachable_database_fails_fast(self) -> None:
+        with StubServer(PostgrestStub().app()) as closed:
+            pass
+        stub = PostgrestStub()
+        failed = self.upsert(stub, url=closed.url)
+        self.assertEqual(len(failed), len(self.ROWS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from ExtractionCache import ExtractionCache
+from types_consts import LLMConstrainedOutput
+
+
+def output(street_address: str) -> LLMConstrainedOutput:
+    return LLMConstrainedOutput(locations=[{"street_address": street_address, "city": None, "state": None, "postal_code": None}])
+
+
+class ExtractionCacheTest(unittest.TestCase):
+    def test_key_ignores_whitespace_but_not_model_or_prompt(self) -> None:
+        key = ExtractionCache.key("model", "prompt", "Some  text\n")
+        self.assertEqual(key, ExtractionCache.key("model", "prompt", "Some text"))
+        self.assertNotEqual(key, ExtractionCache.key("other-model", "prompt", "Some text"))
+        self.assertNotEqual(key, ExtractionCache.key("model", "other prompt", "Some text"))
+
+    def test_hits_do_not_mark_the_cache_changed(self) -> None:
+        cache = ExtractionCache({"a": output("1 Main St").model_dump()})
+        self.assertEqual(cache.get("a"), output("1 Main St"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.hits, cache.misses, cache.changed), (1, 1, False))
+
+        cache.put("b", output("2 Main St"))
+        self.assertTrue(cache.changed)
+
+    def test_evicts_least_recently_used(self) -> None:
+        cache = ExtractionCache({"a": output("1 Main St").model_dump(), "b": output("2 Main St").model_dump()}, max_entries=2)
+        cache.get("a")
+        cache.put("c", output("3 Main St"))
+        self.assertEqual(list(cache.entries()), ["a", "c"])
+
+    def test_loading_more_than_max_entries_evicts_and_marks_changed(self) -> None:
+        cache = ExtractionCache({key: output(key).model_dump() for key in "abc"}, max_entries=2)
+        self.assertEqual(list(cache.entries()), ["b", "c"])
+        self.assertTrue(cache.changed)
+
+
+if __name__ == "__main__":
+    unittest.main()
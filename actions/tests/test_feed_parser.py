@@ -0,0 +1,130 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import feedParser
+from CacheManager import CacheManager
+from RunCache import RunCache
+from RunMetrics import RunMetrics
+
+LOCATION = {"place_id": "p1", "lat": 40.7, "lon": -74.0, "formatted_address": "1 Main St", "types": ["street_address"]}
+
+
+class HandleLocationsResultTest(unittest.TestCase):
+    def test_written_locations_are_added_to_the_snapshot_and_gazetteer(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            run_cache = RunCache(CacheManager(Path(directory)))
+            self.assertIsNone(run_cache.gazetteer.lookup("1 Main St"))
+            with mock.patch.object(feedParser, "RUN_CACHE", run_cache):
+                feedParser.handle_locations_result([LOCATION])  # type: ignore
+            self.assertEqual(run_cache.gazetteer.lookup("1 Main St")["place_id"], "p1")  # type: ignore
+            run_cache.flush()
+            self.assertEqual(run_cache.cache_mgr.load_location_snapshot().place_ids, ["p1"])
+
+
+class RecordResultsTest(unittest.TestCase):
+    def test_aliases_are_only_cached_once_their_location_is_written(self) -> None:
+        candidate = {"alias": "1 main st", "canonical_key": "|1 main st|manhattan", "location": LOCATION, "geo_boundaries": None}
+        with tempfile.TemporaryDirectory() as directory:
+            run_cache = RunCache(CacheManager(Path(directory)))
+            with mock.patch.object(feedParser, "RUN_CACHE", run_cache), mock.patch.object(feedParser, "RUN_METRICS", RunMetrics()):
+                feedParser.record_results([], [candidate], [], [], [])  # type: ignore
+                self.assertIsNone(run_cache.alias_index.lookup("1 main st"))
+                feedParser.record_results([], [candidate], [], [LOCATION], [])  # type: ignore
+                self.assertEqual(run_cache.alias_index.lookup("1 main st"), "p1")
+
+
+class ReportExtractionCachesTest(unittest.TestCase):
+    def test_reporting_after_each_batch_records_the_run_totals(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            run_cache, metrics = RunCache(CacheManager(Path(directory))), RunMetrics()
+            with mock.patch.object(feedParser, "RUN_CACHE", run_cache), mock.patch.object(feedParser, "RUN_METRICS", metrics):
+                run_cache.extraction_cache.hits, run_cache.extraction_cache.misses = 2, 3
+                feedParser.report_extraction_caches()
+                run_cache.extraction_cache.hits, run_cache.extraction_cache.misses = 5, 4
+                feedParser.report_extraction_caches()
+        self.assertEqual((metrics.counters["extraction_cache_hits"], metrics.counters["extraction_cache_misses"]), (5, 4))
+        self.assertEqual(metrics.counters["near_duplicates_reused"], 0)
+
+
+class AddArticleLocationTest(unittest.IsolatedAsyncioTestCase):
+    CONTENT = "A fire broke out at 350 Fifth Avenue in Manhattan on Tuesday morning, officials said."
+
+    async def test_cancelled_extraction_does_not_leave_its_near_duplicates_waiting(self) -> None:
+        started, requests = asyncio.Event(), []
+
+        class Extractor:
+            async def extract(self, content: str, cache_key: object = None) -> None:
+                requests.append(content)
+                if len(requests) == 1:
+                    started.set()
+                    await asyncio.Event().wait()
+
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(feedParser, "RUN_CACHE", RunCache(CacheManager(Path(directory)))):
+            first = asyncio.create_task(feedParser.add_article_location({"id": "a", "title": "A", "content": self.CONTENT}, Extractor()))  # type: ignore
+            await started.wait()
+            second = asyncio.create_task(feedParser.add_article_location({"id": "b", "title": "B", "content": self.CONTENT}, Extractor()))  # type: ignore
+            await asyncio.sleep(0)
+            first.cancel()
+            result = await asyncio.wait_for(second, timeout=10)
+        self.assertEqual(result["locations"], {})  # type: ignore
+        self.assertEqual(len(requests), 2)
+
+
+class StreamingPipelineTest(unittest.IsolatedAsyncioTestCase):
+    ARTICLES = [{"id": f"article-{i}", "title": f"Article {i}", "link": f"https://example.com/{i}", "feed": None} for i in range(6)]
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.metrics = RunMetrics()
+
+        async def scrape(article: dict, scraper: object) -> dict:
+            return {**article, "content": "text"}
+
+        async def extract(article: dict, extractor: object) -> dict:
+            return {"item": article, "locations": {}}
+
+        async def geocode(article: dict, *args: object) -> dict:
+            return article
+
+        for patch in (
+            mock.patch.dict(os.environ, {"OPENAI_API_KEY": "key"}),
+            mock.patch.object(feedParser, "RUN_CACHE", RunCache(CacheManager(Path(directory.name)))),
+            mock.patch.object(feedParser, "RUN_METRICS", self.metrics),
+            mock.patch.object(feedParser, "add_article_full_content", scrape),
+            mock.patch.object(feedParser, "add_article_location", extract),
+            mock.patch.object(feedParser, "add_geocoded_location", geocode),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def test_failed_write_fails_the_run_instead_of_hanging(self) -> None:
+        written = []
+
+        async def write(articles: list, locations: list, candidates: list) -> None:
+            written.append(len(articles))
+            raise RuntimeError("database is down")
+
+        with mock.patch.object(feedParser, "handle_results_in_thread", write):
+            with self.assertRaisesRegex(RuntimeError, "database is down"):
+                await asyncio.wait_for(feedParser.run_streaming_pipeline(self.ARTICLES, flush_size=2), timeout=10)
+        self.assertEqual(written, [2])
+        self.assertEqual(self.metrics.counters["write_stage_errors"], 1)
+
+    async def test_every_article_is_written(self) -> None:
+        written = []
+
+        async def write(articles: list, locations: list, candidates: list) -> None:
+            written.extend(article["item"]["id"] for article in articles)
+
+        with mock.patch.object(feedParser, "handle_results_in_thread", write):
+            await asyncio.wait_for(feedParser.run_streaming_pipeline(self.ARTICLES, flush_size=4), timeout=10)
+        self.assertEqual(sorted(written), sorted(article["id"] for article in self.ARTICLES))
+
+
+if __name__ == "__main__":
+    unittest.main()
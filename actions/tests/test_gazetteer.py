@@ -0,0 +1,46 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from Gazetteer import Gazetteer
+
+
+def address_point(address: str, **properties: str) -> dict:
+    return {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-73.99, 40.73]}, "properties": {"address": address, "borough": "Manhattan", **properties}}
+
+
+class GazetteerTest(unittest.TestCase):
+    def test_known_place_is_found_under_another_spelling(self) -> None:
+        gazetteer = Gazetteer()
+        gazetteer.add_location({"place_id": "p1", "lat": 40.7, "lon": -74.0, "formatted_address": "350 5th Ave, New York, NY 10118, USA", "types": ["premise"]})
+        self.assertEqual(gazetteer.lookup("350 Fifth Avenue, Manhattan")["place_id"], "p1")  # type: ignore
+        self.assertIsNone(gazetteer.lookup("352 Fifth Avenue, Manhattan"))
+
+    def test_address_is_never_answered_with_a_point_of_interest(self) -> None:
+        gazetteer = Gazetteer()
+        # Google gives a point of interest the formatted address of its building, without its name
+        pizza = {"place_id": "joes", "lat": 40.73, "lon": -73.99, "formatted_address": "150 E 14th St, New York, NY 10003, USA", "types": ["restaurant", "point_of_interest", "establishment"]}
+        gazetteer.add_location(pizza)  # type: ignore
+        gazetteer.add_alias("joes pizza|150 e 14 st|manhattan", "joes")
+        self.assertIsNone(gazetteer.lookup("150 E 14th St, Manhattan"))
+        self.assertEqual(gazetteer.lookup("Joe's Pizza, 150 E 14th St, Manhattan")["place_id"], "joes")  # type: ignore
+
+        gazetteer.add_location({"place_id": "building", "lat": 40.73, "lon": -73.99, "formatted_address": "150 E 14th St, New York, NY 10003, USA", "types": ["premise"]})
+        self.assertEqual(gazetteer.lookup("150 E 14th St, Manhattan")["place_id"], "building")  # type: ignore
+        # A point of interest not known by name falls back to its address
+        self.assertEqual(gazetteer.lookup("Corner Deli, 150 E 14th St, Manhattan")["place_id"], "building")  # type: ignore
+
+    def test_only_address_points_with_a_place_id_are_added(self) -> None:
+        features = [address_point("1 Main St", place_id="ChIJ1"), address_point("2 Main St")]
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "address_points.geojson"
+            path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+            gazetteer = Gazetteer()
+            self.assertEqual(gazetteer.add_address_points(path), 1)
+        self.assertEqual(gazetteer.lookup("1 Main Street, Manhattan")["place_id"], "ChIJ1")  # type: ignore
+        self.assertIsNone(gazetteer.lookup("2 Main Street, Manhattan"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+
+from aiohttp import web
+
+from GeocodingClient import GeocodingClient
+from RunMetrics import RunMetrics
+from tests.stubs import StubServer
+
+
+def geocoding_app(responses: list) -> web.Application:
+    """A geocoding API that gives each request the next of `responses`, a status and body, and
+    repeats the last one once they run out."""
+    requests = []
+
+    async def geocode(request: web.Request) -> web.Response:
+        requests.append(request.query["address"])
+        status, body = responses[min(len(requests), len(responses)) - 1]
+        return web.Response(status=status, text=body, content_type="application/json")
+
+    app = web.Application()
+    app["requests"] = requests
+    app.router.add_get("/geocode", geocode)
+    return app
+
+
+OK = (200, '{"status": "OK", "results": [{"place_id": "p1"}]}')
+
+
+class GeocodingClientTest(unittest.IsolatedAsyncioTestCase):
+    async def geocode(self, responses: list, addresses: list, max_retries: int = 2, url: str = "") -> tuple:
+        with StubServer(geocoding_app(responses)) as server:
+            metrics = RunMetrics()
+            async with GeocodingClient("key", url=url or f"{server.url}/geocode", max_retries=max_retries, backoff=0, metrics=metrics) as client:
+                results = await asyncio.gather(*(client.geocode(address) for address in addresses))
+        return results, server.app["requests"], metrics
+
+    async def test_returns_decoded_response(self) -> None:
+        results, requests, _ = await self.geocode([OK], ["1 Main St"])
+        self.assertEqual(results[0]["results"][0]["place_id"], "p1")
+        self.assertEqual(requests, ["1 Main St"])
+
+    async def test_retries_over_query_limit_and_server_errors(self) -> None:
+        results, requests, metrics = await self.geocode([(200, '{"status": "OVER_QUERY_LIMIT"}'), (503, ""), OK], ["1 Main St"])
+        self.assertEqual(results[0]["status"], "OK")
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(metrics.errors["geocode_request"], 2)
+        self.assertEqual(metrics.counters["geocode_retries"], 2)
+
+    async def test_retries_body_that_is_not_json(self) -> None:
+        results, requests, _ = await self.geocode([(200, "<html>Bad gateway</html>"), OK], ["1 Main St"])
+        self.assertEqual(results[0]["status"], "OK")
+        self.assertEqual(len(requests), 2)
+
+    async def test_body_that_is_never_json_fails_only_that_address(self) -> None:
+        results, requests, metrics = await self.geocode([(200, "not json")], ["1 Main St", "2 Main St"], max_retries=1)
+        self.assertEqual(results, [None, None])
+        self.assertEqual(len(requests), 4)
+        self.assertEqual(metrics.errors["geocode_request"], 4)
+
+    async def test_connection_errors_are_retried_and_counted(self) -> None:
+        with StubServer(geocoding_app([OK])) as closed:
+            pass
+        results, _, metrics = await self.geocode([OK], ["1 Main St"], url=f"{closed.url}/geocode")
+        self.assertEqual(results, [None])
+        self.assertEqual(metrics.errors["geocode_request"], 3)
+        self.assertEqual(metrics.counters["geocode_retries"], 2)
+
+    async def test_client_error_is_not_retried(self) -> None:
+        results, requests, _ = await self.geocode([(400, "{}")], ["1 Main St"])
+        self.assertEqual(results, [None])
+        self.assertEqual(len(requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import asyncio
+import re
+import unittest
+
+from aiohttp import web
+from openai import APITimeoutError
+
+from ExtractionCache import ExtractionCache
+from LocationExtractor import LocationExtractor
+from RunMetrics import RunMetrics
+from tests.stubs import StubServer, chat_completion, openai_app
+
+
+def locations_of(content: str) -> dict:
+    """What the fake model extracts: one street address named after the text's first word."""
+    return {"locations": [{"street_address": f"{content.split()[0]} St", "city": None, "state": None, "postal_code": None}]}
+
+
+PACKED_ARTICLE = re.compile(r"### Article (\d+)\n(\S+)")
+
+
+class FakeOpenAI:
+    """A fake OpenAI-compatible server. `failures` are status codes answered before succeeding, and
+    `delay` is how long each completion takes. Packed requests are answered per `pack_mode`: "ok",
+    "partial" to leave out the first article, "duplicate" to answer it twice, or "error"."""
+
+    def __init__(self, failures: tuple = (), delay: float = 0.0, pack_mode: str = "ok"):
+        self.failures = list(failures)
+        self.delay = delay
+        self.pack_mode = pack_mode
+        self.requests: list = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def packed_requests(self) -> list:
+        return [body for body in self.requests if body["messages"][-1]["content"].startswith("### Article")]
+
+    def answer_packed(self, body: dict) -> web.Response:
+        if self.pack_mode == "error":
+            return web.json_response({"error": {"message": "bad request"}}, status=400)
+        articles = [{"article_id": article_id, **locations_of(content)} for article_id, content in PACKED_ARTICLE.findall(body["messages"][-1]["content"])]
+        if self.pack_mode == "partial":
+            articles = articles[1:]
+        elif self.pack_mode == "duplicate":
+            articles.append({**articles[0], "locations": []})
+        return web.json_response(chat_completion(body["model"], {"articles": articles}))
+
+    async def answer(self, body: dict) -> web.Response:
+        self.requests.append(body)
+        if body["messages"][-1]["content"].startswith("### Article"):
+            return self.answer_packed(body)
+        if self.failures:
+            # retry-after-ms keeps the client's backoff short
+            return web.json_response({"error": {"message": "try again"}}, status=self.failures.pop(0), headers={"retry-after-ms": "1"})
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return web.json_response(chat_completion(body["model"], locations_of(body["messages"][-1]["content"])))
+
+
+class LocationExtractorTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.metrics = RunMetrics()
+
+    def extractor(self, server: StubServer, **kwargs: object) -> LocationExtractor:
+        return LocationExtractor("key", base_url=f"{server.url}/v1", metrics=self.metrics, **kwargs)  # type: ignore
+
+    async def test_results_come_back_in_order_with_bounded_concurrency(self) -> None:
+        fake = FakeOpenAI(delay=0.02)
+        contents = [f"a{i} text" for i in range(12)]
+        with StubServer(openai_app(fake.answer)) as server:
+            async with self.extractor(server, max_concurrency=3) as extractor:
+                outputs = await asyncio.gather(*(extractor.extract(content) for content in contents))
+        self.assertEqual([output.locations[0]["street_address"] for output in outputs], [f"a{i} St" for i in range(12)])
+        self.assertEqual(fake.max_in_flight, 3)
+        self.assertEqual(self.metrics.counters["llm_prompt_tokens"], 120)
+
+    async def test_retries_rate_limits_and_server_errors(self) -> None:
+        fake = FakeOpenAI(failures=(429, 500))
+        with StubServer(openai_app(fake.answer)) as server:
+            async with self.extractor(server, max_retries=2) as extractor:
+                output = await extractor.extract("b text")
+        self.assertEqual(output.locations[0]["street_address"], "b St")
+        self.assertEqual(len(fake.requests), 3)
+
+    async def test_request_times_out(self) -> None:
+        fake = FakeOpenAI(delay=1.0)
+        with StubServer(openai_app(fake.answer)) as server:
+            async with self.extractor(server, timeout=0.1, max_retries=0) as extractor:
+                with self.assertRaises(APITimeoutError):
+                    await extractor.extract("c text")
+        self.assertEqual(self.metrics.errors["llm_request"], 1)
+
+    async def test_cache_answers_repeated_text_once(self) -> None:
+        fake = FakeOpenAI(delay=0.02)
+        cache = ExtractionCache()
+        with StubServer(openai_app(fake.answer)) as server:
+            async with self.extractor(server, cache=cache) as extractor:
+                outputs = await asyncio.gather(*(extractor.extract("d  text") for _ in range(3)))
+                outputs.append(await extractor.extract("d text"))
+        self.assertEqual(len(fake.requests), 1)
+        self.assertTrue(all(output.locations[0]["street_address"] == "d St" for output in outputs))
+        self.assertEqual((cache.hits, len(cache)), (1, 1))
+
+
+class PackedExtractionTest(unittest.IsolatedAsyncioTestCase):
+    # Ten short articles that fit about five to a pack, a repeat of the first, and one too long to pack
+    CONTENTS = [f"a{i} " + "filler " * 20 for i in range(10)] + ["a0 " + "filler " * 20, "big " + "word " * 400]
+
+    async def extract(self, fake: FakeOpenAI) -> tuple:
+        metrics = RunMetrics()
+        with StubServer(openai_app(fake.answer)) as server:
+            async with LocationExtractor("key", base_url=f"{server.url}/v1", max_retries=0, cache=ExtractionCache(), metrics=metrics, pack_tokens=200) as extractor:
+                outputs = await asyncio.gather(*(extractor.extract(content) for content in self.CONTENTS))
+        self.assertEqual([output.locations[0]["street_address"] for output in outputs], [f"{content.split()[0]} St" for content in self.CONTENTS])
+        return metrics, len(fake.packed_requests()), len(fake.requests) - len(fake.packed_requests())
+
+    async def test_short_articles_share_requests(self) -> None:
+        metrics, packed, single = await self.extract(FakeOpenAI())
+        self.assertEqual((packed, single), (2, 1))
+        self.assertEqual((metrics.counters["llm_packed_articles"], metrics.counters["llm_pack_fallbacks"]), (10, 0))
+
+    async def test_articles_missing_from_the_response_are_extracted_alone(self) -> None:
+        metrics, packed, single = await self.extract(FakeOpenAI(pack_mode="partial"))
+        self.assertEqual((packed, single), (2, 3))
+        self.assertEqual(metrics.counters["llm_pack_fallbacks"], 2)
+
+    async def test_articles_answered_twice_are_extracted_alone(self) -> None:
+        metrics, packed, single = await self.extract(FakeOpenAI(pack_mode="duplicate"))
+        self.assertEqual((packed, single), (2, 3))
+        self.assertEqual(metrics.counters["llm_pack_fallbacks"], 2)
+
+    async def test_failed_pack_falls_back_to_one_request_per_article(self) -> None:
+        metrics, packed, single = await self.extract(FakeOpenAI(pack_mode="error"))
+        self.assertEqual((packed, single), (2, 11))
+        self.assertEqual(metrics.counters["llm_pack_fallbacks"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
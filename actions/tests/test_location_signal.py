@@ -0,0 +1,41 @@
+import unittest
+
+from location_signal import PREFILTER_THRESHOLD, location_paragraphs, location_signal
+
+# Ledes of the kind local feeds carry, with nothing to map despite naming places
+WITHOUT_LOCATIONS = [
+    "The New York Times reported that New York officials met on Tuesday.",
+    "New York City's budget was approved by the council after weeks of talks.",
+    "The prime minister of Jamaica visited the United Nations.",
+    "Sales of Corona rose last quarter, the brewer said.",
+    "The company moved its headquarters to Richmond, Va., in 2019.",
+    "The Kings beat the Knicks 110-98 on Sunday night.",
+    "A Brooklyn native, she has written three novels.",
+]
+WITH_LOCATIONS = [
+    "A new bakery opened in Bushwick this week.",
+    "Police closed Flatbush Avenue after the crash.",
+    "The fire broke out at 123 Main Street on Monday.",
+    "Tenants in the 11216 ZIP code say rents have doubled.",
+]
+
+
+class LocationSignalTest(unittest.TestCase):
+    def test_ambiguous_place_names_alone_stay_below_the_threshold(self) -> None:
+        for text in WITHOUT_LOCATIONS:
+            with self.subTest(text=text):
+                self.assertLess(location_signal(text), PREFILTER_THRESHOLD)
+
+    def test_one_street_or_neighborhood_passes_the_threshold(self) -> None:
+        for text in WITH_LOCATIONS:
+            with self.subTest(text=text):
+                self.assertGreaterEqual(location_signal(text), PREFILTER_THRESHOLD)
+
+    def test_long_articles_are_trimmed_to_their_location_paragraphs(self) -> None:
+        filler = "Officials said the plan would take years. " * 20
+        content = "\n\n".join(["Dateline paragraph.", filler, WITH_LOCATIONS[2], filler])
+        self.assertEqual(location_paragraphs(content, min_chars=100), f"Dateline paragraph.\n\n{WITH_LOCATIONS[2]}")
+
+
+if __name__ == "__main__":
+    unittest.main()
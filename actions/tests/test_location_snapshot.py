@@ -0,0 +1,46 @@
+import struct
+import unittest
+
+import numpy as np
+
+from LocationSnapshot import SNAPSHOT_MAGIC, LocationSnapshot, pack_strings
+
+LOCATIONS = [
+    {"place_id": "p1", "lat": 40.75, "lon": -73.98, "formatted_address": "1 Main St", "types": ["street_address"]},
+    {"place_id": "p2", "lat": 40.65, "lon": -73.95, "formatted_address": "2 Main St", "types": None},
+]
+
+
+class LocationSnapshotTest(unittest.TestCase):
+    def test_round_trip_appends_only_new_locations(self) -> None:
+        snapshot = LocationSnapshot()
+        self.assertEqual(snapshot.add_locations(LOCATIONS[:1]), 1)  # type: ignore
+        snapshot = LocationSnapshot.from_bytes(snapshot.to_bytes())
+        self.assertEqual(snapshot.add_locations(LOCATIONS), 1)  # type: ignore
+
+        snapshot = LocationSnapshot.from_bytes(snapshot.to_bytes())
+        place_ids, lats, lons = snapshot.points()
+        self.assertEqual(place_ids, ["p1", "p2"])
+        self.assertEqual(snapshot.types, [["street_address"], None])
+        np.testing.assert_allclose(lats, [40.75, 40.65], rtol=1e-6)
+        np.testing.assert_allclose(lons, [-73.98, -73.95], rtol=1e-6)
+
+    def test_reads_version_1_snapshots_with_relations(self) -> None:
+        # Version 1 also had article and relation counts, relation columns and article IDs
+        data = b"".join([
+            struct.pack("<4sIIII", SNAPSHOT_MAGIC, 1, 2, 1, 2),
+            np.array([40.75, 40.65], dtype="<f4").tobytes(),
+            np.array([-73.98, -73.95], dtype="<f4").tobytes(),
+            np.array([0, 1], dtype="<u4").tobytes(),
+            np.array([0, 0], dtype="<u4").tobytes(),
+            bytes(16),
+            pack_strings(["p1", "p2"]),
+            pack_strings(["1 Main St", "2 Main St"]),
+        ])
+        snapshot = LocationSnapshot.from_bytes(data)
+        self.assertEqual((snapshot.place_ids, snapshot.formatted_addresses, snapshot.types), (["p1", "p2"], ["1 Main St", "2 Main St"], [None, None]))
+        np.testing.assert_allclose(snapshot.points()[1], [40.75, 40.65], rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+from CacheManager import CacheManager
+from RunCache import RunCache
+
+
+class FeedValidatorsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.run_cache = RunCache(CacheManager(Path(self.directory.name)))
+        for url, article_ids in (("a", ["a1", "a2"]), ("b", ["b1"]), ("c", ["c1"]), ("d", [])):
+            self.run_cache.pending_feed_validators[url] = {"etag": url, "last_modified": None}
+            self.run_cache.pending_feed_articles[url] = article_ids
+
+    def test_feeds_with_unwritten_articles_keep_their_old_validators(self) -> None:
+        self.run_cache.add_seen_articles(["a1", "b1"])
+        held_back = self.run_cache.commit_feed_validators({"c1"})
+        self.assertEqual(held_back, ["a"])
+        self.assertEqual(sorted(self.run_cache.feed_validators), ["b", "c", "d"])
+
+        self.run_cache.flush()
+        self.assertEqual(sorted(CacheManager(Path(self.directory.name)).load_feed_validators()), ["b", "c", "d"])
+
+
+class FlushTest(unittest.IsolatedAsyncioTestCase):
+    async def test_flush_in_thread_saves_what_changed(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            run_cache = RunCache(CacheManager(Path(directory)))
+            run_cache.add_seen_articles(["a1", "a2"])
+            run_cache.add_seen_locations(["p1"])
+            flushing = asyncio.create_task(run_cache.flush_in_thread())
+            await asyncio.sleep(0)
+            # Tables changed while the writes are in flight are saved by the next flush
+            run_cache.add_seen_articles(["a3"])
+            await flushing
+            run_cache.flush()
+
+            reloaded = RunCache(CacheManager(Path(directory)))
+            self.assertTrue(all(article_id in reloaded.seen_articles for article_id in ["a1", "a2", "a3"]))
+            self.assertEqual(reloaded.seen_locations, {"p1"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,21 @@
+from datetime import timedelta
 from pathlib import Path
-from typing import List, TypedDict, Optional, Dict, Union
+from typing import List, NotRequired, TypedDict, Optional, Dict, Union
 from pydantic import BaseModel
 
 
 FEED_FILE = Path(__file__).resolve().parent / "../public/feeds/feeds.csv"
 CACHE_DIRECTORY = Path(__file__).resolve().parent / "../cache/"
+LINKNYC_FILE = Path(__file__).resolve().parent / "../public/linknyc/linknyc.geojson"
 FILTERABLE_LOCATION_TYPES = ["political", "country", "administrative_area_level_1", "administrative_area_level_2","locality","sublocality","neighborhood","postal_code"]
+NEGATIVE_ALIAS_TTL = timedelta(days=14)
+"""How long a location string that failed to geocode is skipped before it is retried."""
+EXTRACTION_CACHE_MAX_ENTRIES = 20000
+"""Maximum number of LLM extraction results kept in the extraction cache."""
+NEAR_DUPLICATE_MAX_ENTRIES = 200000
+"""Maximum number of articles kept in the near-duplicate index, at roughly 250 bytes each."""
+BATCH_JOB_DIRECTORY = "batch_jobs"
+"""Directory in the cache holding the request, response and article files of each batch extraction job."""
 Hash = str
 PlaceId = str
 
@@ -35,6 +45,15 @@ class LocationAliasDefinition(TypedDict):
     alias: str
     place_id: PlaceId
     geo_boundary_hash: Optional[str]
+    canonical_key: NotRequired[Optional[str]]
+
+class NegativeLocationAliasDefinition(TypedDict):
+    """Location name that geocoded to nothing usable for a given geo boundary, and when that was found."""
+    alias: str
+    geo_boundary_hash: Optional[str]
+    reason: str
+    cached_at: str
+    canonical_key: NotRequired[Optional[str]]
 
 class GeocodedLocation(TypedDict):
     lat: float
@@ -56,6 +75,28 @@ class Feed(OptionalGeoBoundaries):
     name: str
     url: str
 
+class FeedValidatorsDefinition(TypedDict, total=False):
+    """HTTP cache validators from a feed's last full response, sent back to allow a 304."""
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+class BatchJobDefinition(TypedDict):
+    """State of a deferred batch extraction job, kept in the cache until its articles are written."""
+    job_id: str
+    created_at: str
+    model: str
+    status: str
+    """"pending" until submitted, "submitted" while the Batch API works on it, then "completed" once
+    its responses file is in the job directory, or "failed" if the batch ended without output."""
+    batch_id: Optional[str]
+    requests: int
+    articles: int
+
+class ValidationStateDefinition(TypedDict):
+    """High-water mark of a table at its last clean validation: the `created_at` and ID of its newest row."""
+    created_at: Optional[str]
+    id: Optional[str]
+
 class FeedItem(TypedDict, total=False):
     title: Optional[str]
     link: Optional[str]
@@ -65,6 +106,8 @@ class FeedItem(TypedDict, total=False):
     fullText: Optional[bool]
     content: Optional[str]
     feed: Optional[Feed]
+    extraction_key: Optional[str]
+    """Extraction cache key of the article's request in a batch job, for articles queued in one."""
 
 GeocodedLocations = Dict[str, PlaceId | None]
 """Associates string locations with their Google Maps Place IDs, or None."""
@@ -72,6 +115,8 @@ GeocodedLocations = Dict[str, PlaceId | None]
 class CustomFeedItem(TypedDict):
     item: FeedItem
     locations: GeocodedLocations
+    canonical_keys: NotRequired[Dict[str, str]]
+    """Canonical address key of each location string whose structured fields are known."""
 
 
 
@@ -91,6 +136,22 @@ class LLMConstrainedAddress(TypedDict):
 class LLMConstrainedOutput(BaseModel):
     locations: List[Union[LLMConstrainedAddress, LLMConstrainedPOI]]
 
+class LLMPackedArticle(BaseModel):
+    """The locations of one article of a packed extraction request, under the id it was sent with."""
+    article_id: str
+    locations: List[Union[LLMConstrainedAddress, LLMConstrainedPOI]]
+
+class LLMPackedOutput(BaseModel):
+    articles: List[LLMPackedArticle]
+
+class GeocodedCandidate(TypedDict):
+    """A location string's geocoding result, held back until it has been checked against its feed's boundaries."""
+    alias: str
+    canonical_key: Optional[str]
+    location: LocationsDefinition
+    geo_boundaries: Optional[OptionalGeoBoundaries]
+
 class GeocodingResultDefinition(TypedDict):
     articles: List[CustomFeedItem]
-    new_geocoded_full_locations: List[LocationsDefinition]
\ No newline at end of file
+    new_geocoded_full_locations: List[LocationsDefinition]
+    accepted_candidates: List[GeocodedCandidate]
\ No newline at end of file
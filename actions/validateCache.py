@@ -1,156 +1,272 @@
 #!/usr/bin/env python3
-import os
 import sys
-import json
-from typing import List, Set, TypedDict
-from supabase import create_client, Client
+from typing import Dict, List, Optional, Set, TypedDict
+from supabase import Client
 import argparse
 
 from CacheManager import CacheManager
-from types_consts import CACHE_DIRECTORY
+from db_io import (
+    DIGEST_BUCKETS,
+    HASH_KEY_PARTITIONS,
+    compute_bucket_digests,
+    get_bucket_digests,
+    get_latest_row,
+    get_supabase_client,
+    id_bucket,
+    iter_bucket_ids,
+    iter_rows_by_key,
+    iter_rows_since,
+    iter_table_rows_concurrently,
+)
+from ids import compact_relation, to_compact_hash
+from types_consts import ValidationStateDefinition
+
+HASH_KEY_FIELDS = {"uuid3", "id"}
+"""ID fields holding feedParser.hash values, which can be scanned in parallel by leading character
+and may still be in the legacy decimal format."""
+
+RELATION_COLUMNS = "id,article_uuid,place_id,location_name"
 
 class ValidationResults(TypedDict):
     missing_in_cache: int
     missing_in_db: int
     total_cache: int
-    total_db: int
+    total_db: Optional[int]
     sample_missing_in_cache: List[str]
     sample_missing_in_db: List[str]
 
-def get_server_data_recursive(supabase: Client, table: str, field: str, index: int = 0, limit: int = 1000) -> Set[str]:
-    """Recursively get all IDs from a table in the database."""
-    response = supabase.table(table).select(field).range(index, index + limit).execute()
-    result = {item[field] for item in response.data}
-    
-    if len(response.data) == limit:
-        result.update(get_server_data_recursive(supabase, table, field, index + limit, limit))
-    
-    return result
+class Drift(TypedDict):
+    """IDs that differ between the cache and the database, found by incremental validation."""
+    missing_in_cache: Set[str]
+    missing_in_db: Set[str]
+    new_rows: Dict[str, dict]
+    mark: Optional[ValidationStateDefinition]
+    scanned_all: bool
 
-def validate_cache_against_db(table: str, id_field: str, cache_file: str) -> ValidationResults:
-    """Compare the cache with the database for a specific table."""
-    supabase_url = os.getenv("SUPABASE_URL") or ""
-    supabase_key = os.getenv("SUPABASE_SER_KEY") or ""
-    supabase = create_client(supabase_url, supabase_key)
-    
-    # Get IDs from database
-    db_ids = get_server_data_recursive(supabase, table, id_field)
-    
-    # Get IDs from cache
-    cache_mgr = CacheManager()
-    cache_file_path = CACHE_DIRECTORY / cache_file
-    if not cache_file_path.exists():
+def compact_row_id(table: str, id_field: str, row: dict) -> str:
+    """Get a row's ID as a compact hash, so that rows still in the legacy format match the cache."""
+    if table == "location_article_relations":
+        return compact_relation(row)[id_field]  # type: ignore
+    if id_field in HASH_KEY_FIELDS:
+        return to_compact_hash(row[id_field])
+    return row[id_field]
+
+def get_server_ids(supabase: Client, table: str, field: str) -> Set[str]:
+    """Get all IDs from a table in the database."""
+    boundaries = HASH_KEY_PARTITIONS if field in HASH_KEY_FIELDS else ()
+    # Legacy relation IDs are recomputed from the article and place, so those have to be fetched too
+    columns = "id,article_uuid,place_id" if table == "location_article_relations" else field
+    return {compact_row_id(table, field, row) for row in iter_table_rows_concurrently(supabase, table, columns, field, boundaries)}
+
+def get_cache_ids(cache_mgr: CacheManager, id_field: str, cache_file: str) -> Optional[Set[str]]:
+    """Get all IDs from a cache file, or None if it is missing or has an invalid format."""
+    if not cache_mgr.has_records(cache_file):
         print(f"Cache file {cache_file} does not exist. This will be treated as a discrepancy.")
-        return {
-            "missing_in_cache": len(db_ids),  # All database entries are missing from cache
-            "missing_in_db": 0,
-            "total_cache": 0,
-            "total_db": len(db_ids),
-            "sample_missing_in_cache": list(db_ids)[:10],
-            "sample_missing_in_db": []
-        }
-    
-    with open(cache_file_path, "r", encoding="utf-8") as f:
-        cache_data = json.load(f)
-    
+        return None
+
+    cache_data = cache_mgr.load_records(cache_file)
+
     # Simple arrays need to be converted to sets of IDs
     if isinstance(cache_data, list) and all(isinstance(item, str) for item in cache_data):
-        cache_ids = set(cache_data)
+        return {to_compact_hash(item) for item in cache_data} if id_field in HASH_KEY_FIELDS else set(cache_data)
     # For complex objects, extract the ID field
-    elif isinstance(cache_data, list) and all(isinstance(item, dict) for item in cache_data):
-        cache_ids = {item.get(id_field) for item in cache_data if id_field in item}
-    else:
-        print(f"Cache file {cache_file} has invalid format. This will be treated as a discrepancy.")
-        return {
-            "missing_in_cache": len(db_ids),  # All database entries are missing from cache
-            "missing_in_db": 0,
-            "total_cache": 0,
-            "total_db": len(db_ids),
-            "sample_missing_in_cache": list(db_ids)[:10],
-            "sample_missing_in_db": []
-        }
-    
-    # Find differences
-    missing_in_cache = db_ids - cache_ids
-    missing_in_db = cache_ids - db_ids
-    
-    # Get samples for reporting
-    sample_missing_in_cache = list(missing_in_cache)[:10]
-    sample_missing_in_db = list(missing_in_db)[:10]
-    
+    if isinstance(cache_data, list) and all(isinstance(item, dict) for item in cache_data):
+        return {compact_relation(item).get(id_field) for item in cache_data if id_field in item}
+
+    print(f"Cache file {cache_file} has invalid format. This will be treated as a discrepancy.")
+    return None
+
+def summarize(missing_in_cache: Set[str], missing_in_db: Set[str], total_cache: int, total_db: Optional[int]) -> ValidationResults:
     return {
         "missing_in_cache": len(missing_in_cache),
         "missing_in_db": len(missing_in_db),
-        "total_cache": len(cache_ids),
-        "total_db": len(db_ids),
-        "sample_missing_in_cache": sample_missing_in_cache,
-        "sample_missing_in_db": sample_missing_in_db
+        "total_cache": total_cache,
+        "total_db": total_db,
+        "sample_missing_in_cache": list(missing_in_cache)[:10],
+        "sample_missing_in_db": list(missing_in_db)[:10]
     }
 
-def reconcile_cache_with_db(table: str, id_field: str, cache_file: str) -> None:
-    """Update the cache to match the database."""
-    supabase_url = os.getenv("SUPABASE_URL") or ""
-    supabase_key = os.getenv("SUPABASE_SER_KEY") or ""
-    supabase = create_client(supabase_url, supabase_key)
-    
+def validate_cache_against_db(table: str, id_field: str, cache_file: str) -> ValidationResults:
+    """Compare the cache with the database for a specific table, downloading every ID."""
+    supabase = get_supabase_client()
+
     # Get IDs from database
-    db_ids = get_server_data_recursive(supabase, table, id_field)
-    
+    db_ids = get_server_ids(supabase, table, id_field)
+
+    # Get IDs from cache
+    cache_ids = get_cache_ids(CacheManager(), id_field, cache_file)
+    if cache_ids is None:
+        # All database entries are missing from cache
+        return summarize(db_ids, set(), 0, len(db_ids))
+
+    # Find differences
+    return summarize(db_ids - cache_ids, cache_ids - db_ids, len(cache_ids), len(db_ids))
+
+def reconcile_cache_with_db(table: str, id_field: str, cache_file: str) -> None:
+    """Update the cache to match the database, downloading every row."""
+    supabase = get_supabase_client()
+
     # Update the cache file
     cache_mgr = CacheManager()
-    cache_file_path = CACHE_DIRECTORY / cache_file
-    
+
     if table == "articles":
-        cache_mgr.save_seen_articles(list(db_ids))
+        cache_mgr.save_seen_articles(get_server_ids(supabase, table, id_field))
     elif table == "locations":
-        cache_mgr.save_seen_locations(list(db_ids))
+        cache_mgr.save_seen_locations(get_server_ids(supabase, table, id_field))
     elif table == "location_article_relations":
         # For complex objects, need to get the full data from DB
-        response = supabase.table(table).select("*").execute()
-        cache_mgr.save_location_article_relations(response.data)
-    
+        cache_mgr.save_location_article_relations(iter_table_rows_concurrently(supabase, table, RELATION_COLUMNS, id_field, HASH_KEY_PARTITIONS))
+
     print(f"Cache file {cache_file} updated to match the database.")
 
+def find_drift(supabase: Client, table: str, id_field: str, cache_ids: Set[str], mark: Optional[ValidationStateDefinition]) -> Drift:
+    """Find the IDs that differ between the cache and the database without downloading every ID.
+
+    First fetches the rows created since the table's high-water mark, which covers rows added by
+    other runs. Then compares per-bucket digests of the IDs on each side, and downloads the IDs of
+    only the buckets that still differ. Falls back to the new rows alone if the database doesn't
+    have the digest functions."""
+    columns = f"created_at,{RELATION_COLUMNS}" if table == "location_article_relations" else f"created_at,{id_field}"
+
+    new_rows: Dict[str, dict] = {}
+    if mark and mark["created_at"]:
+        for row in iter_rows_since(supabase, table, columns, id_field, mark["created_at"], mark["id"]):
+            mark = {"created_at": row["created_at"], "id": row[id_field]}
+            new_rows[compact_row_id(table, id_field, row)] = row
+    else:
+        latest = get_latest_row(supabase, table, columns, id_field)
+        mark = {"created_at": latest["created_at"], "id": latest[id_field]} if latest else None
+
+    missing_in_cache = set(new_rows) - cache_ids
+    missing_in_db: Set[str] = set()
+    drift: Drift = {"missing_in_cache": missing_in_cache, "missing_in_db": missing_in_db, "new_rows": new_rows, "mark": mark, "scanned_all": False}
+
+    try:
+        db_digests = get_bucket_digests(supabase, table, id_field)
+    except Exception as e:
+        print(f"  (Bucket digests unavailable: {e})")
+        print("  (Only rows added since the last validation were checked. Run with --full for a complete check.)")
+        return drift
+
+    known_ids = cache_ids | missing_in_cache
+    cache_digests = compute_bucket_digests(known_ids)
+    mismatched = {bucket for bucket in db_digests.keys() | cache_digests.keys() if db_digests.get(bucket) != cache_digests.get(bucket)}
+    print(f"  Buckets differing: {len(mismatched)} of {len(db_digests.keys() | cache_digests.keys())}")
+
+    # When most of the table differs, e.g. a missing cache file, one full scan beats a scan per bucket
+    if len(mismatched) > DIGEST_BUCKETS // 2:
+        db_ids = get_server_ids(supabase, table, id_field)
+        missing_in_cache.update(db_ids - known_ids)
+        missing_in_db.update(known_ids - db_ids)
+        drift["scanned_all"] = True
+        return drift
+
+    buckets: Dict[int, Set[str]] = {bucket: set() for bucket in mismatched}
+    for row_id in known_ids:
+        bucket, _ = id_bucket(row_id)
+        if bucket in buckets:
+            buckets[bucket].add(row_id)
+    for bucket, bucket_ids in buckets.items():
+        db_ids = set(iter_bucket_ids(supabase, table, id_field, bucket))
+        if id_field in HASH_KEY_FIELDS:
+            db_ids = {to_compact_hash(row_id) for row_id in db_ids}
+        missing_in_cache.update(db_ids - bucket_ids)
+        missing_in_db.update(bucket_ids - db_ids)
+    # A new row deleted again since the delta scan
+    missing_in_cache -= missing_in_db
+
+    return drift
+
+def reconcile_drift(supabase: Client, cache_mgr: CacheManager, table: str, id_field: str, drift: Drift) -> None:
+    """Update the cache to match the database, changing only the IDs that differ."""
+    missing_in_cache, missing_in_db = drift["missing_in_cache"], drift["missing_in_db"]
+
+    if table == "articles":
+        seen_articles = [article_id for article_id in cache_mgr.load_seen_articles() if article_id not in missing_in_db]
+        cache_mgr.save_seen_articles(seen_articles + sorted(missing_in_cache))
+    elif table == "locations":
+        seen_locations = [place_id for place_id in cache_mgr.load_seen_locations() if place_id not in missing_in_db]
+        cache_mgr.save_seen_locations(seen_locations + sorted(missing_in_cache))
+    elif table == "location_article_relations":
+        # Rows found by the delta scan are already in hand; only the rest need fetching
+        to_fetch = sorted(missing_in_cache - drift["new_rows"].keys())
+        rows = [row for row_id, row in drift["new_rows"].items() if row_id in missing_in_cache]
+        rows.extend(iter_rows_by_key(supabase, table, RELATION_COLUMNS, id_field, to_fetch))
+        relations = [relation for relation in cache_mgr.load_location_article_relations() if relation.get(id_field) not in missing_in_db]
+        relations.extend(compact_relation({column: row[column] for column in RELATION_COLUMNS.split(",")}) for row in rows)  # type: ignore
+        cache_mgr.save_location_article_relations(relations)
+
+    print(f"Cache file for {table} updated to match the database ({len(missing_in_cache)} added, {len(missing_in_db)} removed).")
+
 def main() -> None:
     parser = argparse.ArgumentParser(description='Validate cache artifacts against the database')
     parser.add_argument('--reconcile', action='store_true', help='Update cache to match the database')
     parser.add_argument('--verbose', action='store_true', help='Print detailed results')
+    parser.add_argument('--full', action='store_true', help='Download and compare every ID instead of only the changes since the last validation')
+    parser.add_argument('--migrate-ids', action='store_true', help='Rewrite cache files that still have legacy decimal IDs with compact hashes, then exit')
     args = parser.parse_args()
-    
+
+    if args.migrate_ids:
+        counts = CacheManager().migrate_compact_ids()
+        for cache_file, count in counts.items():
+            print(f"Rewrote {count} records in {cache_file} with compact IDs.")
+        if not counts:
+            print("All cache files already use compact IDs.")
+        return
+
     # Define validation tasks
     tasks = [
         {"table": "articles", "id_field": "uuid3", "cache_file": "articles.json"},
         {"table": "locations", "id_field": "place_id", "cache_file": "locations.json"},
         {"table": "location_article_relations", "id_field": "id", "cache_file": "location_article_relations.json"}
     ]
-    
+
     any_discrepancies = False
-    
+    supabase = get_supabase_client()
+    cache_mgr = CacheManager()
+    validation_state = cache_mgr.load_validation_state()
+
     for task in tasks:
         print(f"\nValidating {task['table']}...")
-        results = validate_cache_against_db(task["table"], task["id_field"], task["cache_file"])
-        
-        print(f"  Total in database: {results['total_db']}")
+        drift: Optional[Drift] = None
+        if args.full:
+            results = validate_cache_against_db(task["table"], task["id_field"], task["cache_file"])
+        else:
+            cache_ids = get_cache_ids(cache_mgr, task["id_field"], task["cache_file"]) or set()
+            drift = find_drift(supabase, task["table"], task["id_field"], cache_ids, validation_state.get(task["table"]))
+            results = summarize(drift["missing_in_cache"], drift["missing_in_db"], len(cache_ids), None)
+
+        if results['total_db'] is not None:
+            print(f"  Total in database: {results['total_db']}")
         print(f"  Total in cache: {results['total_cache']}")
         print(f"  Missing in cache: {results['missing_in_cache']}")
         print(f"  Missing in database: {results['missing_in_db']}")
-        
-        if results['missing_in_cache'] > 0 or results['missing_in_db'] > 0:
+
+        in_sync = results['missing_in_cache'] == 0 and results['missing_in_db'] == 0
+        if not in_sync:
             any_discrepancies = True
             if args.verbose:
                 if results['sample_missing_in_cache']:
                     print("\n  Sample items missing in cache:")
                     for item in results['sample_missing_in_cache']:
                         print(f"    - {item}")
-                
+
                 if results['sample_missing_in_db']:
                     print("\n  Sample items missing in database:")
                     for item in results['sample_missing_in_db']:
                         print(f"    - {item}")
-            
+
             if args.reconcile:
-                reconcile_cache_with_db(task["table"], task["id_field"], task["cache_file"])
-    
+                if drift is None or drift["scanned_all"]:
+                    reconcile_cache_with_db(task["table"], task["id_field"], task["cache_file"])
+                else:
+                    reconcile_drift(supabase, cache_mgr, task["table"], task["id_field"], drift)
+
+        # Only move the high-water mark past rows the cache is known to have
+        if drift is not None and drift["mark"] and (in_sync or args.reconcile):
+            validation_state[task["table"]] = drift["mark"]
+            cache_mgr.save_validation_state(validation_state)
+
     if any_discrepancies and not args.reconcile:
         print("\nDiscrepancies found. Run with --reconcile to update the cache.")
         sys.exit(1)
@@ -160,4 +276,4 @@ def main() -> None:
         print("\nCache has been reconciled with the database.")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
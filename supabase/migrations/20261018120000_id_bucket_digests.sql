@@ -0,0 +1,63 @@
+-- Order-independent digests over hash buckets of a table's IDs, used by actions/validateCache.py
+-- to find drift between the cache and the database without downloading every ID.
+--
+-- Each ID is assigned to bucket (first 32 bits of md5(id)) mod bucket_count, and each bucket's
+-- digest is the sum of the next 60 bits of md5(id) over its IDs, so it doesn't depend on row order.
+-- The digest is returned as text so clients don't lose precision parsing it as a JSON number.
+
+CREATE OR REPLACE FUNCTION "public"."id_bucket_digests"("table_name" "text", "id_field" "text", "bucket_count" integer) RETURNS TABLE("bucket" integer, "row_count" bigint, "digest" "text")
+    LANGUAGE "plpgsql" STABLE SECURITY DEFINER
+    SET "search_path" TO 'public'
+    AS $_$
+begin
+    IF table_name NOT IN ('articles', 'locations', 'location_article_relations') THEN
+        RAISE EXCEPTION 'id_bucket_digests: unsupported table %', table_name;
+    END IF;
+
+    return query execute format(
+        'SELECT ((''x'' || substr(md5(%1$I), 1, 8))::bit(32)::bigint %% $1)::integer,
+                count(*)::bigint,
+                sum((''x'' || substr(md5(%1$I), 9, 15))::bit(60)::bigint::numeric)::text
+         FROM %2$I
+         WHERE %1$I IS NOT NULL
+         GROUP BY 1',
+        id_field, table_name
+    ) USING bucket_count;
+end;
+$_$;
+
+
+ALTER FUNCTION "public"."id_bucket_digests"("table_name" "text", "id_field" "text", "bucket_count" integer) OWNER TO "postgres";
+
+
+CREATE OR REPLACE FUNCTION "public"."id_bucket_ids"("table_name" "text", "id_field" "text", "bucket_count" integer, "bucket" integer, "after" "text" DEFAULT NULL) RETURNS TABLE("id" "text")
+    LANGUAGE "plpgsql" STABLE SECURITY DEFINER
+    SET "search_path" TO 'public'
+    AS $_$
+begin
+    IF table_name NOT IN ('articles', 'locations', 'location_article_relations') THEN
+        RAISE EXCEPTION 'id_bucket_ids: unsupported table %', table_name;
+    END IF;
+
+    return query execute format(
+        'SELECT %1$I::text
+         FROM %2$I
+         WHERE %1$I IS NOT NULL
+           AND (''x'' || substr(md5(%1$I), 1, 8))::bit(32)::bigint %% $1 = $2
+           AND ($3 IS NULL OR %1$I COLLATE "C" > $3)
+         ORDER BY %1$I COLLATE "C"
+         LIMIT 1000',
+        id_field, table_name
+    ) USING bucket_count, bucket, after;
+end;
+$_$;
+
+
+ALTER FUNCTION "public"."id_bucket_ids"("table_name" "text", "id_field" "text", "bucket_count" integer, "bucket" integer, "after" "text") OWNER TO "postgres";
+
+
+REVOKE ALL ON FUNCTION "public"."id_bucket_digests"("table_name" "text", "id_field" "text", "bucket_count" integer) FROM PUBLIC, "anon", "authenticated";
+GRANT ALL ON FUNCTION "public"."id_bucket_digests"("table_name" "text", "id_field" "text", "bucket_count" integer) TO "service_role";
+
+REVOKE ALL ON FUNCTION "public"."id_bucket_ids"("table_name" "text", "id_field" "text", "bucket_count" integer, "bucket" integer, "after" "text") FROM PUBLIC, "anon", "authenticated";
+GRANT ALL ON FUNCTION "public"."id_bucket_ids"("table_name" "text", "id_field" "text", "bucket_count" integer, "bucket" integer, "after" "text") TO "service_role";
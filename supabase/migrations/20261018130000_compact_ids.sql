@@ -0,0 +1,52 @@
+-- Converts article and location-article relation IDs from legacy hashes (a SHA-256 as a ~77-digit
+-- decimal string) to compact hashes (the first 128 bits of the same SHA-256 as 32 hex characters).
+-- See actions/ids.py. Articles convert exactly; relation IDs are recomputed from the converted
+-- article ID and the place ID, since they hashed the legacy article ID.
+
+CREATE OR REPLACE FUNCTION "public"."legacy_hash_to_compact"("legacy" "text") RETURNS "text"
+    LANGUAGE "plpgsql" IMMUTABLE STRICT
+    AS $$
+declare
+    remaining numeric := legacy::numeric;
+    hex text := '';
+begin
+    FOR i IN 1..64 LOOP
+        hex := substr('0123456789abcdef', (mod(remaining, 16))::integer + 1, 1) || hex;
+        remaining := div(remaining, 16);
+    END LOOP;
+    return substr(hex, 1, 32);
+end;
+$$;
+
+
+ALTER FUNCTION "public"."legacy_hash_to_compact"("legacy" "text") OWNER TO "postgres";
+
+
+CREATE OR REPLACE FUNCTION "public"."compact_hash"("value" "text") RETURNS "text"
+    LANGUAGE "sql" IMMUTABLE STRICT
+    AS $$
+    SELECT substr(encode(sha256(convert_to(value, 'UTF8')), 'hex'), 1, 32);
+$$;
+
+
+ALTER FUNCTION "public"."compact_hash"("value" "text") OWNER TO "postgres";
+
+
+-- Rows written by feedParser after it switched to compact IDs, but before this migration ran, may
+-- duplicate legacy rows. Keep the compact row; relations follow their article through the cascade.
+DELETE FROM "public"."articles" a
+WHERE length(a."uuid3") > 32 AND a."uuid3" ~ '^[0-9]+$'
+  AND EXISTS (SELECT 1 FROM "public"."articles" b WHERE b."uuid3" = "public"."legacy_hash_to_compact"(a."uuid3"));
+
+-- location_article_relations.article_uuid follows through ON UPDATE CASCADE.
+UPDATE "public"."articles"
+SET "uuid3" = "public"."legacy_hash_to_compact"("uuid3")
+WHERE length("uuid3") > 32 AND "uuid3" ~ '^[0-9]+$';
+
+DELETE FROM "public"."location_article_relations" r
+WHERE length(r."id") > 32 AND r."id" ~ '^[0-9]+$'
+  AND EXISTS (SELECT 1 FROM "public"."location_article_relations" c WHERE c."id" = "public"."compact_hash"(r."article_uuid" || '-' || r."place_id"));
+
+UPDATE "public"."location_article_relations"
+SET "id" = "public"."compact_hash"("article_uuid" || '-' || "place_id")
+WHERE length("id") > 32 AND "id" ~ '^[0-9]+$' AND "article_uuid" IS NOT NULL AND "place_id" IS NOT NULL;